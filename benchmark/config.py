@@ -12,6 +12,15 @@ CACHE_DIR = DATASETS_DIR / "cache"
 UNIFIED_DIR = DATASETS_DIR / "unified"
 AMBIGUOUS_FILE = DATASETS_DIR / "ambiguous_questions.json"
 
+# Near-duplicate detection (see benchmark/datasets/dedup.py)
+DUPLICATES_REPORT_FILE = UNIFIED_DIR / "duplicates.json"
+EXCLUSIONS_FILE = UNIFIED_DIR / "exclusions.json"
+# Question banks outside the benchmark checked for contamination
+REFERENCE_QUESTION_FILES = [PROJECT_ROOT / "Code" / "mcq.json"]
+DEDUP_NUM_PERM = 128        # MinHash permutations per signature
+DEDUP_BANDS = 16            # LSH bands (rows per band = NUM_PERM / BANDS)
+DEDUP_THRESHOLD = 0.8       # Estimated Jaccard at which two items are duplicates
+
 # Results paths
 RESULTS_DIR = BENCHMARK_DIR / "results"
 RAW_RESULTS_DIR = RESULTS_DIR / "raw"
@@ -57,11 +66,30 @@ RATE_LIMITS = {
     "gemini": 30,
     "deepseek": 20,
     "xai": 10,
+    "local": 64,  # queue depth feeding the local batcher, not an API limit
 }
 
+# Local open-weights inference (vendor "local", see engine/api_clients.py).
+# Needs no API key but only runs when requested explicitly with --vendors local.
+KEYLESS_VENDORS = {"local"}
+LOCAL_MODEL_CACHE_DIR = os.environ.get("TRANSFORMERS_CACHE")
+LOCAL_MAX_BATCH = int(os.environ.get("LOCAL_MAX_BATCH_CBM", 8))
+LOCAL_BATCH_WINDOW = 0.05   # seconds to wait for more prompts before running a batch
+LOCAL_MAX_NEW_TOKENS = 48   # enough for {"answer": "A", "confidence": 0.85}
+LOCAL_NUM_THREADS = int(os.environ.get("LOCAL_NUM_THREADS_CBM", 0)) or None  # None = torch default
+
+# Hedged requests (see benchmark/engine/hedging.py; off unless --hedge is given)
+HEDGE_PERCENTILE = 0.95     # Send a duplicate once a call outlives this latency quantile
+HEDGE_MIN_SAMPLES = 20      # Completed calls per vendor before hedging starts
+HEDGE_MAX_FRACTION = 0.1    # At most this fraction of a vendor's requests are hedged
+HEDGE_WINDOW = 200          # Recent latencies kept per vendor
+
 # Supported datasets
 AVAILABLE_DATASETS = ["mmlu", "truthfulqa", "arc", "ambiguous"]
 
+# Persona and confidence prompt configurations (see benchmark/prompting/persona.py)
+PROMPTS_FILE = PROJECT_ROOT / "Code" / "prompts.json"
+
 # Confidence variants
 VARIANTS = [
     "discrete_combined",
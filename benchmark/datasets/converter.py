@@ -23,7 +23,7 @@ Unified format (compatible with existing mcq.json schema):
 import json
 from pathlib import Path
 from typing import Optional
-from benchmark.config import CACHE_DIR, UNIFIED_DIR
+from benchmark.config import CACHE_DIR, UNIFIED_DIR, DUPLICATES_REPORT_FILE, EXCLUSIONS_FILE
 
 OPTION_KEYS = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J"]
 
@@ -196,9 +196,20 @@ def convert_all(
     cache_dir: Path = CACHE_DIR,
     output_dir: Path = UNIFIED_DIR,
     mmlu_sample_size: Optional[int] = None,
+    dedup: bool = True,
 ):
-    """Convert all downloaded datasets to unified format."""
+    """Convert all downloaded datasets to unified format.
+
+    With dedup=True, near-duplicate detection runs afterwards and writes the
+    exclusion list applied by the benchmark loader (see datasets/dedup.py).
+    """
     convert_mmlu(cache_dir, output_dir, sample_size=mmlu_sample_size)
     convert_truthfulqa(cache_dir, output_dir)
     convert_arc(cache_dir, output_dir)
     print("All datasets converted to unified format.")
+
+    if dedup:
+        from benchmark.datasets.dedup import deduplicate
+        deduplicate(unified_dir=output_dir,
+                    report_file=output_dir / DUPLICATES_REPORT_FILE.name,
+                    exclusions_file=output_dir / EXCLUSIONS_FILE.name)
@@ -0,0 +1,306 @@
+"""Near-duplicate and contamination detection across unified datasets.
+
+Questions are normalised (question + option texts, lowercased, punctuation
+stripped), shingled into word 3-grams and reduced to MinHash signatures.
+Locality-sensitive hashing over signature bands yields candidate pairs, so the
+cost grows with the number of questions rather than the number of pairs.
+Candidates are confirmed by estimated Jaccard similarity and merged into
+clusters with union-find.
+
+Outputs (both in the unified directory):
+  duplicates.json  - cluster report (members, similarity, cross-dataset flag)
+  exclusions.json  - question ids the benchmark loader skips
+
+Within a cluster one benchmark question is kept (by DATASET_PRIORITY, then id)
+and the rest are excluded. Clusters that contain a reference question (e.g.
+Code/mcq.json) are contamination: every benchmark member is excluded.
+"""
+import json
+import re
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmark.config import (
+    UNIFIED_DIR, DUPLICATES_REPORT_FILE, EXCLUSIONS_FILE, REFERENCE_QUESTION_FILES,
+    DEDUP_NUM_PERM, DEDUP_BANDS, DEDUP_THRESHOLD,
+)
+
+# Which copy of a duplicate to keep: earlier datasets win
+DATASET_PRIORITY = ["ambiguous", "arc", "truthfulqa", "mmlu"]
+
+SHINGLE_SIZE = 3
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def normalize_question(question: Dict) -> str:
+    """Canonical text for a question: stem plus option texts, lowercased,
+    punctuation removed and whitespace collapsed. Option keys are dropped so
+    that relabelled (a/b/c vs A/B/C) copies still match."""
+    parts = [str(question.get("question", ""))]
+    parts.extend(str(opt.get("text", "")) for opt in question.get("options", []))
+    text = " ".join(parts).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the word n-grams in text (deterministic across runs)."""
+    words = text.split()
+    if len(words) < size:
+        grams = [" ".join(words)] if words else [""]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.array(sorted({zlib.crc32(g.encode("utf-8")) for g in grams}), dtype=np.uint64)
+
+
+class MinHasher:
+    """Vectorised MinHash over a fixed family of universal hash functions."""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, 2 ** 31 - 1, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, 2 ** 31 - 1, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        """MinHash signature (num_perm,) uint32 of a set of shingle hashes."""
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return np.bitwise_and(permuted, _MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def _load_question_file(path: Path) -> List[Dict]:
+    """Load questions from a unified file or an mcq.json-style reference bank."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data
+    return data.get("questions", [])
+
+
+def collect_questions(
+    unified_dir: Path = UNIFIED_DIR,
+    reference_files: Optional[List[Path]] = None,
+) -> List[Dict]:
+    """Gather benchmark questions plus reference questions for comparison.
+
+    Returns a list of dicts with keys: id, dataset, reference, text, preview.
+    Reference ids are prefixed with the file stem (e.g. "mcq_12") so they
+    never collide with benchmark ids.
+    """
+    ref_files = REFERENCE_QUESTION_FILES if reference_files is None else reference_files
+    items = []
+
+    for path in sorted(unified_dir.glob("*.json")):
+        if path.name in (DUPLICATES_REPORT_FILE.name, EXCLUSIONS_FILE.name):
+            continue
+        for q in _load_question_file(path):
+            items.append({
+                "id": str(q.get("id", "")),
+                "dataset": q.get("dataset", path.stem),
+                "reference": False,
+                "text": normalize_question(q),
+                "preview": str(q.get("question", ""))[:120],
+            })
+
+    for path in ref_files:
+        path = Path(path)
+        if not path.exists():
+            continue
+        for q in _load_question_file(path):
+            items.append({
+                "id": f"{path.stem}_{q.get('id', '')}",
+                "dataset": path.stem,
+                "reference": True,
+                "text": normalize_question(q),
+                "preview": str(q.get("question", ""))[:120],
+            })
+
+    return items
+
+
+def find_duplicate_clusters(
+    texts: List[str],
+    num_perm: int = DEDUP_NUM_PERM,
+    bands: int = DEDUP_BANDS,
+    threshold: float = DEDUP_THRESHOLD,
+) -> List[Dict]:
+    """Cluster near-duplicate texts with MinHash LSH.
+
+    Args:
+        texts: Normalised texts (see normalize_question).
+        num_perm: MinHash signature length; must be divisible by bands.
+        bands: Number of LSH bands. More bands = higher recall at low similarity.
+        threshold: Minimum estimated Jaccard similarity to merge two items.
+
+    Returns:
+        List of clusters, each {"members": [indices], "similarity": min pairwise
+        estimate that joined the cluster}. Singletons are omitted.
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+    n = len(texts)
+    if n < 2:
+        return []
+
+    hasher = MinHasher(num_perm)
+    signatures = np.empty((n, num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        signatures[i] = hasher.signature(shingle_hashes(text))
+
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    rows = num_perm // bands
+    checked = set()
+    join_similarity: Dict[int, float] = {}
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_sigs = signatures[:, band * rows:(band + 1) * rows]
+        for i in range(n):
+            buckets[band_sigs[i].tobytes()].append(i)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            # Every pair in the bucket is a candidate: a near-duplicate pair can
+            # share a bucket with an unrelated first member. Pairs already in
+            # one cluster are skipped, so a bucket of many copies stays cheap.
+            for pos, a in enumerate(members):
+                for b in members[pos + 1:]:
+                    ra, rb = find(a), find(b)
+                    if ra == rb or (a, b) in checked:
+                        continue
+                    checked.add((a, b))
+                    sim = float(np.mean(signatures[a] == signatures[b]))
+                    if sim < threshold:
+                        continue
+                    parent[rb] = ra
+                    join_similarity[ra] = min(
+                        sim, join_similarity.get(ra, 1.0), join_similarity.pop(rb, 1.0))
+
+    groups = defaultdict(list)
+    for i in range(n):
+        groups[find(i)].append(i)
+
+    return [
+        {"members": members, "similarity": round(join_similarity.get(root, 1.0), 4)}
+        for root, members in groups.items()
+        if len(members) > 1
+    ]
+
+
+def _keeper(members: List[Dict]) -> Optional[Dict]:
+    """Pick the benchmark question to keep from a cluster."""
+    candidates = [m for m in members if not m["reference"]]
+    if not candidates:
+        return None
+
+    def rank(m):
+        ds = m["dataset"]
+        prio = DATASET_PRIORITY.index(ds) if ds in DATASET_PRIORITY else len(DATASET_PRIORITY)
+        return (prio, m["id"])
+
+    return min(candidates, key=rank)
+
+
+def deduplicate(
+    unified_dir: Path = UNIFIED_DIR,
+    reference_files: Optional[List[Path]] = None,
+    report_file: Path = DUPLICATES_REPORT_FILE,
+    exclusions_file: Path = EXCLUSIONS_FILE,
+    threshold: float = DEDUP_THRESHOLD,
+    num_perm: int = DEDUP_NUM_PERM,
+    bands: int = DEDUP_BANDS,
+    exclude_contaminated: bool = True,
+) -> Dict:
+    """Find near-duplicates across the unified datasets and write the report
+    and exclusion list.
+
+    Args:
+        unified_dir: Directory of unified dataset JSON files.
+        reference_files: Extra question banks checked for contamination
+            (default: config REFERENCE_QUESTION_FILES).
+        report_file: Where to write the duplicate-cluster report.
+        exclusions_file: Where to write the exclusion list read by the loader.
+        threshold: Minimum estimated Jaccard similarity for a duplicate.
+        num_perm: MinHash signature length.
+        bands: Number of LSH bands.
+        exclude_contaminated: Exclude every benchmark question that matches a
+            reference question (otherwise only the usual duplicate rule applies).
+
+    Returns:
+        Summary dict with counts.
+    """
+    items = collect_questions(unified_dir, reference_files)
+    clusters = find_duplicate_clusters(
+        [it["text"] for it in items], num_perm=num_perm, bands=bands, threshold=threshold,
+    )
+
+    excluded = set()
+    report = []
+    for cluster in clusters:
+        members = [items[i] for i in cluster["members"]]
+        contaminated = any(m["reference"] for m in members)
+        keep = None if (contaminated and exclude_contaminated) else _keeper(members)
+
+        for m in members:
+            if not m["reference"] and m is not keep:
+                excluded.add(m["id"])
+
+        report.append({
+            "similarity": cluster["similarity"],
+            "datasets": sorted({m["dataset"] for m in members}),
+            "cross_dataset": len({m["dataset"] for m in members}) > 1,
+            "contaminated": contaminated,
+            "kept": keep["id"] if keep else None,
+            "members": [
+                {"id": m["id"], "dataset": m["dataset"], "question": m["preview"]}
+                for m in members
+            ],
+        })
+
+    report.sort(key=lambda c: (-len(c["members"]), c["members"][0]["id"]))
+    params = {"threshold": threshold, "num_perm": num_perm, "bands": bands,
+              "shingle_size": SHINGLE_SIZE}
+    generated = datetime.now().isoformat()
+
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump({"generated": generated, "params": params,
+                   "n_questions": len(items), "clusters": report}, f, indent=2)
+    with open(exclusions_file, "w", encoding="utf-8") as f:
+        json.dump({"generated": generated, "params": params,
+                   "excluded_ids": sorted(excluded)}, f, indent=2)
+
+    summary = {
+        "n_questions": len(items),
+        "n_clusters": len(report),
+        "n_cross_dataset": sum(1 for c in report if c["cross_dataset"]),
+        "n_contaminated": sum(1 for c in report if c["contaminated"]),
+        "n_excluded": len(excluded),
+    }
+    print(f"Dedup: {summary['n_clusters']} duplicate clusters "
+          f"({summary['n_cross_dataset']} cross-dataset, {summary['n_contaminated']} contaminated), "
+          f"{summary['n_excluded']} questions excluded -> {exclusions_file}")
+    return summary
+
+
+def load_exclusions(exclusions_file: Path = EXCLUSIONS_FILE) -> set:
+    """Return the set of excluded question ids (empty if no dedup has run)."""
+    if not exclusions_file.exists():
+        return set()
+    with open(exclusions_file, "r", encoding="utf-8") as f:
+        return set(json.load(f).get("excluded_ids", []))
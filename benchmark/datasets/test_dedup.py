@@ -0,0 +1,51 @@
+"""Unit tests for MinHash LSH duplicate clustering in dedup.py (no files)."""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from benchmark.datasets import dedup
+from benchmark.datasets.dedup import find_duplicate_clusters, normalize_question
+
+# Signatures of 8 values in 2 bands of 4 rows. All three share band 0; the two
+# near-duplicates differ in one value of band 1, so band 0 is their only bucket
+# and its first member is the unrelated text.
+SIGNATURES = {
+    "unrelated": [1, 1, 1, 1, 9, 9, 9, 9],
+    "dup one": [1, 1, 1, 1, 2, 3, 4, 5],
+    "dup two": [1, 1, 1, 1, 2, 3, 4, 6],
+}
+
+
+class FixedHasher:
+    def __init__(self, num_perm):
+        self.num_perm = num_perm
+
+    def signature(self, text):
+        return np.array(SIGNATURES[text], dtype=np.uint32)
+
+
+def test_pair_behind_an_unrelated_bucket_member(monkeypatch):
+    monkeypatch.setattr(dedup, "MinHasher", FixedHasher)
+    monkeypatch.setattr(dedup, "shingle_hashes", lambda text: text)
+    clusters = find_duplicate_clusters(list(SIGNATURES), num_perm=8, bands=2, threshold=0.8)
+    assert clusters == [{"members": [1, 2], "similarity": 0.875}]
+
+
+def test_near_duplicate_questions_cluster():
+    question = {
+        "question": "Which data structure gives constant time average lookups by key?",
+        "options": [{"key": "A", "text": "Hash table"}, {"key": "B", "text": "Linked list"},
+                    {"key": "C", "text": "Binary heap"}, {"key": "D", "text": "Sorted array"}],
+    }
+    relabelled = dict(question, options=[dict(o, key=o["key"].lower()) for o in question["options"]])
+    other = {"question": "What is the boiling point of water at sea level in Celsius?",
+             "options": [{"key": "A", "text": "100"}, {"key": "B", "text": "90"}]}
+    texts = [normalize_question(q) for q in (other, question, relabelled)]
+
+    clusters = find_duplicate_clusters(texts)
+    assert [c["members"] for c in clusters] == [[1, 2]]
+    assert find_duplicate_clusters(texts[:1]) == []
@@ -1,12 +1,19 @@
 """Async API clients for all supported LLM vendors.
 
-Supports: OpenAI, Claude, Gemini, DeepSeek, xAI (Grok).
+Supports: OpenAI, Claude, Gemini, DeepSeek, xAI (Grok), and local open-weights
+models run on CPU with transformers (vendor "local").
 All clients use a common interface for single-turn and multi-turn calls.
 """
 import aiohttp
 import asyncio
+import queue
+import re
+import threading
 from typing import List, Dict, Optional
-from benchmark.config import API_KEYS, ENDPOINTS
+from benchmark.config import (
+    API_KEYS, ENDPOINTS, LOCAL_MODEL_CACHE_DIR, LOCAL_MAX_BATCH,
+    LOCAL_BATCH_WINDOW, LOCAL_MAX_NEW_TOKENS, LOCAL_NUM_THREADS,
+)
 
 
 async def call_openai(
@@ -176,6 +183,222 @@ async def call_xai(
         return None
 
 
+OPTION_LETTERS = "ABCDEFGHIJ"
+# Generated text that ends right before the letter of a JSON answer
+_JSON_ANSWER_PREFIX = re.compile(r'"answer"\s*:\s*"?$')
+
+
+class LocalResponse(str):
+    """Response text from a local model, carrying option-letter log-probabilities.
+
+    option_logprobs maps each letter A-J to its log-probability at the step where
+    the model emitted its answer letter (None if no letter was generated there);
+    letters the tokenizer cannot emit as a single token are omitted.
+    """
+    option_logprobs: Optional[Dict[str, float]] = None
+
+
+class LocalBatchEngine:
+    """Serves one local model on CPU, batching concurrent prompts.
+
+    A single worker thread owns the model. Callers enqueue prompts; the worker
+    takes whatever is waiting (up to max_batch, after a short window) and runs
+    one padded generate() call per temperature. Prompts that arrive while a
+    batch is running form the next batch, so the model stays busy as long as
+    requests are queued.
+    """
+
+    def __init__(self, model_name: str, max_batch: int = LOCAL_MAX_BATCH,
+                 batch_window: float = LOCAL_BATCH_WINDOW,
+                 max_new_tokens: int = LOCAL_MAX_NEW_TOKENS,
+                 cache_dir: Optional[str] = LOCAL_MODEL_CACHE_DIR,
+                 num_threads: Optional[int] = LOCAL_NUM_THREADS):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_new_tokens = max_new_tokens
+        self._cache_dir = cache_dir
+        self._num_threads = num_threads
+        self._queue: "queue.Queue" = queue.Queue()
+        self._load_error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._worker, name=f"local-{model_name}", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self._num_threads:
+            torch.set_num_threads(self._num_threads)
+        print(f"Loading local model {self.model_name} (CPU)...")
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name, cache_dir=self._cache_dir)
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(self.model_name, cache_dir=self._cache_dir)
+        model.eval()
+        self._torch = torch
+        self._tokenizer = tokenizer
+        self._model = model
+        self._letter_ids = self._option_token_ids(tokenizer)
+
+    @staticmethod
+    def _option_token_ids(tokenizer) -> Dict[str, List[int]]:
+        """Single-token encodings of each option letter ("A" and " A").
+
+        Lowercase variants are left out: "a" is far more likely to be the
+        article than option A."""
+        ids = {}
+        for letter in OPTION_LETTERS:
+            tids = set()
+            for variant in (letter, " " + letter):
+                enc = tokenizer.encode(variant, add_special_tokens=False)
+                if len(enc) == 1:
+                    tids.add(enc[0])
+            ids[letter] = sorted(tids)
+        return ids
+
+    def _render(self, messages: List[Dict[str, str]]) -> str:
+        try:
+            return self._tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True)
+        except Exception:
+            return "\n".join(
+                f"[INST] {m['content']} [/INST]" if m["role"] == "user" else m["content"]
+                for m in messages
+            )
+
+    def _worker(self):
+        try:
+            self._load()
+        except Exception as e:
+            self._load_error = e
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=deadline))
+                    deadline = 0.0
+                except queue.Empty:
+                    break
+
+            if self._load_error is not None:
+                for _, _, loop, fut in batch:
+                    loop.call_soon_threadsafe(_set_future, fut, None, self._load_error)
+                continue
+
+            by_temp: Dict[float, list] = {}
+            for item in batch:
+                by_temp.setdefault(item[1], []).append(item)
+            for temperature, items in by_temp.items():
+                try:
+                    outputs = self._generate([self._render(m) for m, _, _, _ in items], temperature)
+                    for (_, _, loop, fut), out in zip(items, outputs):
+                        loop.call_soon_threadsafe(_set_future, fut, out, None)
+                except Exception as e:
+                    for _, _, loop, fut in items:
+                        loop.call_soon_threadsafe(_set_future, fut, None, e)
+
+    def _generate(self, prompts: List[str], temperature: float) -> List[LocalResponse]:
+        torch = self._torch
+        inputs = self._tokenizer(prompts, return_tensors="pt", padding=True)
+        gen_kwargs = {
+            "max_new_tokens": self.max_new_tokens,
+            "pad_token_id": self._tokenizer.pad_token_id,
+            "return_dict_in_generate": True,
+            "output_logits": True,
+        }
+        if temperature > 0:
+            gen_kwargs.update(do_sample=True, temperature=temperature)
+        else:
+            gen_kwargs.update(do_sample=False)
+
+        with torch.inference_mode():
+            out = self._model.generate(**inputs, **gen_kwargs)
+
+        prompt_len = inputs["input_ids"].shape[1]
+        generated = out.sequences[:, prompt_len:]
+        results = []
+        for row in range(generated.shape[0]):
+            tokens = generated[row].tolist()
+            text = self._tokenizer.decode(tokens, skip_special_tokens=True).strip()
+            response = LocalResponse(text)
+            response.option_logprobs = self._answer_logprobs(tokens, out.logits, row)
+            results.append(response)
+        return results
+
+    def _answer_logprobs(self, tokens: List[int], logits, row: int) -> Optional[Dict[str, float]]:
+        """Log-probabilities of each option letter at the answer position.
+
+        That is the first generated token for a bare-letter answer ("A"), or
+        the token right after '"answer": "' for JSON output. A letter anywhere
+        else (e.g. "A" starting a sentence) is not the answer."""
+        torch = self._torch
+        text = ""
+        for step, tid in enumerate(tokens[:len(logits)]):
+            raw = self._tokenizer.decode([tid])
+            piece = raw.strip().strip("\"'")
+            at_answer = _JSON_ANSWER_PREFIX.search(text) is not None
+            text += raw
+            if step > 0 and not at_answer:
+                continue
+            if len(piece) != 1 or piece not in OPTION_LETTERS:
+                if at_answer and raw.strip() != '"':
+                    return None
+                continue
+            logprobs = torch.log_softmax(logits[step][row].float(), dim=-1)
+            # Letters with no single-token encoding are left out (no finite value)
+            return {letter: round(torch.logsumexp(logprobs[tids], dim=0).item(), 4)
+                    for letter, tids in self._letter_ids.items() if tids}
+        return None
+
+    async def generate(self, messages: List[Dict[str, str]], temperature: float) -> LocalResponse:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((messages, float(temperature), loop, fut))
+        return await fut
+
+
+def _set_future(fut: asyncio.Future, result, error: Optional[Exception]):
+    if fut.done():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+_LOCAL_ENGINES: Dict[str, LocalBatchEngine] = {}
+_LOCAL_ENGINES_LOCK = threading.Lock()
+
+
+def get_local_engine(model: str) -> LocalBatchEngine:
+    """Get (loading on first use) the batch engine for a local model."""
+    with _LOCAL_ENGINES_LOCK:
+        if model not in _LOCAL_ENGINES:
+            _LOCAL_ENGINES[model] = LocalBatchEngine(model)
+        return _LOCAL_ENGINES[model]
+
+
+async def call_local(
+    session: aiohttp.ClientSession,
+    messages: List[Dict[str, str]],
+    model: str,
+    temperature: float,
+) -> Optional[str]:
+    """Run a local Hugging Face model on CPU and return a LocalResponse.
+
+    The session is unused; it is accepted for interface compatibility.
+    """
+    try:
+        return await get_local_engine(model).generate(messages, temperature)
+    except Exception as e:
+        print(f"Local model error ({model}): {e}")
+        return None
+
+
 # Vendor routing table
 VENDOR_CLIENTS = {
     "openai": call_openai,
@@ -183,6 +406,7 @@ VENDOR_CLIENTS = {
     "gemini": call_gemini,
     "deepseek": call_deepseek,
     "xai": call_xai,
+    "local": call_local,
 }
 
 
@@ -0,0 +1,189 @@
+"""Hedged (speculative) requests to cut vendor tail latency.
+
+If a call has not returned by the vendor's rolling p95 latency, a duplicate is
+issued and whichever finishes first wins; the other is cancelled. Hedges are
+only sent when the vendor's semaphore has a free slot and the per-vendor hedge
+budget (a fraction of all requests) is not exhausted, so hedging never exceeds
+the configured concurrency limits.
+
+Token usage is not returned by call_model, so wasted tokens are estimated from
+the prompt length of each cancelled duplicate (~4 characters per token).
+
+The latency window only holds primary-call times. When a hedge wins, the
+primary's time until it was cancelled is recorded, a lower bound on its true
+latency. Recording only winners would feed the fast side of every race back
+into the window, so the hedge threshold would creep down.
+"""
+import asyncio
+from collections import defaultdict, deque
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from benchmark.config import (
+    HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MAX_FRACTION, HEDGE_WINDOW,
+)
+from benchmark.engine.api_clients import call_model
+
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class HedgeStats:
+    """Per-vendor hedging counters."""
+    requests: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    skipped_no_capacity: int = 0
+    skipped_budget: int = 0
+    wasted_tokens_est: int = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedges / self.requests if self.requests else 0.0
+
+
+class LatencyTracker:
+    """Rolling window of completed-call latencies per vendor."""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, vendor: str, seconds: float):
+        self._samples[vendor].append(seconds)
+
+    def percentile(self, vendor: str, q: float) -> Optional[float]:
+        """q-quantile (0-1) of recent latencies, or None with no samples."""
+        samples = self._samples.get(vendor)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[idx]
+
+    def count(self, vendor: str) -> int:
+        return len(self._samples.get(vendor, ()))
+
+
+class HedgingPolicy:
+    """Decides when to hedge and issues hedged calls through call_model."""
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        max_hedge_fraction: float = HEDGE_MAX_FRACTION,
+        window: int = HEDGE_WINDOW,
+    ):
+        """
+        Args:
+            percentile: Latency quantile after which a duplicate is sent.
+            min_samples: Completed calls needed before a vendor is hedged.
+            max_hedge_fraction: Upper bound on hedges / requests per vendor.
+            window: Number of recent latencies kept per vendor.
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_fraction = max_hedge_fraction
+        self.latencies = LatencyTracker(window)
+        self.stats: Dict[str, HedgeStats] = defaultdict(HedgeStats)
+
+    def hedge_delay(self, vendor: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None while still warming up."""
+        if self.latencies.count(vendor) < self.min_samples:
+            return None
+        return self.latencies.percentile(vendor, self.percentile)
+
+    def _within_budget(self, vendor: str) -> bool:
+        stats = self.stats[vendor]
+        return stats.hedges + 1 <= self.max_hedge_fraction * stats.requests
+
+    async def call(
+        self,
+        session: aiohttp.ClientSession,
+        vendor: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        semaphore: asyncio.Semaphore,
+    ) -> Optional[str]:
+        """call_model with hedging. The caller must already hold one slot of
+        `semaphore`; a hedge takes a second slot only if one is free."""
+        loop = asyncio.get_running_loop()
+        stats = self.stats[vendor]
+        stats.requests += 1
+
+        start = loop.time()
+        primary = asyncio.ensure_future(call_model(session, vendor, messages, model, temperature))
+        delay = self.hedge_delay(vendor)
+
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done:
+                if semaphore.locked():
+                    stats.skipped_no_capacity += 1
+                elif not self._within_budget(vendor):
+                    stats.skipped_budget += 1
+                else:
+                    return await self._race(session, vendor, messages, model,
+                                            temperature, semaphore, primary, start)
+
+        result = await primary
+        if result is not None:
+            self.latencies.record(vendor, loop.time() - start)
+        return result
+
+    async def _race(self, session, vendor, messages, model, temperature,
+                    semaphore, primary, start) -> Optional[str]:
+        """Run a duplicate alongside `primary`; first successful answer wins."""
+        loop = asyncio.get_running_loop()
+        stats = self.stats[vendor]
+        stats.hedges += 1
+        prompt_tokens = sum(len(m["content"]) for m in messages) // CHARS_PER_TOKEN
+
+        async with semaphore:
+            hedge = asyncio.ensure_future(call_model(session, vendor, messages, model, temperature))
+            pending = {primary, hedge}
+            result = None
+            winner = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result() is not None:
+                        result, winner = task.result(), task
+                        break
+                if winner is not None:
+                    break
+
+            # Primary latency, censored at cancellation if the hedge won first
+            primary_seconds = loop.time() - start
+            primary_censored = primary in pending
+            for task in pending:
+                task.cancel()
+                stats.wasted_tokens_est += prompt_tokens
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if winner is primary or primary_censored:
+            self.latencies.record(vendor, primary_seconds)
+        if winner is hedge:
+            stats.hedge_wins += 1
+        return result
+
+    def summary(self) -> Dict[str, Dict]:
+        """Per-vendor hedging report (counts, hedge rate, wasted token estimate)."""
+        report = {}
+        for vendor, stats in sorted(self.stats.items()):
+            entry = asdict(stats)
+            entry["hedge_rate"] = round(stats.hedge_rate, 4)
+            entry["p95_latency"] = self.latencies.percentile(vendor, self.percentile)
+            report[vendor] = entry
+        return report
+
+    def print_summary(self):
+        for vendor, s in self.summary().items():
+            p95 = f"{s['p95_latency']:.2f}s" if s["p95_latency"] is not None else "n/a"
+            print(f"  Hedging {vendor}: {s['hedges']}/{s['requests']} hedged "
+                  f"({s['hedge_rate']*100:.1f}%), {s['hedge_wins']} won, "
+                  f"~{s['wasted_tokens_est']} wasted tokens, p95={p95}")
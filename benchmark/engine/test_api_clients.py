@@ -0,0 +1,72 @@
+"""Unit tests for option-letter log-probabilities of local models (no model load)."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+torch = pytest.importorskip("torch")
+
+from benchmark.engine.api_clients import LocalBatchEngine
+
+VOCAB = ["{", '"answer"', ":", ' "', '"', "A", "B", " C", "a", "}", "The", " answer", " is", "."]
+
+
+class VocabTokenizer:
+    def decode(self, tids):
+        return "".join(VOCAB[t] for t in tids)
+
+    def encode(self, text, add_special_tokens=False):
+        return [VOCAB.index(text)] if text in VOCAB else [0, 0]
+
+
+def engine():
+    eng = LocalBatchEngine.__new__(LocalBatchEngine)
+    eng._torch = torch
+    eng._tokenizer = VocabTokenizer()
+    eng._letter_ids = LocalBatchEngine._option_token_ids(eng._tokenizer)
+    return eng
+
+
+def answer_logprobs(pieces, favoured):
+    """Generated tokens `pieces`; step i's logits strongly favour VOCAB token favoured[i]."""
+    tokens = [VOCAB.index(p) for p in pieces]
+    logits = []
+    for token in favoured:
+        step = torch.zeros(1, len(VOCAB))
+        step[0, VOCAB.index(token)] = 10.0
+        logits.append(step)
+    return engine()._answer_logprobs(tokens, logits, 0)
+
+
+def best(logprobs):
+    return max(logprobs, key=logprobs.get)
+
+
+def test_letter_ids_are_case_sensitive():
+    ids = engine()._letter_ids
+    assert ids["A"] == [VOCAB.index("A")]
+    assert ids["C"] == [VOCAB.index(" C")]
+    assert ids["D"] == []
+
+
+def test_bare_letter_is_read_at_the_first_step():
+    logprobs = answer_logprobs(["B", "."], ["B", "A"])
+    assert best(logprobs) == "B"
+    assert "D" not in logprobs
+
+
+def test_json_answer_is_read_after_the_answer_key():
+    pieces = ["{", '"answer"', ":", ' "', "A", '"', "}"]
+    favoured = ["{", '"answer"', "B", ' "', "A", '"', "}"]
+    assert best(answer_logprobs(pieces, favoured)) == "A"
+
+
+def test_letters_outside_the_answer_position_are_ignored():
+    # "The answer is a." - neither the lowercase article nor a later letter counts
+    assert answer_logprobs(["The", " answer", " is", "a", "."], ["The"] * 5) is None
+    assert answer_logprobs(["The", " answer", " is", " C"], ["The"] * 4) is None
+    # A JSON answer position holding something other than a letter gives no result
+    assert answer_logprobs(["{", '"answer"', ":", ' "', "}", "A"], ["{"] * 6) is None
@@ -0,0 +1,100 @@
+"""Unit tests for hedged requests against a scripted mock vendor (no network)."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from benchmark.engine import hedging
+from benchmark.engine.hedging import HedgingPolicy
+
+MESSAGES = [{"role": "user", "content": "x" * 40}]
+
+
+class MockVendor:
+    """Stands in for call_model: the i-th call sleeps delays[i] and answers 'call i'."""
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.calls = 0
+        self.cancelled = []
+
+    async def __call__(self, session, vendor, messages, model, temperature):
+        i = self.calls
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delays[i])
+        except asyncio.CancelledError:
+            self.cancelled.append(i)
+            raise
+        return f"call {i}"
+
+
+@pytest.fixture
+def vendor(monkeypatch):
+    def install(delays):
+        mock = MockVendor(delays)
+        monkeypatch.setattr(hedging, "call_model", mock)
+        return mock
+    return install
+
+
+def run_calls(policy, n, slots=2):
+    async def main():
+        semaphore = asyncio.Semaphore(slots)
+        results = []
+        for _ in range(n):
+            async with semaphore:
+                results.append(await policy.call(None, "mock", MESSAGES, "m", 0.0, semaphore))
+        return results
+    return asyncio.run(main())
+
+
+def test_no_hedge_before_min_samples(vendor):
+    mock = vendor([0.01, 0.01, 0.2])
+    policy = HedgingPolicy(min_samples=3, max_hedge_fraction=1.0)
+    assert run_calls(policy, 3) == ["call 0", "call 1", "call 2"]
+    assert mock.calls == 3
+    assert policy.stats["mock"].hedges == 0
+    assert policy.hedge_delay("mock") is not None
+
+
+def test_slow_primary_is_hedged_and_cancelled(vendor):
+    # Two fast warm-up calls, then a slow primary that its hedge (call 3) beats
+    mock = vendor([0.01, 0.01, 1.0, 0.01])
+    policy = HedgingPolicy(percentile=0.95, min_samples=2, max_hedge_fraction=1.0)
+    assert run_calls(policy, 3) == ["call 0", "call 1", "call 3"]
+
+    stats = policy.stats["mock"]
+    assert (stats.requests, stats.hedges, stats.hedge_wins) == (3, 1, 1)
+    assert mock.cancelled == [2]
+    assert stats.wasted_tokens_est == 10
+
+
+def test_censored_primary_latency_is_recorded(vendor):
+    vendor([0.01, 0.01, 1.0, 0.05])
+    policy = HedgingPolicy(percentile=0.95, min_samples=2, max_hedge_fraction=1.0)
+    run_calls(policy, 3)
+
+    # The cancelled primary ran for the hedge delay plus the hedge's latency
+    assert policy.latencies.count("mock") == 3
+    assert policy.latencies.percentile("mock", 1.0) >= 0.05
+
+
+def test_no_hedge_without_a_free_slot(vendor):
+    mock = vendor([0.01, 0.01, 0.1])
+    policy = HedgingPolicy(min_samples=2, max_hedge_fraction=1.0)
+    assert run_calls(policy, 3, slots=1)[-1] == "call 2"
+    assert mock.calls == 3
+    assert policy.stats["mock"].skipped_no_capacity == 1
+
+
+def test_no_hedge_over_budget(vendor):
+    mock = vendor([0.01, 0.01, 0.1])
+    policy = HedgingPolicy(min_samples=2, max_hedge_fraction=0.1)
+    run_calls(policy, 3)
+    assert mock.calls == 3
+    assert policy.stats["mock"].skipped_budget == 1
@@ -7,17 +7,22 @@ import json
 import asyncio
 import aiohttp
 from datetime import datetime
+from functools import lru_cache
 from dataclasses import dataclass, asdict, field
 from typing import List, Dict, Optional
 from pathlib import Path
 
-from benchmark.config import TEMPERATURES, NUM_REPETITIONS, ensure_dirs
+from benchmark.config import TEMPERATURES, NUM_REPETITIONS, EXCLUSIONS_FILE, ensure_dirs
+from benchmark.datasets.dedup import load_exclusions
 from benchmark.scoring.base import Scorer
 from benchmark.scoring.discrete_cbm import DiscreteCBMScorer
 from benchmark.scoring.continuous_hlcc import ContinuousHLCCScorer
 from benchmark.prompting.base import PromptingStrategy
 from benchmark.prompting.combined import CombinedStrategy
 from benchmark.prompting.linear import LinearStrategy
+from benchmark.prompting.persona import (
+    CONFIG_VARIANTS, ConfigPromptStrategy, PersonaStrategy, split_variant,
+)
 from benchmark.engine.api_clients import call_model
 from benchmark.engine.response_parser import (
     parse_combined_response,
@@ -25,6 +30,7 @@ from benchmark.engine.response_parser import (
     parse_confidence_only,
 )
 from benchmark.engine.rate_limiter import RateLimiter
+from benchmark.engine.hedging import HedgingPolicy
 
 
 @dataclass
@@ -47,33 +53,51 @@ class TestResult:
     timestamp: str
     processing_time: float
     raw_response: str = ""
+    option_logprobs: Optional[Dict[str, float]] = None  # Local models only
 
 
+@lru_cache(maxsize=None)
 def get_scorer(variant: str) -> Scorer:
-    """Get the scorer for a variant name."""
+    """Get the (shared, stateless) scorer for a variant name."""
     if variant.startswith("discrete"):
         return DiscreteCBMScorer()
     else:
         return ContinuousHLCCScorer()
 
 
+@lru_cache(maxsize=None)
 def get_strategy(variant: str) -> PromptingStrategy:
-    """Get the prompting strategy for a variant name."""
-    scoring_method = "discrete" if variant.startswith("discrete") else "hlcc"
-    if variant.endswith("combined"):
-        return CombinedStrategy(scoring_method)
+    """Get the prompting strategy for a variant name.
+
+    One instance per variant, so its rendered-prompt cache is shared by every
+    (vendor, model, temperature, repetition) task on the same question.
+    Accepts the built-in variants, prompts.json config variants and
+    "<variant>@<persona>" names (see prompting/persona.py).
+    """
+    base, persona_id = split_variant(variant)
+    scoring_method = "discrete" if base.startswith("discrete") else "hlcc"
+    if base in CONFIG_VARIANTS:
+        strategy = ConfigPromptStrategy(base.rsplit("_", 1)[1])
+    elif base.endswith("combined"):
+        strategy = CombinedStrategy(scoring_method)
     else:
-        return LinearStrategy(scoring_method)
+        strategy = LinearStrategy(scoring_method)
+    if persona_id:
+        strategy = PersonaStrategy(strategy, persona_id)
+    return strategy
 
 
 class BenchmarkRunner:
     """Runs benchmarks across models, variants, temperatures, and questions."""
 
-    def __init__(self, models_file: Path = None):
+    def __init__(self, models_file: Path = None, exclusions_file: Path = EXCLUSIONS_FILE,
+                 hedging: Optional[HedgingPolicy] = None):
         self.rate_limiter = RateLimiter()
+        self.hedging = hedging
         self.results: List[TestResult] = []
         self._models = None
         self._models_file = models_file
+        self._exclusions_file = exclusions_file
 
     def load_models(self, models_file: Path = None) -> Dict:
         """Load model configurations from JSON."""
@@ -87,18 +111,44 @@ class BenchmarkRunner:
         return self._models
 
     def load_questions(self, dataset_path: Path) -> List[Dict]:
-        """Load questions from a unified-format JSON file."""
+        """Load questions from a unified-format JSON file.
+
+        Questions listed in the dedup exclusion file (if any) are dropped.
+        """
         with open(dataset_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
-        if "questions" in data:
-            return data["questions"]
+        if isinstance(data, list):
+            questions = data
+        elif "questions" in data:
+            questions = data["questions"]
         elif "eval_data" in data:
-            return data["eval_data"]
-        elif isinstance(data, list):
-            return data
+            questions = data["eval_data"]
         else:
-            return []
+            questions = []
+
+        excluded = load_exclusions(self._exclusions_file) if self._exclusions_file else set()
+        if excluded:
+            before = len(questions)
+            questions = [q for q in questions if str(q.get("id", "")) not in excluded]
+            if len(questions) < before:
+                print(f"Excluded {before - len(questions)} duplicate/contaminated questions")
+        return questions
+
+    async def _call(
+        self,
+        session: aiohttp.ClientSession,
+        vendor: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+    ) -> Optional[str]:
+        """Call a model, hedging slow requests when a policy is configured."""
+        if self.hedging is None:
+            return await call_model(session, vendor, messages, model, temperature)
+        return await self.hedging.call(
+            session, vendor, messages, model, temperature, self.rate_limiter.get(vendor),
+        )
 
     async def _run_single(
         self,
@@ -120,21 +170,22 @@ class BenchmarkRunner:
         async with self.rate_limiter.get(vendor):
             if strategy.is_multi_turn:
                 # Linear strategy: two turns
-                prompt1 = strategy.build_prompt(question)
+                prompt1 = strategy.render_prompt(question)
                 messages = [{"role": "user", "content": prompt1}]
 
-                response1 = await call_model(session, vendor, messages, model, temperature)
+                response1 = await self._call(session, vendor, messages, model, temperature)
                 if response1 is None:
                     return None
 
                 answer = parse_answer_only(response1)
+                option_logprobs = getattr(response1, "option_logprobs", None)
 
                 # Build follow-up with conversation context
                 messages.append({"role": "assistant", "content": response1})
-                prompt2 = strategy.build_followup(question, response1)
+                prompt2 = strategy.build_followup(question, answer)
                 messages.append({"role": "user", "content": prompt2})
 
-                response2 = await call_model(session, vendor, messages, model, temperature)
+                response2 = await self._call(session, vendor, messages, model, temperature)
                 if response2 is None:
                     return None
 
@@ -144,14 +195,15 @@ class BenchmarkRunner:
 
             else:
                 # Combined strategy: single turn
-                prompt = strategy.build_prompt(question)
+                prompt = strategy.render_prompt(question)
                 messages = [{"role": "user", "content": prompt}]
 
-                response = await call_model(session, vendor, messages, model, temperature)
+                response = await self._call(session, vendor, messages, model, temperature)
                 if response is None:
                     return None
 
                 parsed = parse_combined_response(response, confidence_type)
+                option_logprobs = getattr(response, "option_logprobs", None)
                 answer = parsed.answer
                 confidence = parsed.confidence
                 raw_text = parsed.raw_text
@@ -187,6 +239,7 @@ class BenchmarkRunner:
             timestamp=start_time.isoformat(),
             processing_time=processing_time,
             raw_response=raw_text[:500],  # Truncate for storage
+            option_logprobs=option_logprobs,
         )
 
     async def run(
@@ -204,7 +257,8 @@ class BenchmarkRunner:
         Args:
             dataset_path: Path to unified-format JSON questions file.
             variants: List of variant names to test (e.g., ["discrete_combined", "hlcc_linear"]).
-            vendors: Vendor keys to include (default: all with API keys).
+            vendors: Vendor keys to include (default: all with API keys; the
+                keyless "local" vendor is only included when listed here).
             models_filter: Specific model names to test (default: all for selected vendors).
             temperatures: Temperature values to test (default: config TEMPERATURES).
             repetitions: Number of repetitions per combination (default: config NUM_REPETITIONS).
@@ -213,7 +267,7 @@ class BenchmarkRunner:
         Returns:
             List of TestResult objects.
         """
-        from benchmark.config import API_KEYS
+        from benchmark.config import API_KEYS, KEYLESS_VENDORS
 
         questions = self.load_questions(dataset_path)
         if not questions:
@@ -232,7 +286,11 @@ class BenchmarkRunner:
             vendor_key = vendor_data.get("vendor", vendor_name.lower())
             if vendors and vendor_key not in vendors:
                 continue
-            if not API_KEYS.get(vendor_key):
+            if vendor_key in KEYLESS_VENDORS:
+                # Local models are heavy; only run them when asked for by name
+                if not vendors:
+                    continue
+            elif not API_KEYS.get(vendor_key):
                 continue
             model_list = vendor_data["models"]
             if models_filter:
@@ -287,8 +345,50 @@ class BenchmarkRunner:
 
         self.results = results
         print(f"Completed: {len(results)} successful out of {total} tasks")
+        if self.hedging is not None:
+            self.hedging.print_summary()
         return results
 
+    def export_requests(
+        self,
+        dataset_path: Path,
+        variants: List[str],
+        output_path: Path,
+    ) -> int:
+        """Write prebuilt first-turn requests for batch or offline use.
+
+        One JSON line per (variant, question) with the rendered messages and,
+        for linear variants, the fixed follow-up prompt. Vendor, model and
+        temperature are left to the consumer, since the prompt text does not
+        depend on them.
+
+        Returns:
+            Number of requests written.
+        """
+        questions = self.load_questions(dataset_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as f:
+            for variant in variants:
+                strategy = get_strategy(variant)
+                for question in questions:
+                    qid = str(question.get("id", ""))
+                    record = {
+                        "custom_id": f"{variant}:{qid}",
+                        "variant": variant,
+                        "question_id": qid,
+                        "dataset": question.get("dataset", "unknown"),
+                        "correct_answer": question.get(
+                            "correctAnswer", question.get("correct_answer", "")),
+                        "multi_turn": strategy.is_multi_turn,
+                        "messages": [{"role": "user", "content": strategy.render_prompt(question)}],
+                        "followup": strategy.build_followup(question, ""),
+                    }
+                    f.write(json.dumps(record) + "\n")
+                    count += 1
+        print(f"Exported {count} prebuilt requests to {output_path}")
+        return count
+
     def save_results(self, output_path: Path):
         """Save raw results to JSON."""
         output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -1,11 +1,17 @@
 """Abstract base class for prompting strategies."""
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 
 class PromptingStrategy(ABC):
     """Base class for confidence elicitation prompting strategies."""
 
+    def __init__(self):
+        # Rendered first-turn prompts keyed by question id. One strategy
+        # instance exists per variant (see engine.tester.get_strategy), so this
+        # is effectively keyed on (variant, question_id).
+        self._prompt_cache: Dict[str, str] = {}
+
     @abstractmethod
     def build_prompt(self, question: dict) -> str:
         """Build the initial prompt for a question.
@@ -39,6 +45,23 @@ class PromptingStrategy(ABC):
     def name(self) -> str:
         """Human-readable name of this strategy."""
 
+    def render_prompt(self, question: dict) -> str:
+        """Memoised build_prompt: each question is rendered once per variant,
+        however many vendors, models, temperatures and repetitions use it."""
+        qid = question.get("id")
+        if qid is None:
+            return self.build_prompt(question)
+        key = str(qid)
+        prompt = self._prompt_cache.get(key)
+        if prompt is None:
+            prompt = self.build_prompt(question)
+            self._prompt_cache[key] = prompt
+        return prompt
+
+    def clear_cache(self):
+        """Drop all rendered prompts (e.g. after templates change)."""
+        self._prompt_cache.clear()
+
     def format_options(self, options: list) -> str:
         """Format options list into readable text."""
         return "\n".join(f"  {opt['key']}) {opt['text']}" for opt in options)
@@ -18,6 +18,7 @@ class CombinedStrategy(PromptingStrategy):
         """
         if scoring_method not in ("discrete", "hlcc"):
             raise ValueError(f"scoring_method must be 'discrete' or 'hlcc', got '{scoring_method}'")
+        super().__init__()
         self._scoring_method = scoring_method
 
     def build_prompt(self, question: dict) -> str:
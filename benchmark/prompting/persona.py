@@ -0,0 +1,145 @@
+"""Persona and prompt-configuration strategies from Code/prompts.json.
+
+prompts.json defines persona prompts ("acting as a first year computer science
+student ...") and its own combined/linear confidence prompts. These strategies
+let those configurations run through BenchmarkRunner like any other variant.
+
+Variant naming:
+  discrete_config_combined    prompts.json "combined" prompt (letter + level 1-3)
+  discrete_config_linear      prompts.json "linear" prompt + follow-up
+  <base>@<persona_id>         any base variant with a persona prepended,
+                              e.g. "hlcc_linear@professor"
+
+Scoring is taken from the base variant name (prompts.json prompts are discrete).
+"""
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from benchmark.config import PROMPTS_FILE, VARIANTS
+from .base import PromptingStrategy
+
+CONFIG_VARIANTS = ["discrete_config_combined", "discrete_config_linear"]
+
+
+@lru_cache(maxsize=None)
+def load_prompt_configurations(path: Path = PROMPTS_FILE) -> dict:
+    """Load the 'promptConfigurations' block of a prompts.json file."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["promptConfigurations"]
+
+
+def available_personas(path: Path = PROMPTS_FILE) -> List[str]:
+    """Persona ids defined in prompts.json."""
+    return list(load_prompt_configurations(path).get("personaPrompts", {}))
+
+
+def split_variant(variant: str):
+    """Split "<base>@<persona>" into (base, persona_id or None)."""
+    base, _, persona_id = variant.partition("@")
+    return base, (persona_id or None)
+
+
+def is_known_variant(variant: str) -> bool:
+    """Whether a variant name (optionally with @persona) can be built."""
+    base, persona_id = split_variant(variant)
+    if base not in VARIANTS and base not in CONFIG_VARIANTS:
+        return False
+    return persona_id is None or persona_id in available_personas()
+
+
+def persona_variants(base_variants: List[str], personas: Optional[List[str]] = None,
+                     include_base: bool = True) -> List[str]:
+    """Expand a persona x prompt-configuration sweep into variant names.
+
+    Args:
+        base_variants: Base variant names (built-in or CONFIG_VARIANTS).
+        personas: Persona ids to cross with each base (default: all in prompts.json).
+        include_base: Also keep each base variant without a persona.
+
+    Returns:
+        List of variant names, base-major order.
+    """
+    personas = available_personas() if personas is None else personas
+    variants = []
+    for base in base_variants:
+        if include_base:
+            variants.append(base)
+        variants.extend(f"{base}@{p}" for p in personas)
+    return variants
+
+
+class ConfigPromptStrategy(PromptingStrategy):
+    """Confidence prompts exactly as written in prompts.json (discrete 1-3)."""
+
+    def __init__(self, mode: str, prompt_configurations: dict = None):
+        """
+        Args:
+            mode: Either 'combined' or 'linear'.
+            prompt_configurations: Parsed promptConfigurations (default: prompts.json).
+        """
+        if mode not in ("combined", "linear"):
+            raise ValueError(f"mode must be 'combined' or 'linear', got '{mode}'")
+        super().__init__()
+        self._mode = mode
+        self._config = (prompt_configurations or load_prompt_configurations())["confidencePrompts"][mode]
+
+    def build_prompt(self, question: dict) -> str:
+        return (
+            self._config["promptText"].strip() + "\n\n"
+            + question["question"] + "\n"
+            + self.format_options(question["options"])
+        )
+
+    def build_followup(self, question: dict, model_answer: str) -> Optional[str]:
+        if self._mode != "linear":
+            return None
+        followup = self._config["folloupText"].strip()
+        answer = (model_answer or "").strip()
+        if answer:
+            return f"You answered '{answer}'.\n\n{followup}"
+        return followup
+
+    @property
+    def is_multi_turn(self) -> bool:
+        return self._mode == "linear"
+
+    @property
+    def name(self) -> str:
+        return f"discrete_config_{self._mode}"
+
+
+class PersonaStrategy(PromptingStrategy):
+    """Wraps another strategy and prefixes its first-turn prompt with a persona."""
+
+    def __init__(self, base: PromptingStrategy, persona_id: str,
+                 prompt_configurations: dict = None):
+        """
+        Args:
+            base: Strategy whose prompts are being wrapped.
+            persona_id: Key into prompts.json personaPrompts.
+            prompt_configurations: Parsed promptConfigurations (default: prompts.json).
+        """
+        personas = (prompt_configurations or load_prompt_configurations())["personaPrompts"]
+        if persona_id not in personas:
+            raise ValueError(f"Unknown persona '{persona_id}'. Available: {list(personas)}")
+        super().__init__()
+        self._base = base
+        self._persona_id = persona_id
+        self._persona_text = personas[persona_id]["promptText"].strip()
+
+    def build_prompt(self, question: dict) -> str:
+        return f"{self._persona_text}\n\n{self._base.build_prompt(question)}"
+
+    def build_followup(self, question: dict, model_answer: str) -> Optional[str]:
+        return self._base.build_followup(question, model_answer)
+
+    @property
+    def is_multi_turn(self) -> bool:
+        return self._base.is_multi_turn
+
+    @property
+    def name(self) -> str:
+        return f"{self._base.name}@{self._persona_id}"
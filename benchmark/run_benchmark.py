@@ -4,6 +4,9 @@ Usage:
   python -m benchmark.run_benchmark --dataset mmlu --variant all --sample-size 10
   python -m benchmark.run_benchmark --dataset truthfulqa --variant discrete_combined --vendors openai,claude
   python -m benchmark.run_benchmark --dataset all --variant all --temperatures 0.0,0.7 --repetitions 3
+  python -m benchmark.run_benchmark --dataset all --download-only --dedup
+  python -m benchmark.run_benchmark --dataset mmlu --variant all --export-requests prompts.jsonl
+  python -m benchmark.run_benchmark --dataset arc --variant discrete_config_combined,discrete_config_linear --personas all
 """
 import argparse
 import asyncio
@@ -17,7 +20,12 @@ from benchmark.config import (
 )
 from benchmark.datasets.downloader import download_all
 from benchmark.datasets.converter import convert_all, convert_mmlu, convert_truthfulqa, convert_arc
+from benchmark.datasets.dedup import deduplicate
 from benchmark.engine.tester import BenchmarkRunner
+from benchmark.engine.hedging import HedgingPolicy
+from benchmark.prompting.persona import (
+    CONFIG_VARIANTS, available_personas, is_known_variant, persona_variants,
+)
 
 
 def parse_args():
@@ -36,12 +44,20 @@ def parse_args():
         "--variant",
         default="all",
         help="Confidence variant(s): discrete_combined, discrete_linear, "
-             "hlcc_combined, hlcc_linear, or 'all' (default: all)",
+             "hlcc_combined, hlcc_linear, discrete_config_combined, discrete_config_linear, "
+             "<variant>@<persona>, or 'all' (default: all built-in variants)",
+    )
+    parser.add_argument(
+        "--personas",
+        default=None,
+        help="Comma-separated persona ids from Code/prompts.json (or 'all') to sweep "
+             "against every selected variant",
     )
     parser.add_argument(
         "--vendors",
         default=None,
-        help="Comma-separated vendor keys: openai,claude,gemini,deepseek,xai (default: all with API keys)",
+        help="Comma-separated vendor keys: openai,claude,gemini,deepseek,xai,local "
+             "(default: all with API keys; local models run only when listed)",
     )
     parser.add_argument(
         "--models",
@@ -70,6 +86,24 @@ def parse_args():
         action="store_true",
         help="Only download and convert datasets, don't run benchmarks",
     )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Run near-duplicate/contamination detection over the unified datasets "
+             "and refresh the exclusion list before benchmarking",
+    )
+    parser.add_argument(
+        "--export-requests",
+        default=None,
+        help="Write rendered prompts as a JSONL request file (one per variant x question) "
+             "instead of calling any API. With --dataset all, the dataset name is appended.",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Hedge slow requests: re-issue a call that outlives the vendor's rolling "
+             "p95 latency and keep whichever response arrives first",
+    )
     parser.add_argument(
         "--output-dir",
         default=None,
@@ -120,10 +154,23 @@ async def run_benchmark(args):
     else:
         variants = [v.strip() for v in args.variant.split(",")]
         for v in variants:
-            if v not in VARIANTS:
-                print(f"Unknown variant: {v}. Available: {VARIANTS}")
+            if not is_known_variant(v):
+                print(f"Unknown variant: {v}. Available: {VARIANTS + CONFIG_VARIANTS} "
+                      f"(optionally @persona, personas: {available_personas()})")
                 return
 
+    # Persona x prompt-configuration sweep
+    if args.personas:
+        personas = (
+            available_personas() if args.personas == "all"
+            else [p.strip() for p in args.personas.split(",")]
+        )
+        unknown = [p for p in personas if p not in available_personas()]
+        if unknown:
+            print(f"Unknown persona(s): {unknown}. Available: {available_personas()}")
+            return
+        variants = persona_variants(variants, personas)
+
     # Parse vendors
     vendors = [v.strip() for v in args.vendors.split(",")] if args.vendors else None
 
@@ -145,13 +192,25 @@ async def run_benchmark(args):
     for ds in datasets:
         dataset_files[ds] = ensure_dataset(ds, sample_size=args.sample_size)
 
+    if args.dedup:
+        deduplicate()
+
     if args.download_only:
         print("Download complete. Exiting (--download-only).")
         return
 
     # Run benchmarks
     output_dir = Path(args.output_dir) if args.output_dir else RAW_RESULTS_DIR
-    runner = BenchmarkRunner()
+    runner = BenchmarkRunner(hedging=HedgingPolicy() if args.hedge else None)
+
+    if args.export_requests:
+        export_path = Path(args.export_requests)
+        for ds_name, ds_path in dataset_files.items():
+            target = export_path
+            if len(dataset_files) > 1:
+                target = export_path.with_name(f"{export_path.stem}_{ds_name}{export_path.suffix}")
+            runner.export_requests(ds_path, variants, target)
+        return
 
     for ds_name, ds_path in dataset_files.items():
         print(f"\n{'='*60}")
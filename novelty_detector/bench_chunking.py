@@ -0,0 +1,122 @@
+"""
+Benchmark for PDFProcessor overlap chunking and chunk-context building.
+
+Times the linear-time chunker (prefix-sum offsets, text slices) and the
+streaming chunker against the previous implementation, which re-joined the
+whole word prefix for every chunk's char offset and re-split both neighbours
+for every context, on a synthetic document (500k words by default, roughly a
+book-length thesis). Outputs are checked to be identical.
+
+  python bench_chunking.py
+  python bench_chunking.py --words 100000 --chunk-size 150 --overlap 20
+  python bench_chunking.py --skip-legacy      # quadratic baseline is slow
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import Dict, List
+
+from pdf_processor import PDFProcessor, _iter_words
+
+
+def synthetic_text(n_words: int, seed: int = 0) -> str:
+    """Pseudo-text with paragraph breaks and irregular whitespace."""
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(5000)] + ["the", "of", "and", "novelty,", "result."]
+    parts = []
+    for i in range(n_words):
+        parts.append(rng.choice(vocab))
+        parts.append("\n\n" if i % 120 == 119 else ("\n" if i % 13 == 12 else " "))
+    return "".join(parts)
+
+
+def legacy_chunk_overlap(text: str, chunk_size: int, overlap: int) -> List[Dict]:
+    """The previous _chunk_text_overlap (O(n^2) char offsets)."""
+    text = re.sub(r'\s+', ' ', text).strip()
+    words = text.split()
+    chunks = []
+    start_idx = 0
+    chunk_idx = 0
+    while start_idx < len(words):
+        end_idx = min(start_idx + chunk_size, len(words))
+        chunk_words = words[start_idx:end_idx]
+        chunk_text = ' '.join(chunk_words)
+        char_start = len(' '.join(words[:start_idx]))
+        if start_idx > 0:
+            char_start += 1
+        chunks.append({
+            'chunk_index': chunk_idx,
+            'text': chunk_text,
+            'word_start': start_idx,
+            'word_end': end_idx,
+            'char_start': char_start,
+            'char_end': char_start + len(chunk_text),
+            'word_count': len(chunk_words)
+        })
+        chunk_idx += 1
+        start_idx += chunk_size - overlap
+        if end_idx >= len(words):
+            break
+    return chunks
+
+
+def legacy_contexts(chunks: List[Dict], before: int = 50, after: int = 50):
+    """The previous get_chunk_context, applied to every chunk."""
+    contexts = []
+    for i, chunk in enumerate(chunks):
+        before_context = ' '.join(chunks[i - 1]['text'].split()[-before:]) if i > 0 else ""
+        after_context = (' '.join(chunks[i + 1]['text'].split()[:after])
+                         if i < len(chunks) - 1 else "")
+        contexts.append((before_context, chunk['text'], after_context))
+    return contexts
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark overlap chunking")
+    p.add_argument("--words", type=int, default=500_000)
+    p.add_argument("--chunk-size", type=int, default=150)
+    p.add_argument("--overlap", type=int, default=20)
+    p.add_argument("--skip-legacy", action="store_true",
+                   help="Do not run the quadratic baseline")
+    args = p.parse_args()
+
+    text = synthetic_text(args.words)
+    processor = PDFProcessor(chunk_size=args.chunk_size, overlap=args.overlap)
+    print(f"{args.words} words, {len(text)} chars, chunk_size={args.chunk_size}, "
+          f"overlap={args.overlap}")
+
+    chunks, t_chunk = timed(lambda: processor.chunk_text(text))
+    contexts, t_ctx = timed(
+        lambda: [processor.get_chunk_context(chunks, i) for i in range(len(chunks))])
+    streamed, t_stream = timed(lambda: list(processor._iter_overlap_chunks(_iter_words([text]))))
+    assert streamed == chunks, "streaming chunker disagrees with chunk_text"
+
+    print(f"{'step':<22} {'new (s)':>9} {'legacy (s)':>11} {'speedup':>8}")
+    rows = [("chunk_text", t_chunk, None), ("contexts", t_ctx, None),
+            ("streaming chunker", t_stream, None)]
+    if not args.skip_legacy:
+        old_chunks, t_old = timed(
+            lambda: legacy_chunk_overlap(text, args.chunk_size, args.overlap))
+        old_contexts, t_old_ctx = timed(lambda: legacy_contexts(old_chunks))
+        assert old_chunks == chunks, "chunks differ from the legacy chunker"
+        assert old_contexts == contexts, "contexts differ from the legacy implementation"
+        rows = [("chunk_text", t_chunk, t_old), ("contexts", t_ctx, t_old_ctx),
+                ("streaming chunker", t_stream, t_old)]
+
+    for name, new, old in rows:
+        legacy = f"{old:>11.3f}" if old is not None else f"{'-':>11}"
+        speedup = f"{old / new:>7.1f}x" if old is not None else f"{'-':>8}"
+        print(f"{name:<22} {new:>9.3f} {legacy} {speedup}")
+    print(f"{len(chunks)} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compare the cheap embedding modes against full LLM-prompt mode.
+
+Scores one document in 'prompt' mode (an LLM prompt per chunk, the reference),
+'raw' mode (chunk text only, no LLM calls) and 'hybrid' mode (LLM prompts only
+for chunks near a colour threshold) and reports, against the reference:
+
+  spearman   rank correlation of the novelty scores
+  kendall    Kendall tau-b of the novelty scores
+  top10      overlap of the 10% most novel chunks
+  colour     share of chunks that get the same highlight colour
+  llm calls  chunks sent to the LLM, and wall time
+
+  python bench_embedding_modes.py paper.pdf
+  python bench_embedding_modes.py notes.txt --llm-provider openai --margin 0.1
+  python bench_embedding_modes.py paper.pdf --chunk-size 100 --k 5
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+import novelty_detector as nd
+from novelty_detector import NoveltyDetector
+from pdf_processor import PDFProcessor
+
+
+def rankdata(values: np.ndarray) -> np.ndarray:
+    """Ranks with ties given their average rank (as scipy.stats.rankdata)."""
+    order = np.argsort(values, kind="mergesort")
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+    _, inverse = np.unique(values, return_inverse=True)
+    sums = np.bincount(inverse, weights=ranks)
+    counts = np.bincount(inverse)
+    return sums[inverse] / counts[inverse]
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    """Spearman rank correlation (Pearson correlation of the ranks)."""
+    ra, rb = rankdata(a), rankdata(b)
+    if ra.std() == 0 or rb.std() == 0:
+        return float("nan")
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def kendall_tau(a: np.ndarray, b: np.ndarray) -> float:
+    """Kendall tau-b over all chunk pairs (O(n^2), fine for a document)."""
+    da = np.sign(a[:, None] - a[None, :])
+    db = np.sign(b[:, None] - b[None, :])
+    upper = np.triu_indices(len(a), k=1)
+    da, db = da[upper], db[upper]
+    denom = np.sqrt(np.count_nonzero(da) * np.count_nonzero(db))
+    return float((da * db).sum() / denom) if denom else float("nan")
+
+
+def top_overlap(a: np.ndarray, b: np.ndarray, fraction: float = 0.1) -> float:
+    """Share of the top-fraction chunks by a that are also top by b."""
+    n = max(1, int(round(len(a) * fraction)))
+    top_a = set(np.argsort(-a, kind="mergesort")[:n].tolist())
+    top_b = set(np.argsort(-b, kind="mergesort")[:n].tolist())
+    return len(top_a & top_b) / n
+
+
+def colour_agreement(a: np.ndarray, b: np.ndarray) -> float:
+    """Share of chunks that fall in the same highlight colour bucket."""
+    thresholds = np.array(nd.NOVELTY_THRESHOLDS)
+    return float(np.mean(np.searchsorted(thresholds, a) == np.searchsorted(thresholds, b)))
+
+
+def load_chunks(path: str, processor: PDFProcessor) -> List[Dict]:
+    if path.lower().endswith(".pdf"):
+        return processor.chunk_text(processor.extract_text(path))
+    with open(path, encoding="utf-8") as f:
+        return processor.chunk_text(f.read())
+
+
+def run_mode(mode: str, chunks: List[Dict], processor: PDFProcessor, args) -> Dict:
+    detector = NoveltyDetector(llm_provider=args.llm_provider, llm_model=args.llm_model,
+                               embedding_mode=mode, use_prompt_cache=not args.no_cache)
+    start = time.perf_counter()
+    scores = detector.analyze_document(chunks, processor, k=args.k)
+    return {
+        "scores": np.array([s["novelty_score"] for s in scores]),
+        "llm_calls": detector.prompted_chunks,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Rank agreement of embedding modes with prompt mode")
+    p.add_argument("document", help="PDF or plain-text file")
+    p.add_argument("--llm-provider", default=os.getenv("DEFAULT_LLM_PROVIDER", "ollama"))
+    p.add_argument("--llm-model", default=None)
+    p.add_argument("--chunk-size", type=int, default=150)
+    p.add_argument("--overlap", type=int, default=20)
+    p.add_argument("--k", type=int, default=5, help="Nearest neighbours for scoring")
+    p.add_argument("--margin", type=float, default=nd.HYBRID_MARGIN,
+                   help="Hybrid mode: distance to a colour threshold that triggers an LLM call")
+    p.add_argument("--no-cache", action="store_true",
+                   help="Do not reuse cached prompts (time real LLM calls)")
+    args = p.parse_args()
+    nd.HYBRID_MARGIN = args.margin
+
+    processor = PDFProcessor(chunk_size=args.chunk_size, overlap=args.overlap)
+    chunks = load_chunks(args.document, processor)
+    if len(chunks) < 2:
+        raise SystemExit("Need at least two chunks to compare rankings")
+    print(f"{len(chunks)} chunks, provider={args.llm_provider}, k={args.k}, "
+          f"hybrid margin={args.margin}")
+
+    results = {mode: run_mode(mode, chunks, processor, args) for mode in nd.EMBEDDING_MODES}
+    reference = results["prompt"]["scores"]
+
+    print(f"\n{'mode':<8} {'spearman':>9} {'kendall':>8} {'top10':>6} {'colour':>7} "
+          f"{'llm calls':>10} {'time (s)':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<8} {spearman(r['scores'], reference):>9.3f} "
+              f"{kendall_tau(r['scores'], reference):>8.3f} "
+              f"{top_overlap(r['scores'], reference):>6.2f} "
+              f"{colour_agreement(r['scores'], reference):>7.2f} "
+              f"{r['llm_calls']:>10} {r['seconds']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
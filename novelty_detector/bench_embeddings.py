@@ -0,0 +1,165 @@
+"""
+Benchmark the local embedding backends: PyTorch SentenceTransformer ('local')
+against the int8 ONNX Runtime export ('onnx', see onnx_embedder.py).
+
+Each backend runs in its own subprocess so memory is measured in isolation.
+Per backend: load time (including the one-off ONNX export on first use),
+resident memory after loading, peak memory while encoding and throughput in
+texts per second. Quality of the ONNX vectors against the PyTorch ones:
+
+  cosine     mean cosine similarity between the two embeddings of each text
+  recall@k   overlap of each text's k nearest neighbours
+  spearman   rank correlation of the resulting novelty scores
+
+Texts are chunks of a PDF or text file, or synthetic topical paragraphs.
+
+  python bench_embeddings.py
+  python bench_embeddings.py --model all-MiniLM-L6-v2 --texts 2000
+  python bench_embeddings.py --document paper.pdf --threads 4 --batch-size 32
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from bench_embedding_modes import load_chunks, spearman
+from novelty_detector import score_novelty
+from onnx_embedder import available_cpus
+from pdf_processor import PDFProcessor
+from vector_index import create_index
+
+TOPICS = [
+    "neural network training gradient loss layer weights optimiser epoch accuracy",
+    "protein enzyme cell membrane receptor binding molecule expression gene",
+    "market price inflation demand supply interest rate policy growth trade",
+    "court ruling statute contract liability plaintiff appeal evidence judge",
+    "climate rainfall temperature ocean carbon emission ice sea level model",
+    "student course assessment feedback learning curriculum exam teacher grade",
+]
+COMMON = "the of and a in to is that for with as on by this we are results show".split()
+
+
+def synthetic_texts(n: int, words: int = 150, seed: int = 0) -> List[str]:
+    """Chunk-sized paragraphs, each mostly about one of a few topics."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        topic = rng.choice(TOPICS).split()
+        texts.append(" ".join(rng.choice(topic if rng.random() < 0.5 else COMMON)
+                              for _ in range(words)))
+    return texts
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux), else the peak."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend: str, model_name: str, texts: List[str], batch_size: int,
+                threads: int, out_path: str) -> Dict:
+    """Load and time one backend (in a fresh process); embeddings go to out_path."""
+    base = rss_mb()
+    start = time.perf_counter()
+    if backend == "onnx":
+        from onnx_embedder import OnnxEmbedder
+        model = OnnxEmbedder(model_name, threads=threads)
+    else:
+        import torch
+        from sentence_transformers import SentenceTransformer
+        torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device="cpu")
+    load_seconds = time.perf_counter() - start
+    loaded = rss_mb()
+
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    seconds = time.perf_counter() - start
+    np.save(out_path, np.asarray(embeddings, dtype="float32"))
+    return {
+        "load_s": load_seconds,
+        "model_mb": loaded - base,
+        "peak_mb": peak_rss_mb(),
+        "texts_per_s": len(texts) / seconds,
+    }
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def knn(embeddings: np.ndarray, k: int) -> np.ndarray:
+    sims = embeddings @ embeddings.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1)[:, :k]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compare PyTorch and int8 ONNX embedding backends")
+    p.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "BAAI/bge-large-en-v1.5"))
+    p.add_argument("--document", help="PDF or text file to chunk (default: synthetic texts)")
+    p.add_argument("--texts", type=int, default=1000, help="Synthetic texts to embed")
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--threads", type=int, default=available_cpus())
+    p.add_argument("--k", type=int, default=5, help="Neighbours for recall and novelty")
+    p.add_argument("--backends", nargs="+", default=["local", "onnx"],
+                   choices=["local", "onnx"])
+    args = p.parse_args()
+
+    if args.document:
+        texts = [c["text"] for c in load_chunks(args.document, PDFProcessor())]
+    else:
+        texts = synthetic_texts(args.texts)
+    print(f"{args.model}: {len(texts)} texts, batch size {args.batch_size}, "
+          f"{args.threads} threads")
+
+    ctx = multiprocessing.get_context("spawn")
+    results, embeddings = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            out_path = os.path.join(tmp, f"{backend}.npy")
+            with ctx.Pool(1) as pool:
+                results[backend] = pool.apply(
+                    run_backend, (backend, args.model, texts, args.batch_size,
+                                  args.threads, out_path))
+            embeddings[backend] = normalize(np.load(out_path))
+
+    print(f"\n{'backend':<8} {'load (s)':>9} {'model MB':>9} {'peak MB':>8} {'texts/s':>8}")
+    for backend, r in results.items():
+        print(f"{backend:<8} {r['load_s']:>9.1f} {r['model_mb']:>9.0f} "
+              f"{r['peak_mb']:>8.0f} {r['texts_per_s']:>8.1f}")
+
+    if len(embeddings) == 2 and len(texts) > args.k:
+        ref, onnx = embeddings["local"], embeddings["onnx"]
+        k = args.k
+        cosine = float(np.mean(np.sum(ref * onnx, axis=1)))
+        ref_nn, onnx_nn = knn(ref, k), knn(onnx, k)
+        recall = float(np.mean([len(set(a) & set(b)) / k
+                                for a, b in zip(ref_nn.tolist(), onnx_nn.tolist())]))
+        scores = [np.array([s["novelty_score"] for s in score_novelty(
+            e, create_index(e, "flat"), texts, k)]) for e in (ref, onnx)]
+        speedup = results["onnx"]["texts_per_s"] / results["local"]["texts_per_s"]
+        print(f"\nonnx vs local: cosine {cosine:.4f}, recall@{k} {recall:.3f}, "
+              f"novelty spearman {spearman(*scores):.4f}, speedup {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
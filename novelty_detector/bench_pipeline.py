@@ -0,0 +1,304 @@
+"""
+Reproducible end-to-end benchmark of the novelty pipeline.
+
+Runs extract -> chunk -> prompts -> embed -> index -> score -> annotate on a
+corpus of PDFs: synthetic documents of the requested page counts, written
+with reportlab from a fixed seed (and kept in --corpus-dir, so every commit
+sees the same files), plus any real PDFs given with --documents. Prompts
+come from FallbackProvider, so no LLM or network is involved; embeddings
+from a small local model. Caches are disabled, so every run does the full
+work.
+
+Each document runs in its own subprocess, so peak RSS is that document's
+alone. Per document the results record model load time, total wall time,
+pages per second and peak RSS, and per stage the StageProfiler figures
+(see profiler.py) with items per second.
+
+--output writes the results as a JSON baseline. --compare checks a run (or
+a second saved file, --against) against a baseline and exits with status 1
+if any document or stage is slower, or uses more memory, beyond the
+tolerance.
+
+  python bench_pipeline.py
+  python bench_pipeline.py --pages 10 100 1000 --output baseline.json
+  python bench_pipeline.py --documents paper.pdf thesis.pdf --output real.json
+  python bench_pipeline.py --compare baseline.json
+  python bench_pipeline.py --compare baseline.json --against new.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
+
+from bench_embeddings import COMMON, TOPICS, peak_rss_mb, rss_mb
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BENCH_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "bench_corpus")
+FONT, FONT_SIZE, LEADING, MARGIN = "Helvetica", 9, 11, 54
+
+# Changes smaller than these are noise, whatever the ratio
+MIN_SECONDS = 0.05
+MIN_MB = 20
+
+# Command-line settings recorded with the results (a comparison warns if they differ)
+SETTINGS = ("model", "embedding_provider", "embedding_mode", "chunk_size", "overlap",
+            "chunking_mode", "k", "extract_workers", "words_per_page", "seed")
+
+
+def write_synthetic_pdf(path: str, pages: int, words_per_page: int = 400, seed: int = 0):
+    """
+    Write a PDF of topical paragraphs (~60 words, each mostly about one of
+    a few topics, with occasional repeated passages so the document has
+    both novel and redundant chunks).
+    """
+    rng = random.Random(seed)
+    width, height = letter
+    pdf = canvas.Canvas(path, pagesize=letter)
+    pdf.setTitle(f"Synthetic benchmark document ({pages} pages, seed {seed})")
+    paragraphs: List[str] = []
+    for _ in range(pages):
+        text = pdf.beginText(MARGIN, height - MARGIN)
+        text.setFont(FONT, FONT_SIZE, leading=LEADING)
+        words = 0
+        while words < words_per_page:
+            if paragraphs and rng.random() < 0.1:
+                paragraph = rng.choice(paragraphs)
+            else:
+                topic = rng.choice(TOPICS).split()
+                paragraph = " ".join(rng.choice(topic if rng.random() < 0.5 else COMMON)
+                                     for _ in range(rng.randint(40, 80)))
+                paragraph = paragraph[0].upper() + paragraph[1:] + "."
+                paragraphs.append(paragraph)
+            for line in simpleSplit(paragraph, FONT, FONT_SIZE, width - 2 * MARGIN):
+                text.textLine(line)
+            text.textLine("")
+            words += len(paragraph.split())
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+
+
+def synthetic_corpus(directory: str, page_counts: List[int], words_per_page: int,
+                     seed: int) -> List[Tuple[str, str]]:
+    """(name, path) of each synthetic document, generated if not already on disk."""
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for pages in page_counts:
+        name = f"synthetic-{pages}p"
+        path = os.path.join(directory, f"{name}-{words_per_page}w-seed{seed}.pdf")
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            write_synthetic_pdf(path, pages, words_per_page, seed)
+            print(f"Generated {path} in {time.perf_counter() - start:.1f}s")
+        corpus.append((name, path))
+    return corpus
+
+
+def run_document(path: str, args: Dict) -> Dict:
+    """Run the whole pipeline on one PDF (in a fresh process) and profile it."""
+    import fitz
+    from novelty_detector import NoveltyDetector
+    from pdf_processor import PDFProcessor
+    from profiler import StageProfiler
+
+    base = rss_mb()
+    start = time.perf_counter()
+    detector = NoveltyDetector(
+        llm_provider="fallback",
+        embedding_provider=args["embedding_provider"],
+        embedding_model_name=args["model"],
+        embedding_mode=args["embedding_mode"],
+        use_prompt_cache=False,
+        use_embedding_cache=False,
+        use_usage_log=False,
+        use_model_registry=False,
+    )
+    load_seconds = time.perf_counter() - start
+    loaded = rss_mb()
+
+    # Profile the run, not the model load
+    profiler = StageProfiler()
+    detector.profiler = profiler
+    processor = PDFProcessor(chunk_size=args["chunk_size"], overlap=args["overlap"],
+                             chunking_mode=args["chunking_mode"], profiler=profiler)
+    chunks, scores = detector.analyze_stream(
+        processor.iter_chunk_contexts(processor.stream_chunks(path, args["extract_workers"])),
+        k=args["k"])
+    with tempfile.TemporaryDirectory() as tmp:
+        processor.annotate_pdf(path, os.path.join(tmp, "annotated.pdf"), scores, chunks)
+    report = profiler.report()
+
+    with fitz.open(path) as doc:
+        pages = len(doc)
+    stages = {}
+    for name, figures in report["stages"].items():
+        stages[name] = dict(figures)
+        stages[name]["items_per_s"] = (round(figures["items"] / figures["wall_s"], 2)
+                                       if figures["wall_s"] else None)
+    return {
+        "pages": pages,
+        "file_mb": round(os.path.getsize(path) / 2 ** 20, 2),
+        "chunks": len(chunks),
+        "words": sum(c["word_count"] for c in chunks),
+        "load_s": round(load_seconds, 3),
+        "model_mb": round(loaded - base, 1),
+        "wall_s": report["wall_s"],
+        "pages_per_s": round(pages / report["wall_s"], 2) if report["wall_s"] else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": stages,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=here, capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(corpus: List[Tuple[str, str]], args: Dict, repeat: int) -> Dict:
+    """Run every document repeat times, keeping each document's fastest run."""
+    ctx = multiprocessing.get_context("spawn")
+    documents = {}
+    for name, path in corpus:
+        runs = []
+        for _ in range(repeat):
+            with ctx.Pool(1) as pool:
+                runs.append(pool.apply(run_document, (path, args)))
+        documents[name] = min(runs, key=lambda r: r["wall_s"])
+        print_document(name, documents[name])
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            **args,
+        },
+        "documents": documents,
+    }
+
+
+def print_document(name: str, result: Dict):
+    print(f"\n{name}: {result['pages']} pages, {result['chunks']} chunks, "
+          f"{result['wall_s']:.2f}s ({result['pages_per_s']} pages/s), "
+          f"peak RSS {result['peak_rss_mb']:.0f} MB, model load {result['load_s']:.1f}s")
+    print(f"  {'stage':<9} {'wall (s)':>9} {'cpu (s)':>9} {'items':>7} {'items/s':>10}")
+    for stage, s in result["stages"].items():
+        rate = f"{s['items_per_s']:.1f}" if s["items_per_s"] is not None else "-"
+        print(f"  {stage:<9} {s['wall_s']:>9.3f} {s['cpu_s']:>9.3f} {s['items']:>7} {rate:>10}")
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of current against baseline: documents or stages whose wall
+    time, or documents whose peak RSS, grew by more than tolerance (and by
+    more than the noise floor). Only documents present in both are compared.
+    """
+    regressions = []
+
+    def check(label: str, old: float, new: float, floor: float, unit: str):
+        change = (new - old) / old if old else 0.0
+        flag = change > tolerance and new - old > floor
+        if flag:
+            regressions.append(f"{label}: {old:.3f}{unit} -> {new:.3f}{unit} ({change:+.0%})")
+        print(f"  {label:<32} {old:>10.3f} {new:>10.3f} {change:>+8.0%}"
+              f"{'  REGRESSION' if flag else ''}")
+
+    print(f"\nBaseline {baseline['meta'].get('revision')} vs "
+          f"{current['meta'].get('revision')} (tolerance {tolerance:.0%})")
+    differ = [key for key in SETTINGS
+              if baseline["meta"].get(key) != current["meta"].get(key)]
+    if differ:
+        print(f"Warning: runs differ in {', '.join(differ)}; timings may not be comparable")
+    print(f"  {'':<32} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, old in baseline["documents"].items():
+        new = current["documents"].get(name)
+        if new is None:
+            continue
+        check(f"{name} wall", old["wall_s"], new["wall_s"], MIN_SECONDS, "s")
+        check(f"{name} peak RSS", old["peak_rss_mb"], new["peak_rss_mb"], MIN_MB, "MB")
+        for stage, figures in old["stages"].items():
+            if stage in new["stages"]:
+                check(f"{name} {stage}", figures["wall_s"], new["stages"][stage]["wall_s"],
+                      MIN_SECONDS, "s")
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description="End-to-end novelty pipeline benchmark")
+    p.add_argument("--pages", type=int, nargs="*", default=[10, 100],
+                   help="Page counts of the synthetic documents")
+    p.add_argument("--words-per-page", type=int, default=400)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--documents", nargs="*", default=[], help="Real PDFs to include")
+    p.add_argument("--corpus-dir", default=BENCH_CORPUS_DIR,
+                   help="Where synthetic PDFs are generated and reused")
+    p.add_argument("--model", default=DEFAULT_MODEL, help="Embedding model")
+    p.add_argument("--embedding-provider", default="local", choices=["local", "onnx"])
+    p.add_argument("--embedding-mode", default="prompt", choices=["prompt", "raw", "hybrid"])
+    p.add_argument("--chunk-size", type=int, default=150)
+    p.add_argument("--overlap", type=int, default=20)
+    p.add_argument("--chunking-mode", default="overlap", choices=["overlap", "paragraph"])
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--extract-workers", type=int, default=None,
+                   help="PDF extraction processes (default: PDF_EXTRACT_WORKERS)")
+    p.add_argument("--repeat", type=int, default=1, help="Runs per document (fastest kept)")
+    p.add_argument("--output", help="Write the results to this JSON file")
+    p.add_argument("--compare", metavar="BASELINE", help="Baseline JSON to check against")
+    p.add_argument("--against", metavar="RESULTS",
+                   help="With --compare: saved results to check instead of running")
+    p.add_argument("--tolerance", type=float, default=0.2,
+                   help="Allowed relative slowdown or memory growth")
+    args = p.parse_args()
+
+    if args.against:
+        if not args.compare:
+            p.error("--against needs --compare")
+        with open(args.against) as f:
+            current = json.load(f)
+    else:
+        corpus = synthetic_corpus(args.corpus_dir, args.pages, args.words_per_page, args.seed)
+        corpus += [(os.path.basename(path), path) for path in args.documents]
+        if not corpus:
+            p.error("nothing to run: give --pages and/or --documents")
+        settings = {key: getattr(args, key) for key in SETTINGS}
+        current = run_suite(corpus, settings, args.repeat)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+            print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
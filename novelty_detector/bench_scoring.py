@@ -0,0 +1,177 @@
+"""
+Micro-benchmark for NoveltyDetector.calculate_novelty_scores.
+
+Compares the batched kNN scoring against the previous implementation (one
+FAISS search per chunk plus NumPy masking) on random unit vectors, and checks
+that both produce the same scores. No models or providers are loaded.
+
+  python bench_scoring.py                      # 1k, 2k and 5k chunks, dim 384
+  python bench_scoring.py --sizes 2000 --dim 1024 --k 10
+
+--index-sweep instead measures recall@k, query latency and novelty-score error
+of the approximate indexes in vector_index.py against the exact flat index, on
+clustered vectors (closer to real embeddings than uniform noise):
+
+  python bench_scoring.py --index-sweep --sizes 200000 --queries 1000
+"""
+
+import argparse
+import time
+from typing import List
+
+import faiss
+import numpy as np
+
+from novelty_detector import NoveltyDetector
+from profiler import StageProfiler
+from vector_index import create_index, set_search_params
+
+
+def random_embeddings(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    vecs = rng.standard_normal((n, dim)).astype("float32")
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def clustered_embeddings(n: int, dim: int, clusters: int = 200, spread: float = 0.6,
+                         seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random topic centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype("float32")
+    vecs = centres[rng.integers(0, clusters, n)]
+    vecs += spread * rng.standard_normal((n, dim)).astype("float32")
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def make_detector(embeddings: np.ndarray) -> NoveltyDetector:
+    """A bare NoveltyDetector with a flat index over embeddings (skips __init__)."""
+    detector = NoveltyDetector.__new__(NoveltyDetector)
+    detector.embeddings = embeddings
+    detector.chunk_prompts = [f"chunk {i}" for i in range(len(embeddings))]
+    detector.index = faiss.IndexFlatIP(embeddings.shape[1])
+    detector.index.add(embeddings)
+    detector.profiler = StageProfiler()
+    return detector
+
+
+def per_row_scores(detector: NoveltyDetector, k: int) -> List[float]:
+    """The old scoring loop: one index.search call per chunk."""
+    scores = []
+    for i in range(len(detector.embeddings)):
+        distances, indices = detector.index.search(detector.embeddings[i:i+1], k + 1)
+        mask = indices[0] != i
+        scores.append(float(1.0 - np.mean(distances[0][mask][:k])))
+    return scores
+
+
+def best_time(fn, repeats: int) -> float:
+    """Fastest of `repeats` timed calls (after one warm-up call)."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(sizes: List[int], dim: int, k: int, repeats: int = 3):
+    print(f"{'chunks':>8} {'per-row (s)':>12} {'batched (s)':>12} {'speedup':>8} {'max |diff|':>11}")
+    for n in sizes:
+        detector = make_detector(random_embeddings(n, dim))
+
+        baseline = per_row_scores(detector, k)
+        batched = [r["novelty_score"] for r in detector.calculate_novelty_scores(k)]
+        per_row_time = best_time(lambda: per_row_scores(detector, k), repeats)
+        batched_time = best_time(lambda: detector.calculate_novelty_scores(k), repeats)
+
+        diff = float(np.max(np.abs(np.array(baseline) - np.array(batched))))
+        print(f"{n:>8} {per_row_time:>12.3f} {batched_time:>12.3f} "
+              f"{per_row_time / batched_time:>7.1f}x {diff:>11.2e}")
+
+
+INDEX_SWEEP = [
+    ("flat", {}),
+    ("hnsw", {"ef_search": 16}),
+    ("hnsw", {"ef_search": 64}),
+    ("hnsw", {"ef_search": 128}),
+    ("ivfpq", {"nprobe": 4}),
+    ("ivfpq", {"nprobe": 16}),
+    ("ivfpq", {"nprobe": 64}),
+]
+
+
+def neighbours_without_self(distances, indices, query_ids, k):
+    """Drop each query's own id (or the last hit if absent), keep k results."""
+    is_self = indices == query_ids[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    n = len(query_ids)
+    return distances[keep].reshape(n, k), indices[keep].reshape(n, k)
+
+
+def run_index_sweep(n: int, dim: int, k: int, n_queries: int):
+    """Recall/latency/score error of each index configuration vs exact search."""
+    corpus = clustered_embeddings(n, dim)
+    query_ids = np.random.default_rng(1).choice(n, min(n_queries, n), replace=False)
+    queries = corpus[query_ids]
+
+    # Exact neighbours of the sampled queries against the whole corpus
+    true_dist = np.empty((len(queries), k + 1), dtype="float32")
+    true_idx = np.empty((len(queries), k + 1), dtype="int64")
+    for start in range(0, len(queries), 256):
+        sims = queries[start:start + 256] @ corpus.T
+        top = np.argpartition(-sims, k, axis=1)[:, :k + 1]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        true_idx[start:start + 256] = np.take_along_axis(top, order, axis=1)
+        true_dist[start:start + 256] = np.take_along_axis(top_sims, order, axis=1)
+    true_dist, true_idx = neighbours_without_self(true_dist, true_idx, query_ids, k)
+    true_novelty = 1.0 - true_dist.mean(axis=1)
+
+    print(f"corpus={n} dim={dim} k={k} queries={len(queries)}")
+    print(f"{'index':<18} {'build (s)':>10} {'ms/query':>9} {'recall@k':>9} "
+          f"{'mean |dnov|':>12} {'max |dnov|':>11}")
+    for kind, params in INDEX_SWEEP:
+        start = time.perf_counter()
+        index = create_index(corpus, kind)
+        build = time.perf_counter() - start
+        set_search_params(index, **params)
+
+        index.search(queries[:10], k + 1)
+        start = time.perf_counter()
+        dist, idx = index.search(queries, k + 1)
+        latency = (time.perf_counter() - start) * 1000 / len(queries)
+        dist, idx = neighbours_without_self(dist, idx, query_ids, k)
+
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(idx.tolist(), true_idx.tolist())])
+        found = idx >= 0
+        novelty = 1.0 - np.where(found, dist, 0).sum(axis=1) / np.maximum(found.sum(axis=1), 1)
+        err = np.abs(novelty - true_novelty)
+        label = kind + "".join(f" {key}={val}" for key, val in params.items())
+        print(f"{label:<18} {build:>10.2f} {latency:>9.3f} {recall:>9.3f} "
+              f"{err.mean():>12.4f} {err.max():>11.4f}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark novelty kNN scoring")
+    p.add_argument("--sizes", default="1000,2000,5000",
+                   help="Comma-separated chunk counts")
+    p.add_argument("--dim", type=int, default=384, help="Embedding dimension")
+    p.add_argument("--k", type=int, default=5, help="Neighbours per chunk")
+    p.add_argument("--repeats", type=int, default=3, help="Timed runs per size (best is kept)")
+    p.add_argument("--index-sweep", action="store_true",
+                   help="Compare approximate FAISS indexes against the flat baseline")
+    p.add_argument("--queries", type=int, default=1000,
+                   help="Sampled query chunks per index in --index-sweep")
+    args = p.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+    if args.index_sweep:
+        for n in sizes:
+            run_index_sweep(n, args.dim, args.k, args.queries)
+    else:
+        run(sizes, args.dim, args.k, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,29 @@
 """
 Provider metadata, pricing data, and cost estimation for novelty detection.
+
+Token counts are exact BPE counts for OpenAI when tiktoken is installed and
+its encodings are loaded, and character-based approximations otherwise.
+Loading an encoding downloads its BPE file on first use (cached under
+TIKTOKEN_CACHE_DIR), so it never happens on a caller's thread: the server
+starts load_tiktoken_encodings at startup, and counts made before it finishes
+fall back to the approximation. Estimates take an optional
+calibration (see usage_log.py) built from recorded usage of past runs: the
+ratio of API-reported to estimated input tokens, the mean reply length and
+the measured chunk throughput of the prompt and embedding stages, from which
+the wall-clock time of a job is predicted.
 """
 
-# Pricing per 1K tokens (USD)
+import math
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pricing per 1K tokens (USD). max_concurrency caps in-flight prompt-generation
+# calls per provider across the whole process (local Ollama serialises on the GPU);
+# max_concurrent_jobs caps background upload jobs running against the provider.
+# call_seconds is the typical latency of one prompt call until usage is recorded.
 PROVIDERS = {
     "ollama": {
         "name": "Ollama (Local)",
@@ -16,6 +37,9 @@ PROVIDERS = {
             "gemma2": {"input": 0.0, "output": 0.0},
         },
         "default_model": "qwen2.5:7b",
+        "max_concurrency": 2,
+        "max_concurrent_jobs": 1,
+        "call_seconds": 4.0,
     },
     "google": {
         "name": "Google Gemini",
@@ -27,6 +51,9 @@ PROVIDERS = {
             "gemini-1.5-flash": {"input": 0.000075, "output": 0.00030},
         },
         "default_model": "gemini-2.0-flash",
+        "max_concurrency": 8,
+        "max_concurrent_jobs": 2,
+        "call_seconds": 1.0,
     },
     "openai": {
         "name": "OpenAI",
@@ -38,6 +65,9 @@ PROVIDERS = {
             "gpt-4o": {"input": 0.0025, "output": 0.0100},
         },
         "default_model": "gpt-4o-mini",
+        "max_concurrency": 8,
+        "max_concurrent_jobs": 2,
+        "call_seconds": 1.5,
     },
     "anthropic": {
         "name": "Anthropic Claude",
@@ -49,83 +79,169 @@ PROVIDERS = {
             "claude-haiku-4-5-20251001": {"input": 0.0008, "output": 0.004},
         },
         "default_model": "claude-sonnet-4-20250514",
+        "max_concurrency": 4,
+        "max_concurrent_jobs": 2,
+        "call_seconds": 2.5,
     },
 }
 
+# texts_per_second: embedding throughput until usage is recorded
 EMBEDDING_PROVIDERS = {
     "local": {
         "name": "Sentence Transformers (Local)",
         "cost_per_1k_tokens": 0.0,
         "models": ["BAAI/bge-large-en-v1.5", "all-MiniLM-L6-v2", "all-mpnet-base-v2"],
         "default_model": "BAAI/bge-large-en-v1.5",
+        "texts_per_second": 40,
+    },
+    "onnx": {
+        "name": "Sentence Transformers (Local, int8 ONNX)",
+        "cost_per_1k_tokens": 0.0,
+        "models": ["BAAI/bge-large-en-v1.5", "all-MiniLM-L6-v2", "all-mpnet-base-v2"],
+        "default_model": "BAAI/bge-large-en-v1.5",
+        "texts_per_second": 120,
     },
     "ollama": {
         "name": "Ollama Embeddings (Local)",
         "cost_per_1k_tokens": 0.0,
         "models": ["nomic-embed-text", "mxbai-embed-large"],
         "default_model": "nomic-embed-text",
+        "texts_per_second": 30,
     },
     "openai": {
         "name": "OpenAI Embeddings",
         "cost_per_1k_tokens": 0.00002,
         "models": ["text-embedding-3-small", "text-embedding-3-large"],
         "default_model": "text-embedding-3-small",
+        "texts_per_second": 400,
     },
 }
 
+# Characters per token where no local tokenizer is available (English prose);
+# recorded usage corrects the remaining error per provider
+CHARS_PER_TOKEN = {"openai": 4.0, "anthropic": 3.5, "google": 4.0, "ollama": 3.8}
+# Prompt-generation input besides the chunk: system prompt, instructions and
+# up to 200 characters of context on each side (see llm_providers.prompt_text)
+PROMPT_OVERHEAD_TOKENS = 210
+# Reply length until calibrated: a 2-3 sentence prompt (~60 words)
+DEFAULT_OUTPUT_TOKENS = 80
 
-def estimate_cost(word_count: int, chunk_size: int = 150, overlap: int = 20,
-                  llm_provider: str = "ollama", llm_model: str = None,
-                  embedding_provider: str = "local") -> dict:
+_tiktoken_encodings: Dict[str, object] = {}  # model -> encoding, or None if unavailable
+_tiktoken_requested: set = set()
+_tiktoken_lock = threading.Lock()
+
+
+def _load_tiktoken(models: Iterable[str]):
+    for model in models:
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+        except ImportError:
+            encoding = None
+        except Exception as e:  # the BPE file cannot be fetched
+            logger.warning(f"tiktoken encoding for {model} unavailable, "
+                           f"using character estimates: {e}")
+            encoding = None
+        _tiktoken_encodings[model] = encoding
+
+
+def load_tiktoken_encodings(models: Iterable[str] = None, background: bool = False):
     """
-    Estimate cost for analyzing a document.
+    Load the tiktoken encodings of OpenAI models (default: all priced models).
 
     Args:
-        word_count: Number of words in the document
-        chunk_size: Words per chunk
-        overlap: Overlap between chunks
-        llm_provider: LLM provider name
-        llm_model: Specific model (uses provider default if None)
-        embedding_provider: Embedding provider name
-
-    Returns:
-        Dict with cost breakdown
+        models: Model names
+        background: Load on a daemon thread and return at once
     """
-    if word_count <= 0:
-        return {"total_cost": 0.0, "chunks": 0, "llm_cost": 0.0, "embedding_cost": 0.0}
+    with _tiktoken_lock:
+        pending = [m for m in (models or PROVIDERS["openai"]["models"])
+                   if m not in _tiktoken_requested]
+        _tiktoken_requested.update(pending)
+    if not pending:
+        return
+    if background:
+        threading.Thread(target=_load_tiktoken, args=(pending,),
+                         name="tiktoken-load", daemon=True).start()
+    else:
+        _load_tiktoken(pending)
 
-    # Calculate number of chunks
-    step = max(chunk_size - overlap, 1)
-    chunks = max(1, (word_count - overlap + step - 1) // step)
 
-    # Get provider pricing
+def _tiktoken_encoding(model: str):
+    """Loaded tiktoken encoding for an OpenAI model, or None (not loaded yet or unavailable)."""
+    if model not in _tiktoken_encodings:
+        load_tiktoken_encodings([model], background=True)
+    return _tiktoken_encodings.get(model)
+
+
+def token_counter(llm_provider: str, llm_model: str = None) -> str:
+    """'tiktoken' if count_tokens is exact for this provider, else 'approx'."""
+    if llm_provider == "openai":
+        model = llm_model or PROVIDERS["openai"]["default_model"]
+        if _tiktoken_encoding(model) is not None:
+            return "tiktoken"
+    return "approx"
+
+
+def count_tokens(text: str, llm_provider: str = "openai", llm_model: str = None) -> int:
+    """Tokens in text for the provider's model (exact with tiktoken for OpenAI)."""
+    if not text:
+        return 0
+    if llm_provider == "openai":
+        encoding = _tiktoken_encoding(llm_model or PROVIDERS["openai"]["default_model"])
+        if encoding is not None:
+            return len(encoding.encode(text))
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN.get(llm_provider, 4.0)))
+
+
+def call_cost(llm_provider: str, llm_model: str = None, chunk_size: int = 150) -> float:
+    """Estimated USD cost of one prompt-generation call for a chunk of chunk_size words."""
     provider = PROVIDERS.get(llm_provider, PROVIDERS["ollama"])
     model = llm_model or provider["default_model"]
     pricing = provider["models"].get(model, {"input": 0.0, "output": 0.0})
+    input_tokens = chunk_size * 1.3 + PROMPT_OVERHEAD_TOKENS
+    return (input_tokens * pricing["input"] + DEFAULT_OUTPUT_TOKENS * pricing["output"]) / 1000
 
-    # Estimate tokens per chunk
-    # Input: chunk text + context (~160 words) + prompt template, * 1.3 for tokenization
-    input_tokens_per_chunk = (chunk_size + 160) * 1.3
-    # Output: ~2-3 sentence response (~60 words)
-    output_tokens_per_chunk = 60 * 1.3
 
-    llm_cost = chunks * (
-        input_tokens_per_chunk * pricing["input"] / 1000 +
-        output_tokens_per_chunk * pricing["output"] / 1000
-    )
+def _estimate(chunks: int, input_tokens: float, word_count: int, llm_provider: str,
+              llm_model: Optional[str], embedding_provider: str,
+              calibration: Optional[Dict], counter: str) -> dict:
+    """Price and time a job of chunks prompt calls with input_tokens in total."""
+    calibration = calibration or {}
+    provider = PROVIDERS.get(llm_provider, PROVIDERS["ollama"])
+    model = llm_model or provider["default_model"]
+    pricing = provider["models"].get(model, {"input": 0.0, "output": 0.0})
+
+    input_tokens *= calibration.get("input_ratio") or 1.0
+    output_tokens = chunks * (calibration.get("output_tokens") or DEFAULT_OUTPUT_TOKENS)
+    llm_cost = (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1000
 
-    # Embedding cost
+    # Embedding cost (each chunk's prompt is embedded)
     embed_provider = EMBEDDING_PROVIDERS.get(embedding_provider, EMBEDDING_PROVIDERS["local"])
-    embed_cost = chunks * output_tokens_per_chunk * embed_provider["cost_per_1k_tokens"] / 1000
+    embed_cost = output_tokens * embed_provider["cost_per_1k_tokens"] / 1000
 
-    total = llm_cost + embed_cost
+    # Wall time: measured stage throughput, else concurrency cap / call latency
+    call_seconds = calibration.get("call_seconds") or provider["call_seconds"]
+    prompt_rate = (calibration.get("prompt_chunks_per_second")
+                   or provider["max_concurrency"] / call_seconds)
+    embed_rate = (calibration.get("embed_chunks_per_second")
+                  or embed_provider["texts_per_second"])
+    seconds = chunks / prompt_rate + chunks / embed_rate
 
+    total = llm_cost + embed_cost
     return {
         "total_cost": round(total, 6),
         "llm_cost": round(llm_cost, 6),
         "embedding_cost": round(embed_cost, 6),
         "chunks": chunks,
         "word_count": word_count,
+        "input_tokens": int(round(input_tokens)),
+        "output_tokens": int(round(output_tokens)),
+        "estimated_seconds": round(seconds, 1),
+        "token_counter": counter,
+        "calibrated": bool(calibration.get("calls") or calibration.get("runs")),
         "provider": llm_provider,
         "model": model,
         "embedding_provider": embedding_provider,
@@ -133,12 +249,86 @@ def estimate_cost(word_count: int, chunk_size: int = 150, overlap: int = 20,
     }
 
 
+def estimate_cost(word_count: int, chunk_size: int = 150, overlap: int = 20,
+                  llm_provider: str = "ollama", llm_model: str = None,
+                  embedding_provider: str = "local", calibration: Optional[Dict] = None) -> dict:
+    """
+    Estimate cost and wall time for analyzing a document from its word count.
+    estimate_chunks_cost is more accurate when the chunks are at hand.
+
+    Args:
+        word_count: Number of words in the document
+        chunk_size: Words per chunk
+        overlap: Overlap between chunks
+        llm_provider: LLM provider name
+        llm_model: Specific model (uses provider default if None)
+        embedding_provider: Embedding provider name
+        calibration: Corrections from recorded usage (UsageLog.calibration)
+
+    Returns:
+        Dict with cost breakdown, token counts and estimated_seconds
+    """
+    if word_count <= 0:
+        return {"total_cost": 0.0, "chunks": 0, "llm_cost": 0.0, "embedding_cost": 0.0,
+                "estimated_seconds": 0.0}
+
+    # Calculate number of chunks
+    step = max(chunk_size - overlap, 1)
+    chunks = max(1, (word_count - overlap + step - 1) // step)
+
+    # ~1.3 tokens per word of chunk text, plus the prompt template and context
+    input_tokens = chunks * (chunk_size * 1.3 + PROMPT_OVERHEAD_TOKENS)
+    return _estimate(chunks, input_tokens, word_count, llm_provider, llm_model,
+                     embedding_provider, calibration, "approx")
+
+
+def estimate_chunks_cost(contexts: Iterable[Tuple[str, str, str]], llm_provider: str = "ollama",
+                         llm_model: str = None, embedding_provider: str = "local",
+                         calibration: Optional[Dict] = None) -> dict:
+    """
+    Estimate cost and wall time from a document's actual chunks, counting the
+    tokens of each prompt-generation request as it would be sent.
+
+    Args:
+        contexts: (before_context, chunk_text, after_context) per chunk
+        llm_provider: LLM provider name
+        llm_model: Specific model (uses provider default if None)
+        embedding_provider: Embedding provider name
+        calibration: Corrections from recorded usage (UsageLog.calibration)
+
+    Returns:
+        Dict as estimate_cost
+    """
+    from llm_providers import prompt_text  # llm_providers imports this module
+
+    chunks = words = input_tokens = 0
+    for before, chunk_text, after in contexts:
+        chunks += 1
+        words += len(chunk_text.split())
+        input_tokens += count_tokens(prompt_text(chunk_text, before, after),
+                                     llm_provider, llm_model)
+    if not chunks:
+        return estimate_cost(0)
+    return _estimate(chunks, input_tokens, words, llm_provider, llm_model, embedding_provider,
+                     calibration, token_counter(llm_provider, llm_model))
+
+
 def estimate_cost_all_providers(word_count: int, chunk_size: int = 150,
-                                 overlap: int = 20) -> list:
-    """Estimate cost for all providers for comparison."""
+                                 overlap: int = 20, contexts=None, calibrations=None) -> list:
+    """
+    Estimate cost for all providers for comparison: from contexts (a list of
+    chunk contexts, see estimate_chunks_cost) when given, else from word_count.
+    calibrations maps provider id to its calibration.
+    """
+    calibrations = calibrations or {}
     results = []
     for provider_id in PROVIDERS:
-        est = estimate_cost(word_count, chunk_size, overlap, llm_provider=provider_id)
+        if contexts is not None:
+            est = estimate_chunks_cost(contexts, llm_provider=provider_id,
+                                       calibration=calibrations.get(provider_id))
+        else:
+            est = estimate_cost(word_count, chunk_size, overlap, llm_provider=provider_id,
+                                calibration=calibrations.get(provider_id))
         est["provider_name"] = PROVIDERS[provider_id]["name"]
         est["tier"] = PROVIDERS[provider_id]["tier"]
         est["requires_key"] = PROVIDERS[provider_id]["requires_key"]
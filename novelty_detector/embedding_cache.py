@@ -0,0 +1,165 @@
+"""
+Content-addressed embedding cache shared by the novelty detector and the
+submission validator.
+
+Vectors are stored as float32 blobs in SQLite, keyed on (model_key,
+sha256(text)), where model_key names both provider and model (e.g.
+"local:BAAI/bge-large-en-v1.5") so vectors from different models never mix.
+encode_with_cache() looks every text up first and only sends the misses to the
+encoder, in batches of the requested size. Like the prompt cache, the
+database is shared by all server workers and trimmed least-recently-used
+first once it exceeds max_bytes (see sqlite_lru.py).
+"""
+
+import os
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from sqlite_lru import SQLiteLRUStore
+
+# Relative defaults live next to this module, not in the working directory
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "embedding_cache.sqlite"))
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", 1024))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+
+# Texts per encode call, per embedding provider
+EMBED_BATCH_SIZES = {
+    "local": int(os.getenv("EMBED_BATCH_SIZE_LOCAL", 64)),
+    "onnx": int(os.getenv("EMBED_BATCH_SIZE_ONNX", 64)),
+    "ollama": int(os.getenv("EMBED_BATCH_SIZE_OLLAMA", 32)),
+    "openai": int(os.getenv("EMBED_BATCH_SIZE_OPENAI", 256)),
+}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(SQLiteLRUStore):
+    """SQLite-backed float32 vector cache with size-based LRU eviction (see sqlite_lru)."""
+
+    table = "embeddings"
+    schema = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model_key TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (model_key, text_hash)
+        );
+        CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)
+    """
+    key_columns = ("model_key", "text_hash")
+    size_expr = "LENGTH({row}.vector)"
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        """
+        Args:
+            path: SQLite file path (':memory:' for a throwaway cache)
+            max_bytes: Approximate size cap for stored vectors
+        """
+        super().__init__(
+            path or EMBEDDING_CACHE_PATH,
+            max_bytes if max_bytes is not None else int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024))
+
+    def get_many(self, model_key: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Cached vector for each text, or None where missing."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model_key = ? AND text_hash IN ({marks})",
+                    [model_key, *part]).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            self._touch((model_key, h) for h in found)
+            result = [found.get(h) for h in hashes]
+            hit_count = sum(1 for v in result if v is not None)
+            self.hits += hit_count
+            self.misses += len(result) - hit_count
+        return result
+
+    def put_many(self, model_key: str, texts: Sequence[str], vectors: np.ndarray):
+        """Store vectors (one row per text) and evict if over the size cap."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = time.time()
+        rows = [
+            (model_key, text_hash(t), int(v.shape[0]), v.tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_key, text_hash, dim, vector, last_used) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            self._evict()
+            self._conn.commit()
+
+
+def encode_with_cache(texts: Sequence[str], model_key: str,
+                      encode_batch: Callable[[List[str]], np.ndarray],
+                      cache: Optional[EmbeddingCache] = None,
+                      batch_size: int = 64) -> np.ndarray:
+    """
+    Embed texts, reusing cached vectors and encoding only the misses.
+
+    Args:
+        texts: Texts to embed
+        model_key: Provider/model identifier the vectors belong to
+        encode_batch: Function embedding a list of texts -> (n, dim) array
+        cache: EmbeddingCache, or None to encode everything
+        batch_size: Max texts per encode_batch call
+
+    Returns:
+        float32 array of shape (len(texts), dim), in input order
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    cached = cache.get_many(model_key, texts) if cache is not None else [None] * len(texts)
+
+    # Encode each distinct missing text once
+    missing: Dict[str, List[int]] = {}
+    for i, (text, vec) in enumerate(zip(texts, cached)):
+        if vec is None:
+            missing.setdefault(text, []).append(i)
+
+    if missing:
+        todo = list(missing)
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            vectors = np.asarray(encode_batch(batch), dtype=np.float32)
+            if cache is not None:
+                cache.put_many(model_key, batch, vectors)
+            for text, vec in zip(batch, vectors):
+                for i in missing[text]:
+                    cached[i] = vec
+
+    return np.vstack(cached).astype(np.float32)
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide embedding cache, or None when EMBEDDING_CACHE_ENABLED=0."""
+    global _default_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
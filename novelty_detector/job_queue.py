@@ -0,0 +1,325 @@
+"""
+Background job queue for long-running analyses (PDF uploads).
+
+Jobs run on a small pool of worker threads inside the server process; their
+state lives in a SQLite table so any server worker can answer status polls.
+Each job is tied to an LLM provider and at most provider_job_limit(provider)
+jobs per provider run at once in each process: with several server workers
+the cap applies per worker. A queued job whose provider is saturated is
+skipped, not blocking jobs for other providers behind it.
+
+Job functions receive a progress callback and return a JSON-serialisable
+result. They are plain callables held in memory, so a job only survives as
+long as the queue that accepted it. Each queue records itself as the owner of
+its jobs and keeps a heartbeat in the database; queued or running jobs whose
+owner has stopped beating (its process exited or was killed) are marked
+failed by any live queue. Jobs of other live processes are left alone.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cost_config import PROVIDERS
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 7))
+# Minimum seconds between progress writes to SQLite for one job
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", 1.0))
+# Seconds between owner heartbeats; an owner silent for 3 intervals is gone
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 10.0))
+
+ProgressCallback = Callable[..., None]
+
+
+def provider_job_limit(provider_name: str) -> int:
+    """
+    Max concurrently running jobs for a provider in one process (env
+    JOB_MAX_PER_PROVIDER overrides).
+    """
+    override = os.getenv("JOB_MAX_PER_PROVIDER")
+    if override:
+        return max(1, int(override))
+    return PROVIDERS.get(provider_name, {}).get("max_concurrent_jobs", 2)
+
+
+class JobQueue:
+    """SQLite-backed job table with a provider-aware worker thread pool."""
+
+    def __init__(self, path: str = None, workers: int = None,
+                 limit: Callable[[str], int] = provider_job_limit,
+                 heartbeat_interval: float = None):
+        """
+        Args:
+            path: SQLite file path (':memory:' for a throwaway queue)
+            workers: Worker threads (default: JOB_WORKERS)
+            limit: Max running jobs for a provider name
+            heartbeat_interval: Seconds between owner heartbeats
+                                (default: JOB_HEARTBEAT_INTERVAL)
+        """
+        self.path = path or JOB_DB_PATH
+        self.limit = limit
+        self.owner = uuid.uuid4().hex
+        self.heartbeat_interval = (JOB_HEARTBEAT_INTERVAL if heartbeat_interval is None
+                                   else heartbeat_interval)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()            # SQLite connection
+        self._cond = threading.Condition()       # pending / running bookkeeping
+        self._pending: List[Tuple[str, str, Callable]] = []
+        self._running: Dict[str, int] = {}
+        self._live: Dict[str, Dict] = {}         # latest progress of running jobs
+        self._closed = False
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                provider TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER,
+                params TEXT,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                owner TEXT
+            )
+        """)
+        if "owner" not in [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_owners (
+                id TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                heartbeat REAL NOT NULL
+            )
+        """)
+        self._conn.execute("DELETE FROM jobs WHERE created < ?",
+                           (time.time() - JOB_RETENTION_DAYS * 86400,))
+        self._conn.commit()
+        self._heartbeat()
+
+        n_workers = JOB_WORKERS if workers is None else workers
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(max(1, n_workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+        self._beat_thread = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+        self._beat_thread.start()
+
+    # ── Ownership ─────────────────────────────────────────────────────────
+
+    def _heartbeat(self):
+        """Mark this queue alive, then fail the jobs of queues that have gone."""
+        now = time.time()
+        expired = now - 3 * self.heartbeat_interval
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job_owners (id, pid, heartbeat) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.owner, os.getpid(), now))
+            # Job callables live in their owner's memory and die with it
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', "
+                "error = 'Interrupted by server restart', finished = ? "
+                "WHERE status IN ('queued', 'running') AND (owner IS NULL OR owner NOT IN "
+                "(SELECT id FROM job_owners WHERE heartbeat >= ?))", (now, expired))
+            self._conn.execute("DELETE FROM job_owners WHERE heartbeat < ?", (expired,))
+            self._conn.commit()
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self._heartbeat()
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue heartbeat failed: {e}")
+
+    # ── Submission and status ─────────────────────────────────────────────
+
+    def submit(self, kind: str, provider: str, fn: Callable[[ProgressCallback], Any],
+               params: Optional[Dict] = None) -> str:
+        """
+        Queue a job.
+
+        Args:
+            kind: Job type shown in status (e.g. 'upload')
+            provider: LLM provider the job uses (for the per-provider cap)
+            fn: Called as fn(progress) on a worker thread; progress accepts
+                done=, total= and stage= keywords. Its return value is the
+                job result.
+            params: JSON-serialisable parameters stored with the job (no secrets)
+
+        Returns:
+            Job id
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, provider, status, stage, params, created, owner) "
+                "VALUES (?, ?, ?, 'queued', 'queued', ?, ?, ?)",
+                (job_id, kind, provider, json.dumps(params or {}), time.time(), self.owner))
+            self._conn.commit()
+        with self._cond:
+            self._pending.append((job_id, provider, fn))
+            self._cond.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Job status with progress and an ETA for running jobs, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, provider, status, stage, chunks_done, chunks_total, "
+                "params, error, created, started, finished FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "provider", "status", "stage", "chunks_done", "chunks_total",
+                "params", "error", "created", "started", "finished")
+        job = dict(zip(keys, row))
+        job["params"] = json.loads(job["params"]) if job["params"] else {}
+        with self._cond:
+            live = self._live.get(job_id)
+            if live:
+                job.update(live)
+            if job["status"] == "queued":
+                queued = [j for j, _, _ in self._pending]
+                job["queue_position"] = queued.index(job_id) + 1 if job_id in queued else None
+        job["eta_seconds"] = self._eta(job)
+        return job
+
+    @staticmethod
+    def _eta(job: Dict) -> Optional[float]:
+        done, total = job["chunks_done"], job["chunks_total"]
+        if job["status"] != "running" or not done or not total or not job["started"]:
+            return 0.0 if job["status"] == "done" else None
+        elapsed = time.time() - job["started"]
+        return round(elapsed / done * max(total - done, 0), 1)
+
+    def result(self, job_id: str) -> Optional[Any]:
+        """Result of a finished job, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def stats(self) -> Dict:
+        """Job counts by status and running jobs per provider."""
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        with self._cond:
+            running = {p: n for p, n in self._running.items() if n}
+        return {"jobs": counts, "running_by_provider": running, "workers": len(self._threads)}
+
+    # ── Workers ───────────────────────────────────────────────────────────
+
+    def _next_job(self) -> Optional[Tuple[str, str, Callable]]:
+        """Oldest pending job whose provider is below its limit (cond held)."""
+        for i, (job_id, provider, fn) in enumerate(self._pending):
+            if self._running.get(provider, 0) < self.limit(provider):
+                del self._pending[i]
+                self._running[provider] = self._running.get(provider, 0) + 1
+                return job_id, provider, fn
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+            job_id, provider, fn = job
+            try:
+                self._run(job_id, fn)
+            finally:
+                with self._cond:
+                    self._running[provider] -= 1
+                    self._live.pop(job_id, None)
+                    self._cond.notify_all()
+
+    def _run(self, job_id: str, fn: Callable[[ProgressCallback], Any]):
+        started = time.time()
+        with self._cond:
+            self._live[job_id] = {"status": "running", "stage": "starting", "started": started}
+        self._update(job_id, status="running", stage="starting", started=started)
+        last_write = [0.0]
+
+        def progress(done: int = None, total: int = None, stage: str = None):
+            fields = {k: v for k, v in (("chunks_done", done), ("chunks_total", total),
+                                        ("stage", stage)) if v is not None}
+            with self._cond:
+                live = self._live.setdefault(job_id, {})
+                stage_changed = stage is not None and stage != live.get("stage")
+                live.update(fields)
+            now = time.time()
+            if stage_changed or now - last_write[0] >= JOB_PROGRESS_INTERVAL:
+                last_write[0] = now
+                self._update(job_id, **fields)
+
+        try:
+            result = fn(progress)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            self._update(job_id, status="failed", stage="failed", error=str(e),
+                         finished=time.time(), **self._live_progress(job_id))
+            return
+        self._update(job_id, status="done", stage="done", result=json.dumps(result),
+                     finished=time.time(), **self._live_progress(job_id))
+
+    def _live_progress(self, job_id: str) -> Dict:
+        with self._cond:
+            live = self._live.get(job_id, {})
+            return {k: live[k] for k in ("chunks_done", "chunks_total") if k in live}
+
+    def _update(self, job_id: str, **fields):
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?",
+                               (*fields.values(), job_id))
+            self._conn.commit()
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers once the pending jobs have been taken."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._stop.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            self._beat_thread.join()
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide JobQueue, started on first use."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
@@ -3,19 +3,40 @@ LLM Provider Abstraction Layer
 
 Provides a unified interface for different LLM backends used in novelty detection.
 Supports Anthropic, OpenAI, Google Gemini, Ollama (local), and a keyword-based fallback.
+RouterProvider picks among the discovered providers per call, using rolling
+latency and error statistics, cost_config pricing and circuit breakers.
 
 Adapted from readingnovelty project and integrated with CBM cost_config and OllamaClient.
 """
 
 import os
+import time
 import logging
-from typing import Optional, Dict
+import threading
+from collections import deque
+from typing import Callable, Optional, Dict, List, Tuple
 
-from ollama_client import OllamaClient
-from cost_config import PROVIDERS
+from ollama_client import OllamaClient, get_ollama_client
+from cost_config import PROVIDERS, call_cost
+from model_registry import ModelRegistry, pool_key
 
 logger = logging.getLogger(__name__)
 
+# Provider routing (RouterProvider): policy, latency SLA for 'cheapest',
+# minimum tier for 'quality', and the rolling window of calls per provider
+ROUTER_POLICIES = ("cheapest", "fastest", "quality")
+ROUTER_POLICY = os.getenv("LLM_ROUTER_POLICY", "cheapest")
+ROUTER_SLA_SECONDS = float(os.getenv("LLM_ROUTER_SLA_SECONDS", 10))
+ROUTER_MIN_TIER = os.getenv("LLM_ROUTER_MIN_TIER", "Free")
+ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", 50))
+# Circuit breaker: open after this many consecutive failures, retry after the
+# cooldown (doubling up to BREAKER_MAX_COOLDOWN while trial calls keep failing)
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 3))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+BREAKER_MAX_COOLDOWN = float(os.getenv("LLM_BREAKER_MAX_COOLDOWN", 600))
+
+TIERS = ("Free", "Budget", "Mid", "Premium")
+
 
 SYSTEM_PROMPT = """You are an expert at analyzing text and creating prompts.
 Given a piece of text and its surrounding context, generate a concise prompt that could
@@ -38,6 +59,40 @@ Generate a concise prompt (2-3 sentences) that captures the essence of the targe
 and could be used to regenerate it. Respond with ONLY the prompt."""
 
 
+def prompt_text(chunk: str, context_before: str = "", context_after: str = "") -> str:
+    """Full prompt-generation input (system prompt and user message) for one chunk."""
+    return SYSTEM_PROMPT + "\n\n" + _build_user_message(chunk, context_before, context_after)
+
+
+# Token usage reported by the provider API for the calling thread's last request
+_usage = threading.local()
+
+
+def _report_usage(input_tokens, output_tokens):
+    if isinstance(input_tokens, int) and isinstance(output_tokens, int):
+        _usage.tokens = (input_tokens, output_tokens)
+
+
+def take_usage() -> Optional[Tuple[int, int]]:
+    """
+    (input, output) tokens the API reported for this thread's last call, or
+    None if it reported none (Ollama, keyword fallback). Cleared on read.
+    """
+    tokens = getattr(_usage, "tokens", None)
+    _usage.tokens = None
+    return tokens
+
+
+def take_route() -> Optional[Tuple[str, Optional[str]]]:
+    """
+    (provider name, model) that served this thread's last RouterProvider
+    call, or None if the last call was not routed. Cleared on read.
+    """
+    route = getattr(_usage, "route", None)
+    _usage.route = None
+    return route
+
+
 class LLMProvider:
     """Base class for LLM providers."""
 
@@ -57,9 +112,16 @@ class LLMProvider:
         raise NotImplementedError
 
     def is_available(self) -> bool:
-        """Check if this provider is ready to use."""
+        """Check if this provider is ready to use (cheap: no network I/O)."""
         return True
 
+    def probe(self) -> bool:
+        """
+        Live health check. May do network I/O, so it is run by the background
+        ProviderMonitor (provider_monitor.py), not on the request path.
+        """
+        return self.is_available()
+
 
 class AnthropicProvider(LLMProvider):
     """Anthropic Claude provider."""
@@ -82,6 +144,8 @@ class AnthropicProvider(LLMProvider):
                 {"role": "user", "content": _build_user_message(chunk, context_before, context_after)}
             ]
         )
+        usage = getattr(message, "usage", None)
+        _report_usage(getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None))
         return message.content[0].text.strip()
 
     def complete(self, prompt: str, system: str = "", max_tokens: int = 1500) -> str:
@@ -116,6 +180,9 @@ class OpenAIProvider(LLMProvider):
             max_tokens=200,
             temperature=0.7
         )
+        usage = getattr(response, "usage", None)
+        _report_usage(getattr(usage, "prompt_tokens", None),
+                      getattr(usage, "completion_tokens", None))
         return response.choices[0].message.content.strip()
 
     def complete(self, prompt: str, system: str = "", max_tokens: int = 1500) -> str:
@@ -138,47 +205,55 @@ class GoogleProvider(LLMProvider):
     name = "google"
 
     def __init__(self, api_key: str, model: str = None):
-        import google.generativeai as genai
+        # A client per instance: the older google.generativeai SDK only had a
+        # process-wide genai.configure(api_key=...), which would make every
+        # pooled instance use whichever user key was configured last
+        from google import genai
         default = PROVIDERS["google"]["default_model"]
-        genai.configure(api_key=api_key)
-        self.genai = genai
+        self.client = genai.Client(api_key=api_key)
         self.model = model or default
 
     def generate_prompt(self, chunk: str, context_before: str = "",
                         context_after: str = "") -> str:
-        model = self.genai.GenerativeModel(self.model)
-        prompt = SYSTEM_PROMPT + "\n\n" + _build_user_message(chunk, context_before, context_after)
-        response = model.generate_content(prompt)
+        response = self.client.models.generate_content(
+            model=self.model, contents=prompt_text(chunk, context_before, context_after))
+        usage = getattr(response, "usage_metadata", None)
+        _report_usage(getattr(usage, "prompt_token_count", None),
+                      getattr(usage, "candidates_token_count", None))
         return response.text.strip()
 
     def complete(self, prompt: str, system: str = "", max_tokens: int = 1500) -> str:
-        model = self.genai.GenerativeModel(self.model)
         full = (system + "\n\n" + prompt) if system else prompt
-        response = model.generate_content(full)
+        response = self.client.models.generate_content(model=self.model, contents=full)
         return response.text.strip()
 
 
 class OllamaProvider(LLMProvider):
-    """Ollama provider using the existing OllamaClient."""
+    """Ollama provider using the shared, connection-pooled OllamaClient."""
 
     name = "ollama"
 
     def __init__(self, client: OllamaClient = None, model: str = None):
         default = PROVIDERS["ollama"]["default_model"]
-        self.client = client or OllamaClient()
+        self.client = client or get_ollama_client()
         self.model = model or default
 
     def is_available(self) -> bool:
-        return self.client.health().get("available", False)
+        # Last health check of the shared client (kept fresh by the provider monitor)
+        health = self.client.last_health()
+        return True if health is None else health.get("available", False)
+
+    def probe(self) -> bool:
+        return self.client.health(refresh=True).get("available", False)
 
     def generate_prompt(self, chunk: str, context_before: str = "",
                         context_after: str = "") -> str:
-        prompt = SYSTEM_PROMPT + "\n\n" + _build_user_message(chunk, context_before, context_after)
-        return self.client.generate(prompt, model=self.model)
+        return self.client.generate(prompt_text(chunk, context_before, context_after),
+                                    model=self.model)
 
     def complete(self, prompt: str, system: str = "", max_tokens: int = 1500) -> str:
         full = (system + "\n\n" + prompt) if system else prompt
-        return self.client.generate(full, model=self.model)
+        return self.client.generate(full, model=self.model, max_tokens=max_tokens)
 
 
 class FallbackProvider(LLMProvider):
@@ -198,12 +273,269 @@ class FallbackProvider(LLMProvider):
         return "[]"
 
 
-def discover_providers(api_keys: Optional[Dict[str, str]] = None) -> Dict[str, LLMProvider]:
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open (one trial call) -> closed."""
+
+    def __init__(self, failures: int = None, cooldown: float = None,
+                 max_cooldown: float = None):
+        self.threshold = failures or BREAKER_FAILURES
+        self.base_cooldown = BREAKER_COOLDOWN if cooldown is None else cooldown
+        self.max_cooldown = BREAKER_MAX_COOLDOWN if max_cooldown is None else max_cooldown
+        self.cooldown = self.base_cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _retry_due(self, now: float) -> bool:
+        return self.state == "open" and now - self.opened_at >= self.cooldown
+
+    def available(self) -> bool:
+        """Whether a call could be let through now (does not claim the trial call)."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            return not self._trial and (self.state == "half_open"
+                                        or self._retry_due(time.monotonic()))
+
+    def allow(self) -> bool:
+        """Claim permission for one call; in half-open state only one trial runs at a time."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self._trial:
+                return False
+            if self.state == "half_open" or self._retry_due(time.monotonic()):
+                self.state = "half_open"
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self.state, self.failures, self.cooldown = "closed", 0, self.base_cooldown
+                return
+            self.failures += 1
+            if self.state == "half_open":
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit opened after {self.failures} failures "
+                                   f"(retry in {self.cooldown:.0f}s)")
+                self.state, self.opened_at = "open", time.monotonic()
+
+
+class ProviderStats:
+    """Rolling latency and error rate of one provider/model, with its circuit breaker."""
+
+    def __init__(self, window: int = None):
+        self.calls: deque = deque(maxlen=window or ROUTER_WINDOW)  # (seconds, ok)
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self.calls.append((seconds, ok))
+        self.breaker.record(ok)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            calls = list(self.calls)
+        latencies = sorted(t for t, ok in calls if ok)
+        return {
+            "calls": len(calls),
+            "error_rate": sum(not ok for _, ok in calls) / len(calls) if calls else 0.0,
+            # None until the provider has succeeded at least once in the window
+            "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p90": latencies[int(0.9 * (len(latencies) - 1))] if latencies else None,
+            "circuit": self.breaker.state,
+        }
+
+
+_provider_stats: Dict[Tuple[str, str], ProviderStats] = {}
+_provider_stats_lock = threading.Lock()
+
+
+def get_provider_stats(provider_name: str, model: Optional[str] = None) -> ProviderStats:
+    """Process-wide rolling stats for a provider/model (shared by all routers)."""
+    key = (provider_name, model or "")
+    with _provider_stats_lock:
+        if key not in _provider_stats:
+            _provider_stats[key] = ProviderStats()
+        return _provider_stats[key]
+
+
+def provider_stats_snapshot() -> Dict[str, Dict]:
+    """Stats of every provider/model a router has called, keyed 'provider:model'."""
+    with _provider_stats_lock:
+        items = list(_provider_stats.items())
+    return {f"{name}:{model}": stats.snapshot() for (name, model), stats in items}
+
+
+class RouterProvider(LLMProvider):
+    """
+    Routes each call to one of several providers by policy:
+
+    - 'cheapest': lowest estimated cost per call among providers meeting the
+      latency SLA (p90 of recent calls; untried providers count as meeting it)
+    - 'fastest': lowest mean latency (untried providers are tried first)
+    - 'quality': highest cost_config tier at or above min_tier, then cheapest
+
+    Providers whose circuit breaker is open, or that the health callback
+    reports down, are skipped; providers with only failures in the recent
+    window rank last under every policy. A failed call moves
+    on to the next provider in the ranking, and when the preferred provider
+    has no free concurrency slot the call spills over to the next one, so
+    throughput holds when a provider slows down or fails.
+    """
+
+    name = "router"
+
+    def __init__(self, providers: Dict[str, LLMProvider], policy: str = None,
+                 sla_seconds: float = None, min_tier: str = None,
+                 slot: Optional[Callable[[str], threading.Semaphore]] = None,
+                 health: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            providers: Providers to route between ('fallback' is ignored)
+            policy: One of ROUTER_POLICIES (default: LLM_ROUTER_POLICY)
+            sla_seconds: Latency SLA for 'cheapest' (default: LLM_ROUTER_SLA_SECONDS)
+            min_tier: Lowest tier for 'quality' (default: LLM_ROUTER_MIN_TIER)
+            slot: Concurrency semaphore per provider name (default: one per
+                  router, sized by cost_config max_concurrency)
+            health: Whether a provider is up, by name (e.g. ProviderMonitor.is_up);
+                    providers reported down are not routed to
+        """
+        self.policy = policy or ROUTER_POLICY
+        if self.policy not in ROUTER_POLICIES:
+            raise ValueError(f"Unknown routing policy '{self.policy}' "
+                             f"(expected one of {', '.join(ROUTER_POLICIES)})")
+        self.providers = {n: p for n, p in providers.items() if n not in ("fallback", "router")}
+        self.sla_seconds = ROUTER_SLA_SECONDS if sla_seconds is None else sla_seconds
+        self.min_tier = min_tier or ROUTER_MIN_TIER
+        self.model = self.policy  # prompt cache key: routed prompts are shared per policy
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._slots_lock = threading.Lock()
+        self._slot = slot or self._own_slot
+        self._health = health or (lambda name: True)
+
+    def _own_slot(self, provider_name: str) -> threading.BoundedSemaphore:
+        with self._slots_lock:
+            if provider_name not in self._slots:
+                self._slots[provider_name] = threading.BoundedSemaphore(
+                    PROVIDERS.get(provider_name, {}).get("max_concurrency", 4))
+            return self._slots[provider_name]
+
+    @property
+    def max_concurrency(self) -> int:
+        """Combined concurrency cap of the routed providers."""
+        return max(1, sum(PROVIDERS.get(n, {}).get("max_concurrency", 4) for n in self.providers))
+
+    def stats(self, provider_name: str) -> ProviderStats:
+        return get_provider_stats(provider_name, getattr(self.providers[provider_name], "model", None))
+
+    def cost(self, provider_name: str) -> float:
+        return call_cost(provider_name, getattr(self.providers[provider_name], "model", None))
+
+    def ranking(self) -> List[str]:
+        """Provider names in the order the policy would try them (open circuits and
+        providers reported down excluded)."""
+        rows = []
+        for name in self.providers:
+            stats = self.stats(name)
+            if not stats.breaker.available() or not self._health(name):
+                continue
+            snap = stats.snapshot()
+            p90 = snap["latency_p90"]
+            tier = PROVIDERS.get(name, {}).get("tier", "Free")
+            rows.append({
+                "name": name,
+                # Only failures in the window (no latency to go by): tried last,
+                # except for the trial call once its circuit has opened
+                "failing": (snap["calls"] > 0 and snap["latency_mean"] is None
+                            and snap["circuit"] == "closed"),
+                "cost": self.cost(name),
+                "latency": snap["latency_mean"] if snap["latency_mean"] is not None else 0.0,
+                "meets_sla": p90 is None or p90 <= self.sla_seconds,
+                "tier": TIERS.index(tier) if tier in TIERS else 0,
+            })
+        if self.policy == "cheapest":
+            rows.sort(key=lambda r: (r["failing"], not r["meets_sla"], r["cost"], r["latency"]))
+        elif self.policy == "fastest":
+            rows.sort(key=lambda r: (r["failing"], r["latency"], r["cost"]))
+        else:
+            floor = TIERS.index(self.min_tier) if self.min_tier in TIERS else 0
+            rows = [r for r in rows if r["tier"] >= floor] or rows
+            rows.sort(key=lambda r: (r["failing"], -r["tier"], r["cost"], r["latency"]))
+        return [r["name"] for r in rows]
+
+    def _acquire(self, names: List[str]) -> Tuple[str, threading.Semaphore]:
+        """First provider in names with a free slot; waits for the first if all are busy."""
+        for name in names:
+            slot = self._slot(name)
+            if slot.acquire(blocking=False):
+                return name, slot
+        slot = self._slot(names[0])
+        slot.acquire()
+        return names[0], slot
+
+    def _route(self, call: Callable[[LLMProvider], str]) -> str:
+        remaining = self.ranking()
+        if not remaining:
+            raise RuntimeError("No provider available to route to (all down or circuits open)")
+        errors, refused = [], []
+        while remaining:
+            name, slot = self._acquire(remaining)
+            remaining.remove(name)
+            try:
+                stats = self.stats(name)
+                if not stats.breaker.allow():
+                    refused.append(name)
+                    continue
+                start = time.monotonic()
+                try:
+                    result = call(self.providers[name])
+                except Exception as e:
+                    stats.record(time.monotonic() - start, ok=False)
+                    logger.warning(f"Routed call to {name} failed: {e}")
+                    errors.append(f"{name}: {e}")
+                    continue
+                stats.record(time.monotonic() - start, ok=True)
+                _usage.route = (name, getattr(self.providers[name], "model", None))
+                return result
+            finally:
+                slot.release()
+        if not errors:
+            raise RuntimeError("No routed provider was called: every circuit was open "
+                               f"({', '.join(refused)})")
+        if refused:
+            errors.append(f"circuit open: {', '.join(refused)}")
+        raise RuntimeError("All routed providers failed: " + "; ".join(errors))
+
+    def generate_prompt(self, chunk: str, context_before: str = "",
+                        context_after: str = "") -> str:
+        return self._route(lambda p: p.generate_prompt(chunk, context_before, context_after))
+
+    def complete(self, prompt: str, system: str = "", max_tokens: int = 1500) -> str:
+        return self._route(lambda p: p.complete(prompt, system, max_tokens))
+
+    def is_available(self) -> bool:
+        return bool(self.ranking())
+
+
+def discover_providers(api_keys: Optional[Dict[str, str]] = None,
+                       registry: Optional[ModelRegistry] = None) -> Dict[str, LLMProvider]:
     """
     Discover all available LLM providers from environment and optional per-request keys.
 
     Args:
         api_keys: Optional dict of provider -> API key overrides (e.g. from request headers).
+        registry: Reuse provider instances from this registry's client pool
+                  (keyed by provider, model and API-key hash) instead of
+                  building new SDK clients.
 
     Returns:
         Dict mapping provider name to LLMProvider instance.
@@ -219,9 +551,15 @@ def discover_providers(api_keys: Optional[Dict[str, str]] = None) -> Dict[str, L
         val = os.getenv(env_var, "")
         return val if val else None
 
+    def _create(provider_id: str, factory, key: Optional[str] = None) -> LLMProvider:
+        if registry is None:
+            return factory()
+        model = PROVIDERS[provider_id]["default_model"]
+        return registry.clients.get(pool_key(provider_id, model, key), factory)
+
     # Ollama (always try — it's free/local)
     try:
-        providers["ollama"] = OllamaProvider()
+        providers["ollama"] = _create("ollama", OllamaProvider)
         logger.info("Registered Ollama provider")
     except Exception as e:
         logger.warning(f"Failed to initialize Ollama provider: {e}")
@@ -230,7 +568,7 @@ def discover_providers(api_keys: Optional[Dict[str, str]] = None) -> Dict[str, L
     key = _get_key("google")
     if key:
         try:
-            providers["google"] = GoogleProvider(api_key=key)
+            providers["google"] = _create("google", lambda: GoogleProvider(api_key=key), key)
             logger.info("Registered Google provider")
         except Exception as e:
             logger.warning(f"Failed to initialize Google provider: {e}")
@@ -239,7 +577,7 @@ def discover_providers(api_keys: Optional[Dict[str, str]] = None) -> Dict[str, L
     key = _get_key("openai")
     if key:
         try:
-            providers["openai"] = OpenAIProvider(api_key=key)
+            providers["openai"] = _create("openai", lambda: OpenAIProvider(api_key=key), key)
             logger.info("Registered OpenAI provider")
         except Exception as e:
             logger.warning(f"Failed to initialize OpenAI provider: {e}")
@@ -248,7 +586,7 @@ def discover_providers(api_keys: Optional[Dict[str, str]] = None) -> Dict[str, L
     key = _get_key("anthropic")
     if key:
         try:
-            providers["anthropic"] = AnthropicProvider(api_key=key)
+            providers["anthropic"] = _create("anthropic", lambda: AnthropicProvider(api_key=key), key)
             logger.info("Registered Anthropic provider")
         except Exception as e:
             logger.warning(f"Failed to initialize Anthropic provider: {e}")
@@ -0,0 +1,182 @@
+"""
+Process-wide pool of loaded embedding models and LLM provider clients.
+
+Loading a SentenceTransformer such as BAAI/bge-large-en-v1.5 takes tens of
+seconds and over 1 GB of memory; SDK clients are cheaper but still build
+HTTP connection pools. Requests therefore look them up here instead of
+constructing their own.
+
+Entries are keyed by (provider, model, api-key hash). The raw key is never
+stored, and requests with different user keys get different clients. Each
+pool is LRU-bounded. Loading is lazy and single-flight: concurrent requests
+for the same entry wait for one load, and loads of different entries do
+not block each other.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Embedding models are large: keep few. Clients are small but per user key.
+MODEL_POOL_MAX_MODELS = int(os.getenv("MODEL_POOL_MAX_MODELS", 2))
+MODEL_POOL_MAX_CLIENTS = int(os.getenv("MODEL_POOL_MAX_CLIENTS", 64))
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+
+PoolKey = Tuple[str, str, str]
+
+
+def api_key_hash(api_key: Optional[str]) -> str:
+    """Short, non-reversible fingerprint of an API key ('' for none)."""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def pool_key(provider: str, model: Optional[str] = None, api_key: Optional[str] = None) -> PoolKey:
+    """Registry key for a provider/model pair used with an API key."""
+    return provider, model or "", api_key_hash(api_key)
+
+
+class LockedModel:
+    """
+    Embedding model whose encode() calls are serialised.
+
+    Pooled models are shared between request threads, and a HuggingFace fast
+    tokenizer fails on concurrent calls ("Already borrowed"). Every caller
+    that takes a model from the pool goes through this wrapper, so the lock
+    belongs to the model instance: different models encode in parallel.
+    """
+
+    def __init__(self, model: Any):
+        self.model = model
+        self._lock = threading.Lock()
+
+    def encode(self, *args, **kwargs):
+        with self._lock:
+            return self.model.encode(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
+
+
+class ModelPool:
+    """LRU map of lazily created objects with single-flight loading."""
+
+    def __init__(self, max_entries: int, name: str = "pool"):
+        """
+        Args:
+            max_entries: Entries kept before the least recently used is dropped
+            name: Label used in logs and stats
+        """
+        self.max_entries = max(1, max_entries)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[PoolKey, Any]" = OrderedDict()
+        self._loading: Dict[PoolKey, Future] = {}
+
+    def get(self, key: PoolKey, factory: Callable[[], Any]) -> Any:
+        """
+        Return the entry for key, creating it with factory() on first use.
+
+        Args:
+            key: (provider, model, api-key hash), see pool_key
+            factory: Builds the object; called at most once per key at a time
+
+        Returns:
+            The pooled object
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            future = self._loading.get(key)
+            loader = future is None
+            if loader:
+                future = self._loading[key] = Future()
+
+        if not loader:
+            return future.result()
+
+        try:
+            value = factory()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.info(f"Evicted {evicted[0]}:{evicted[1]} from {self.name}")
+        future.set_result(value)
+        return value
+
+    def __contains__(self, key: PoolKey) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def evict(self, key: PoolKey) -> bool:
+        """Drop an entry (e.g. a client whose key was revoked)."""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": [f"{p}:{m}" + (f" (key {h})" if h else "")
+                            for p, m, h in self._entries],
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class ModelRegistry:
+    """Embedding models and provider clients shared by all requests."""
+
+    def __init__(self, max_models: int = None, max_clients: int = None):
+        # Embedding models are stored wrapped in LockedModel (see embedding_model)
+        self.models = ModelPool(
+            MODEL_POOL_MAX_MODELS if max_models is None else max_models, "embedding models")
+        self.clients = ModelPool(
+            MODEL_POOL_MAX_CLIENTS if max_clients is None else max_clients, "provider clients")
+
+    def embedding_model(self, provider: str, model: str, factory: Callable[[], Any]) -> LockedModel:
+        """Pooled, locked embedding model for provider ('local' or 'onnx') and model name."""
+        return self.models.get(pool_key(provider, model), lambda: LockedModel(factory()))
+
+    def stats(self) -> Dict:
+        return {"models": self.models.stats(), "clients": self.clients.stats()}
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Process-wide ModelRegistry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
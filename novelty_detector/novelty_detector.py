@@ -5,21 +5,171 @@ Includes provider abstraction with automatic fallback and multi-provider compari
 """
 
 import os
+import time
 import logging
+import threading
+from dataclasses import dataclass
 import numpy as np
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Iterable, Optional, Tuple
 from sentence_transformers import SentenceTransformer
 import faiss
 from tqdm import tqdm
 
 from ollama_client import OllamaClient
-from cost_config import PROVIDERS
+from cost_config import PROVIDERS, count_tokens
 from llm_providers import (
-    LLMProvider, FallbackProvider, discover_providers,
+    LLMProvider, FallbackProvider, RouterProvider, discover_providers, prompt_text, take_route,
+    take_usage, ROUTER_POLICY,
+)
+from provider_monitor import get_provider_monitor
+from prompt_cache import PromptCache, get_prompt_cache
+from usage_log import UsageLog, get_usage_log
+from profiler import StageProfiler
+from model_registry import LockedModel, ModelPool, ModelRegistry, get_model_registry, pool_key
+from vector_index import create_index
+from onnx_embedder import OnnxEmbedder
+from reference_corpus import ReferenceCorpus
+from embedding_cache import (
+    EmbeddingCache, get_embedding_cache, encode_with_cache, EMBED_BATCH_SIZES,
 )
 
 logger = logging.getLogger(__name__)
 
+# Retries per chunk before falling back to keyword extraction
+LLM_MAX_RETRIES = int(os.getenv("NOVELTY_LLM_RETRIES", 2))
+LLM_RETRY_BACKOFF = float(os.getenv("NOVELTY_LLM_RETRY_BACKOFF", 1.0))
+
+# Process-wide caps on concurrent prompt-generation calls, one per provider,
+# so parallel requests cannot overrun a provider (see cost_config max_concurrency).
+_provider_slots: Dict[str, threading.BoundedSemaphore] = {}
+_provider_slots_lock = threading.Lock()
+
+
+def provider_concurrency(provider_name: str) -> int:
+    """Max in-flight calls for a provider (env NOVELTY_MAX_CONCURRENCY overrides)."""
+    override = os.getenv("NOVELTY_MAX_CONCURRENCY")
+    if override:
+        return max(1, int(override))
+    return PROVIDERS.get(provider_name, {}).get("max_concurrency", 4)
+
+
+# What gets embedded per chunk: 'prompt' (an LLM-generated prompt), 'raw' (the
+# chunk text, no LLM calls) or 'hybrid' (chunk text, plus an LLM prompt only
+# for chunks whose raw-text novelty is within HYBRID_MARGIN of a colour threshold)
+EMBEDDING_MODES = ("prompt", "raw", "hybrid")
+EMBEDDING_MODE = os.getenv("NOVELTY_EMBEDDING_MODE", "prompt")
+HYBRID_MARGIN = float(os.getenv("NOVELTY_HYBRID_MARGIN", 0.05))
+# Colour thresholds of the novelty legend (see PDFProcessor.get_novelty_color)
+NOVELTY_THRESHOLDS = (0.2, 0.4, 0.7)
+
+# Similarity-matrix elements per block in blocked_self_knn (~128 MB of float32)
+KNN_BLOCK_ELEMENTS = int(os.getenv("NOVELTY_KNN_BLOCK_ELEMENTS", 2 ** 25))
+
+
+def blocked_self_knn(vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact inner-product kNN of every row against all rows, computed as blocked
+    matrix products so memory stays bounded. Same output layout as
+    faiss index.search: (similarities, indices), each (n, k), best first.
+    """
+    n = len(vectors)
+    k = min(k, n)
+    block = max(1, KNN_BLOCK_ELEMENTS // max(n, 1))
+    distances = np.empty((n, k), dtype='float32')
+    indices = np.empty((n, k), dtype='int64')
+    for start in range(0, n, block):
+        sims = vectors[start:start + block] @ vectors.T
+        if k < n:
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (len(sims), 1))
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind='stable')
+        indices[start:start + block] = np.take_along_axis(top, order, axis=1)
+        distances[start:start + block] = np.take_along_axis(top_sims, order, axis=1)
+    return distances, indices
+
+
+def score_novelty(embeddings: np.ndarray, index: faiss.Index, prompts: List[str],
+                  k: int = 5) -> List[Dict]:
+    """
+    Novelty of each chunk from its k nearest other chunks.
+
+    Args:
+        embeddings: (n, dim) normalised chunk embeddings
+        index: FAISS index over the same embeddings
+        prompts: Prompt (or text) per chunk, used for the preview
+        k: Number of nearest neighbors to consider
+
+    Returns:
+        List of dicts with chunk_index, novelty_score, and similar_chunks
+    """
+    n = len(embeddings)
+    # Each chunk can have at most n-1 other neighbours
+    k = max(0, min(k, n - 1))
+
+    # All chunks are queried at once (k+1 so each row can drop itself).
+    # For an exact flat index over these same vectors a blocked matrix
+    # product gives the same neighbours faster than index.search.
+    queries = np.ascontiguousarray(embeddings, dtype='float32')
+    if isinstance(index, faiss.IndexFlatIP) and index.ntotal == n:
+        distances, indices = blocked_self_knn(queries, k + 1)
+    else:
+        distances, indices = index.search(queries, k + 1)
+
+    # Drop each row's own hit; if ties pushed it out of the top k+1,
+    # drop the furthest neighbour instead so every row keeps k results.
+    is_self = indices == np.arange(n)[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    similar_indices = indices[keep].reshape(n, k)
+    similar_distances = distances[keep].reshape(n, k)
+
+    # Approximate indexes can return fewer than k hits (padded with -1)
+    found = similar_indices >= 0
+    counts = found.sum(axis=1)
+    avg_similarity = np.where(found, similar_distances, 0).sum(axis=1) / np.maximum(counts, 1)
+    novelty = 1.0 - avg_similarity
+
+    novelty_scores = []
+    for i, (score, avg, idx_row, sim_row) in enumerate(zip(
+            novelty.tolist(), avg_similarity.tolist(),
+            similar_indices.tolist(), similar_distances.tolist())):
+        prompt = prompts[i]
+        novelty_scores.append({
+            'chunk_index': i,
+            'novelty_score': score,
+            'avg_similarity': avg,
+            'similar_chunks': [
+                {'index': idx, 'similarity': sim}
+                for idx, sim in zip(idx_row, sim_row) if idx >= 0
+            ],
+            'text_preview': prompt[:100] + "..." if len(prompt) > 100 else prompt
+        })
+
+    return novelty_scores
+
+
+@dataclass
+class ProviderResult:
+    """One provider's analysis of a document, independent of the detector state."""
+    provider: str
+    prompts: List[str]
+    embeddings: np.ndarray
+    novelty_scores: List[Dict]
+    seconds: float
+    prompted_chunks: int = 0  # chunks sent to the provider (see embed_contexts)
+    llm_calls: int = 0  # of which got an LLM answer (prompt cache misses)
+
+
+def _provider_slot(provider_name: str) -> threading.BoundedSemaphore:
+    with _provider_slots_lock:
+        if provider_name not in _provider_slots:
+            _provider_slots[provider_name] = threading.BoundedSemaphore(
+                provider_concurrency(provider_name))
+        return _provider_slots[provider_name]
+
 
 class NoveltyDetector:
     """Detects novelty in text chunks using LLM-generated prompts and FAISS embeddings."""
@@ -29,53 +179,130 @@ class NoveltyDetector:
                  llm_model: str = None,
                  embedding_provider: str = None,
                  embedding_model_name: str = None,
-                 api_keys: Optional[Dict[str, str]] = None):
+                 api_keys: Optional[Dict[str, str]] = None,
+                 prompt_cache: Optional[PromptCache] = None,
+                 use_prompt_cache: bool = True,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 use_embedding_cache: bool = True,
+                 embed_batch_size: Optional[int] = None,
+                 index_type: Optional[str] = None,
+                 model_registry: Optional[ModelRegistry] = None,
+                 use_model_registry: bool = True,
+                 embedding_mode: Optional[str] = None,
+                 usage_log: Optional[UsageLog] = None,
+                 use_usage_log: bool = True,
+                 profiler: Optional[StageProfiler] = None):
         """
         Initialize novelty detector.
 
         Args:
             embedding_model: Name of sentence transformer model (for local provider)
-            llm_provider: LLM provider ('ollama', 'anthropic', 'openai', 'google', 'fallback')
-            llm_model: Specific model override (uses provider default if None)
-            embedding_provider: Embedding provider ('local', 'ollama', 'openai')
+            llm_provider: LLM provider ('ollama', 'anthropic', 'openai', 'google', 'fallback',
+                          or 'router' to pick one per call, see RouterProvider)
+            llm_model: Specific model override (uses provider default if None);
+                       for 'router', the routing policy
+            embedding_provider: Embedding provider ('local', 'onnx', 'ollama', 'openai')
             embedding_model_name: Override embedding model name
             api_keys: Dict of provider API keys (e.g. {'anthropic': 'sk-...'})
+            prompt_cache: PromptCache to use (default: the shared on-disk cache)
+            use_prompt_cache: Set False to always call the LLM
+            embedding_cache: EmbeddingCache to use (default: the shared on-disk cache)
+            use_embedding_cache: Set False to always re-embed
+            embed_batch_size: Texts per embedding call (default: EMBED_BATCH_SIZES)
+            index_type: FAISS index ('auto', 'flat', 'hnsw', 'ivfpq'; default NOVELTY_INDEX_TYPE)
+            model_registry: Pool of loaded models and clients (default: the process-wide one)
+            use_model_registry: Set False to load a private embedding model and clients
+            embedding_mode: 'prompt', 'raw' or 'hybrid' (default NOVELTY_EMBEDDING_MODE),
+                            see embed_contexts
+            usage_log: Where LLM calls and stage throughput are recorded for
+                       cost/time estimates (default: the shared on-disk log)
+            use_usage_log: Set False to record nothing
+            profiler: Records per-stage timings and counters (prompts, embed,
+                      index, score); share one with the PDFProcessor to
+                      profile a whole run
         """
+        self.embedding_mode = embedding_mode or EMBEDDING_MODE
+        if self.embedding_mode not in EMBEDDING_MODES:
+            raise ValueError(f"Unknown embedding mode '{self.embedding_mode}' "
+                             f"(expected one of {', '.join(EMBEDDING_MODES)})")
         self.llm_provider = llm_provider
         self.api_keys = api_keys or {}
+        self.prompted_chunks = 0  # chunks sent to the LLM by the last embed_contexts
+        self.llm_calls = 0  # successful LLM calls (prompt cache misses) by this detector
+        self._llm_calls_lock = threading.Lock()
         self.embeddings = None
         self.index = None
+        self.index_type = index_type
         self.chunk_prompts = []
+        self.prompt_cache = (prompt_cache or get_prompt_cache()) if use_prompt_cache else None
+        self.usage_log = (usage_log or get_usage_log()) if use_usage_log else None
+        self.profiler = profiler or StageProfiler()
+        self.embedding_cache = (
+            (embedding_cache or get_embedding_cache()) if use_embedding_cache else None)
         self.embedding_provider = embedding_provider or os.getenv("EMBEDDING_PROVIDER", "local")
+        self.embed_batch_size = embed_batch_size or EMBED_BATCH_SIZES.get(self.embedding_provider, 64)
         embedding_model = embedding_model or os.getenv("EMBEDDING_MODEL", "BAAI/bge-large-en-v1.5")
 
         # Resolve LLM model
         provider_config = PROVIDERS.get(llm_provider, PROVIDERS["ollama"])
-        self.llm_model = llm_model or provider_config["default_model"]
+        if llm_provider == "router":
+            self.llm_model = llm_model or ROUTER_POLICY
+        else:
+            self.llm_model = llm_model or provider_config["default_model"]
+
+        registry = (model_registry or get_model_registry()) if use_model_registry else None
 
         # Discover all available LLM providers (used for compare and fallback)
-        self.providers = discover_providers(api_keys)
+        self.providers = discover_providers(api_keys, registry=registry)
 
         # Set active provider
-        if llm_provider in self.providers:
+        monitor = get_provider_monitor()
+        if llm_provider == "router":
+            # Routes between the discovered providers, sharing their process-wide slots
+            self.active_provider = RouterProvider(self.providers, policy=self.llm_model,
+                                                  slot=_provider_slot, health=monitor.is_up)
+        elif llm_provider in self.providers and not monitor.is_up(llm_provider):
+            # Down at the last background probe: skip the per-chunk retries
+            self.active_provider = self.providers["fallback"]
+            logger.warning(f"Provider '{llm_provider}' is down, using fallback")
+        elif llm_provider in self.providers:
             self.active_provider = self.providers[llm_provider]
         else:
             self.active_provider = self.providers.get("fallback", FallbackProvider())
             logger.warning(f"Provider '{llm_provider}' not available, using fallback")
 
-        # Initialize embedding model
+        def pooled(pool: Optional[ModelPool], key, factory):
+            return factory() if pool is None else pool.get(key, factory)
+
+        def embedder(factory):
+            # Locked per model instance (see LockedModel), pooled or not
+            if registry is None:
+                return LockedModel(factory())
+            return registry.embedding_model(self.embedding_provider, self.embedding_model_name,
+                                            factory)
+
+        # Initialize embedding model (shared with other requests through the registry)
         if self.embedding_provider == "local":
-            model_name = embedding_model_name or embedding_model
-            self.embedding_model = SentenceTransformer(model_name)
+            self.embedding_model_name = embedding_model_name or embedding_model
+            self.embedding_model = embedder(lambda: SentenceTransformer(self.embedding_model_name))
+        elif self.embedding_provider == "onnx":
+            # Same models as 'local', run as int8 ONNX (see onnx_embedder.py)
+            self.embedding_model_name = embedding_model_name or embedding_model
+            self.embedding_model = embedder(lambda: OnnxEmbedder(self.embedding_model_name))
         elif self.embedding_provider == "ollama":
             self.ollama_embed_model = embedding_model_name or os.getenv(
                 "OLLAMA_EMBED_MODEL", "nomic-embed-text")
-            self.ollama_client_embed = OllamaClient()
+            self.ollama_client_embed = pooled(
+                registry and registry.clients, pool_key("ollama-embeddings"), OllamaClient)
+            self.embedding_model_name = self.ollama_embed_model
         elif self.embedding_provider == "openai":
             import openai as openai_mod
             key = self._get_api_key("openai")
-            self.openai_embed_client = openai_mod.OpenAI(api_key=key)
+            self.openai_embed_client = pooled(
+                registry and registry.clients, pool_key("openai-embeddings", api_key=key),
+                lambda: openai_mod.OpenAI(api_key=key))
             self.openai_embed_model = embedding_model_name or "text-embedding-3-small"
+            self.embedding_model_name = self.openai_embed_model
 
     def _get_api_key(self, provider: str) -> str:
         """Get API key from per-request keys or environment."""
@@ -94,36 +321,70 @@ class NoveltyDetector:
             )
         return key
 
+    @property
+    def embedding_model_key(self) -> str:
+        """Provider-qualified embedding model name, e.g. 'local:BAAI/bge-large-en-v1.5'."""
+        return f"{self.embedding_provider}:{self.embedding_model_name}"
+
     def _encode_texts(self, texts: List[str]) -> np.ndarray:
-        """Encode texts to embeddings using the configured provider."""
-        if self.embedding_provider == "local":
-            return self.embedding_model.encode(texts, show_progress_bar=True)
+        """
+        Encode texts to embeddings using the configured provider.
+        Vectors already in the embedding cache are reused; the rest are sent
+        to the provider in batches of embed_batch_size.
+        """
+        if self.embedding_provider not in ("local", "onnx", "ollama", "openai"):
+            raise ValueError(f"Unsupported embedding provider: {self.embedding_provider}")
+        model_key = self.embedding_model_key
+        batches = (len(texts) + self.embed_batch_size - 1) // self.embed_batch_size
+        progress = tqdm(total=batches, desc=f"{self.embedding_provider} embeddings",
+                        disable=batches < 2)
+
+        encoded = 0
+
+        def encode_batch(batch: List[str]) -> np.ndarray:
+            nonlocal encoded
+            vectors = self._encode_batch(batch)
+            encoded += len(batch)
+            progress.update(1)
+            return vectors
+
+        start = time.monotonic()
+        try:
+            with self.profiler.stage("embed", items=len(texts)):
+                embeddings = encode_with_cache(texts, model_key, encode_batch,
+                                               cache=self.embedding_cache,
+                                               batch_size=self.embed_batch_size)
+        finally:
+            progress.close()
+        self.profiler.count("embed", cache_hits=len(texts) - encoded, cache_misses=encoded)
+        if self.usage_log is not None:
+            self.usage_log.record_run("embed", self.embedding_provider, self.embedding_model_name,
+                                      len(texts), time.monotonic() - start)
+        return embeddings
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch of texts with a single provider call."""
+        if self.embedding_provider in ("local", "onnx"):
+            # Pooled models lock their own encode() calls (see LockedModel)
+            return self.embedding_model.encode(
+                texts, batch_size=self.embed_batch_size, show_progress_bar=False)
         elif self.embedding_provider == "ollama":
-            embeddings = []
-            for text in tqdm(texts, desc="Ollama embeddings"):
-                vec = self.ollama_client_embed.embeddings(text, model=self.ollama_embed_model)
-                embeddings.append(vec)
-            return np.array(embeddings, dtype="float32")
-        elif self.embedding_provider == "openai":
-            # Batch in groups of 100
-            all_embeddings = []
-            for i in range(0, len(texts), 100):
-                batch = texts[i:i+100]
-                resp = self.openai_embed_client.embeddings.create(
-                    input=batch, model=self.openai_embed_model
-                )
-                for item in resp.data:
-                    all_embeddings.append(item.embedding)
-            return np.array(all_embeddings, dtype="float32")
+            return np.array(self.ollama_client_embed.embed_batch(
+                texts, model=self.ollama_embed_model), dtype="float32")
         else:
-            raise ValueError(f"Unsupported embedding provider: {self.embedding_provider}")
+            resp = self.openai_embed_client.embeddings.create(
+                input=texts, model=self.openai_embed_model
+            )
+            return np.array([item.embedding for item in resp.data], dtype="float32")
 
     def generate_prompt_for_chunk(self, chunk_text: str, before_context: str = "",
                                   after_context: str = "",
                                   provider: Optional[LLMProvider] = None) -> str:
         """
         Use LLM to generate a prompt that captures the essence of the text chunk.
-        Falls back to keyword extraction if the active provider fails.
+        Results are served from the persistent prompt cache when the same
+        provider/model has seen this chunk in this context before.
+        Retries failed calls with backoff, then falls back to keyword extraction.
 
         Args:
             chunk_text: The main text chunk
@@ -134,14 +395,161 @@ class NoveltyDetector:
         Returns:
             Generated prompt that could regenerate this text
         """
+        return self._prompt_for_chunk(chunk_text, before_context, after_context, provider)[0]
+
+    def _prompt_for_chunk(self, chunk_text: str, before_context: str, after_context: str,
+                          provider: Optional[LLMProvider]) -> Tuple[str, bool]:
+        """generate_prompt_for_chunk, also saying whether an LLM call succeeded."""
         use_provider = provider or self.active_provider
-        try:
-            return use_provider.generate_prompt(chunk_text, before_context, after_context)
-        except Exception as e:
-            logger.error(f"Error generating prompt with {use_provider.name}: {e}")
-            # Fall back to keyword-based extraction
-            fallback = self.providers.get("fallback", FallbackProvider())
-            return fallback.generate_prompt(chunk_text, before_context, after_context)
+        if use_provider.name == "fallback":
+            return use_provider.generate_prompt(chunk_text, before_context, after_context), False
+
+        model = getattr(use_provider, "model", None)
+        cache_key = None
+        if self.prompt_cache is not None:
+            cache_key = PromptCache.make_key(use_provider.name, model, chunk_text,
+                                             before_context, after_context)
+            cached = self.prompt_cache.get(cache_key)
+            if cached is not None:
+                self.profiler.count("prompts", cache_hits=1)
+                return cached, False
+            self.profiler.count("prompts", cache_misses=1)
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            take_usage()
+            take_route()
+            start = time.monotonic()
+            try:
+                if isinstance(use_provider, RouterProvider):
+                    # The router takes a slot of the provider it picks
+                    prompt = use_provider.generate_prompt(chunk_text, before_context, after_context)
+                else:
+                    with _provider_slot(use_provider.name):
+                        prompt = use_provider.generate_prompt(
+                            chunk_text, before_context, after_context)
+            except Exception as e:
+                logger.warning(f"Prompt generation with {use_provider.name} failed "
+                               f"(attempt {attempt + 1}/{LLM_MAX_RETRIES + 1}): {e}")
+                if attempt < LLM_MAX_RETRIES:
+                    time.sleep(LLM_RETRY_BACKOFF * (2 ** attempt))
+                continue
+            with self._llm_calls_lock:
+                self.llm_calls += 1
+            if self.usage_log is not None:
+                # Routed calls are logged under the provider that served them
+                served_by, served_model = take_route() or (use_provider.name, model)
+                self._record_call(served_by, served_model, chunk_text, before_context,
+                                  after_context, prompt, time.monotonic() - start)
+            # Only genuine LLM output is cached, never the keyword fallback
+            if cache_key is not None:
+                self.prompt_cache.put(cache_key, prompt, use_provider.name, model)
+            return prompt, True
+
+        logger.error(f"Error generating prompt with {use_provider.name}, using keyword fallback")
+        fallback = self.providers.get("fallback", FallbackProvider())
+        return fallback.generate_prompt(chunk_text, before_context, after_context), False
+
+    def _record_call(self, provider: str, model: Optional[str], chunk_text: str,
+                     before_context: str, after_context: str, prompt: str, seconds: float):
+        """Log one LLM call's token counts and latency (calibrates cost_config estimates)."""
+        reported = take_usage()
+        est_input = count_tokens(prompt_text(chunk_text, before_context, after_context),
+                                 provider, model)
+        self.usage_log.record_call(provider, model, est_input,
+                                   count_tokens(prompt, provider, model), seconds, reported)
+
+    def generate_prompts(self, contexts: Iterable[Tuple[str, str, str]],
+                         provider: Optional[LLMProvider] = None,
+                         max_workers: Optional[int] = None,
+                         progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """
+        Generate prompts for many chunks concurrently, preserving chunk order.
+
+        Calls run on a thread pool sized to the provider's concurrency cap;
+        each call retries and falls back to keyword extraction on its own, so
+        one failing chunk never aborts the document. contexts may be a lazy
+        iterator (e.g. chunks still being extracted): each chunk is submitted
+        as soon as it arrives.
+
+        Args:
+            contexts: (before_context, chunk_text, after_context) per chunk
+            provider: Optional provider override
+            max_workers: Thread pool size (default: provider concurrency cap)
+            progress: Called as progress(done, submitted) after each prompt;
+                      submitted is the final chunk count once contexts is exhausted
+
+        Returns:
+            List of prompts, one per context, in input order
+        """
+        return self._generate_prompts(contexts, provider, max_workers, progress)[0]
+
+    def _generate_prompts(self, contexts: Iterable[Tuple[str, str, str]],
+                          provider: Optional[LLMProvider] = None,
+                          max_workers: Optional[int] = None,
+                          progress: Optional[Callable[[int, int], None]] = None
+                          ) -> Tuple[List[str], int]:
+        """generate_prompts, also returning how many chunks reached the LLM."""
+        use_provider = provider or self.active_provider
+        if isinstance(use_provider, RouterProvider):
+            workers = max_workers or use_provider.max_concurrency
+        else:
+            workers = max_workers or provider_concurrency(use_provider.name)
+        if isinstance(contexts, list):
+            if not contexts:
+                return [], 0
+            workers = min(workers, len(contexts))
+        workers = max(1, workers)
+
+        done = 0
+        done_lock = threading.Lock()
+        # LLM calls of this run, and the time prompts were actually in flight
+        # (not waiting for a lazy contexts stream), for the usage log
+        llm_calls = in_flight = 0
+        busy_since = busy_seconds = 0.0
+
+        def prompt_one(chunk_text: str, before: str, after: str) -> str:
+            nonlocal llm_calls, in_flight, busy_since, busy_seconds
+            with done_lock:
+                if not in_flight:
+                    busy_since = time.monotonic()
+                in_flight += 1
+            called = False
+            try:
+                prompt, called = self._prompt_for_chunk(chunk_text, before, after, use_provider)
+                return prompt
+            finally:
+                with done_lock:
+                    in_flight -= 1
+                    llm_calls += called
+                    if not in_flight:
+                        busy_seconds += time.monotonic() - busy_since
+
+        def report(_future):
+            nonlocal done
+            with done_lock:
+                done += 1
+                progress(done, len(futures))
+
+        futures = {}
+        # Time spent pulling a lazy contexts stream is charged to its own stages
+        with self.profiler.stage("prompts"), ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f"prompts-{use_provider.name}") as pool:
+            for i, (before, chunk_text, after) in enumerate(contexts):
+                future = pool.submit(prompt_one, chunk_text, before, after)
+                futures[future] = i
+                if progress is not None:
+                    future.add_done_callback(report)
+            prompts: List[Optional[str]] = [None] * len(futures)
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                prompts[futures[future]] = future.result()
+        self.profiler.count("prompts", items=len(prompts))
+
+        if self.usage_log is not None:
+            # Throughput of the calls that reached the LLM, at this concurrency
+            self.usage_log.record_run("prompts", use_provider.name,
+                                      getattr(use_provider, "model", None),
+                                      llm_calls, busy_seconds)
+        return prompts, llm_calls
 
     def analyze_chunks(self, chunks: List[Dict], pdf_processor) -> List[str]:
         """
@@ -154,18 +562,9 @@ class NoveltyDetector:
         Returns:
             List of generated prompts
         """
-        prompts = []
-
         print("Generating prompts for chunks...")
-        for i, chunk in enumerate(tqdm(chunks)):
-            before_context, chunk_text, after_context = pdf_processor.get_chunk_context(
-                chunks, i
-            )
-
-            prompt = self.generate_prompt_for_chunk(
-                chunk_text, before_context, after_context
-            )
-            prompts.append(prompt)
+        contexts = [pdf_processor.get_chunk_context(chunks, i) for i in range(len(chunks))]
+        prompts = self.generate_prompts(contexts)
 
         self.chunk_prompts = prompts
         return prompts
@@ -178,18 +577,98 @@ class NoveltyDetector:
             prompts: List of generated prompts
         """
         print("Generating embeddings...")
-        self.embeddings = self._encode_texts(prompts)
+        self.embeddings = self._embed_normalized(prompts)
+
+        # Build FAISS index (flat, HNSW or IVF-PQ depending on corpus size)
+        with self.profiler.stage("index", items=len(self.embeddings)):
+            self.index = create_index(self.embeddings, self.index_type)
+
+        print(f"FAISS index built with {self.index.ntotal} vectors")
 
-        # Normalize embeddings for cosine similarity
-        norms = np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+    def _embed_normalized(self, texts: List[str]) -> np.ndarray:
+        """Unit-length float32 embeddings of texts (for cosine similarity)."""
+        embeddings = self._encode_texts(texts)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
         norms[norms == 0] = 1  # avoid division by zero
-        self.embeddings = self.embeddings / norms
+        return (embeddings / norms).astype('float32')
+
+    def embed_contexts(self, contexts: Iterable[Tuple[str, str, str]],
+                       provider: Optional[LLMProvider] = None, k: int = 5,
+                       progress: Optional[Callable[[int, int], None]] = None
+                       ) -> Tuple[List[str], np.ndarray]:
+        """
+        Represent each chunk as a unit embedding according to embedding_mode:
 
-        # Build FAISS index
-        dimension = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        self.index.add(self.embeddings.astype('float32'))
+        - 'prompt': embed an LLM-generated prompt per chunk (contexts may be a
+          lazy stream; prompts start as chunks arrive)
+        - 'raw': embed the chunk text itself, no LLM calls
+        - 'hybrid': embed the chunk text, score it, and ask the LLM only about
+          chunks whose raw novelty is within HYBRID_MARGIN of a threshold;
+          their vector becomes the normalised mean of text and prompt vectors
 
+        Args:
+            contexts: (before_context, chunk_text, after_context) per chunk
+            provider: Optional provider override
+            k: Neighbours used for the hybrid pre-scoring
+            progress: Prompt progress callback (see generate_prompts)
+
+        Returns:
+            (texts, embeddings): the prompt, or the chunk text where no prompt
+            was generated, per chunk, and the (n, dim) embeddings
+        """
+        texts, embeddings, self.prompted_chunks, _ = self._embed_contexts(
+            contexts, provider, k, progress)
+        return texts, embeddings
+
+    def _embed_contexts(self, contexts: Iterable[Tuple[str, str, str]],
+                        provider: Optional[LLMProvider] = None, k: int = 5,
+                        progress: Optional[Callable[[int, int], None]] = None
+                        ) -> Tuple[List[str], np.ndarray, int, int]:
+        """embed_contexts, also returning the prompted chunk and LLM call counts."""
+        if self.embedding_mode == "prompt":
+            texts, llm_calls = self._generate_prompts(contexts, provider, progress=progress)
+            embeddings = self._embed_normalized(texts) if texts else np.empty((0, 0), 'float32')
+            return texts, embeddings, len(texts), llm_calls
+
+        contexts = list(contexts)
+        texts = [chunk_text for _, chunk_text, _ in contexts]
+        if not texts:
+            return texts, np.empty((0, 0), 'float32'), 0, 0
+        embeddings = self._embed_normalized(texts)
+        if self.embedding_mode == "raw":
+            if progress is not None:
+                progress(len(texts), len(texts))
+            return texts, embeddings, 0, 0
+
+        with self.profiler.stage("index", items=len(embeddings)):
+            raw_index = create_index(embeddings, self.index_type)
+        with self.profiler.stage("score", items=len(texts)):
+            raw_scores = np.array([
+                s['novelty_score'] for s in score_novelty(embeddings, raw_index, texts, k)])
+        distance = np.abs(raw_scores[:, None] - np.array(NOVELTY_THRESHOLDS)).min(axis=1)
+        borderline = np.flatnonzero(distance < HYBRID_MARGIN)
+        print(f"Hybrid mode: {len(borderline)}/{len(texts)} borderline chunks sent to the LLM")
+        prompts, llm_calls = self._generate_prompts([contexts[i] for i in borderline],
+                                                    provider, progress=progress)
+        if prompts:
+            mixed = embeddings[borderline] + self._embed_normalized(prompts)
+            embeddings[borderline] = mixed / np.linalg.norm(mixed, axis=1, keepdims=True)
+            for i, prompt in zip(borderline.tolist(), prompts):
+                texts[i] = prompt
+        return texts, embeddings, len(prompts), llm_calls
+
+    def index_document(self, contexts: Iterable[Tuple[str, str, str]], k: int = 5,
+                       progress: Optional[Callable[[int, int], None]] = None) -> None:
+        """
+        Embed a document's chunks (embed_contexts) and build its FAISS index;
+        sets chunk_prompts, embeddings and index for calculate_novelty_scores.
+        """
+        self.chunk_prompts, self.embeddings = self.embed_contexts(contexts, k=k, progress=progress)
+        if not self.chunk_prompts:
+            self.index = None
+            return
+        with self.profiler.stage("index", items=len(self.embeddings)):
+            self.index = create_index(self.embeddings, self.index_type)
         print(f"FAISS index built with {self.index.ntotal} vectors")
 
     def calculate_novelty_scores(self, k: int = 5) -> List[Dict]:
@@ -204,40 +683,64 @@ class NoveltyDetector:
         """
         if self.index is None or self.embeddings is None:
             raise ValueError("FAISS index not built. Call build_faiss_index first.")
+        print("Calculating novelty scores...")
+        with self.profiler.stage("score", items=len(self.chunk_prompts)):
+            return score_novelty(self.embeddings, self.index, self.chunk_prompts, k)
 
-        novelty_scores = []
+    def add_to_corpus(self, corpus: ReferenceCorpus, doc_id: str,
+                      previews: Optional[List[str]] = None, title: str = None,
+                      metadata: Optional[Dict] = None) -> int:
+        """
+        Store the embeddings of the last analysed document in a reference corpus.
 
-        print("Calculating novelty scores...")
-        for i in tqdm(range(len(self.embeddings))):
-            query_vector = self.embeddings[i:i+1].astype('float32')
-
-            # Search for k+1 nearest neighbors (including itself)
-            distances, indices = self.index.search(query_vector, k + 1)
-
-            # Remove self from results
-            mask = indices[0] != i
-            similar_indices = indices[0][mask][:k]
-            similar_distances = distances[0][mask][:k]
-
-            # Calculate novelty score
-            avg_similarity = np.mean(similar_distances)
-            novelty_score = 1.0 - avg_similarity
-
-            novelty_scores.append({
-                'chunk_index': i,
-                'novelty_score': float(novelty_score),
-                'avg_similarity': float(avg_similarity),
-                'similar_chunks': [
-                    {
-                        'index': int(idx),
-                        'similarity': float(sim)
-                    }
-                    for idx, sim in zip(similar_indices, similar_distances)
-                ],
-                'text_preview': self.chunk_prompts[i][:100] + "..."
-                if len(self.chunk_prompts[i]) > 100 else self.chunk_prompts[i]
-            })
+        Args:
+            corpus: ReferenceCorpus to add to
+            doc_id: Document identifier (re-adding replaces the old entry)
+            previews: Text shown for matches (default: the chunk prompts)
+            title: Document title
+            metadata: Extra fields stored with the document
 
+        Returns:
+            Number of chunks added
+        """
+        if self.embeddings is None:
+            raise ValueError("No embeddings to add. Run analyze_document first.")
+        return corpus.add_document(
+            doc_id, self.embeddings, previews=previews or self.chunk_prompts,
+            title=title, metadata=metadata, model_key=self.embedding_model_key)
+
+    def calculate_corpus_novelty(self, corpus: ReferenceCorpus, k: int = 5,
+                                 exclude_doc_id: Optional[str] = None) -> List[Dict]:
+        """
+        Score each chunk of the last analysed document against a reference corpus.
+
+        Args:
+            corpus: ReferenceCorpus to compare against
+            k: Number of corpus neighbours per chunk
+            exclude_doc_id: Corpus document to ignore (e.g. an earlier copy of this one)
+
+        Returns:
+            List of dicts like calculate_novelty_scores, where similar_chunks
+            name the corpus document and chunk of each match
+        """
+        if self.embeddings is None:
+            raise ValueError("No embeddings to score. Run analyze_document first.")
+        with self.profiler.stage("score", items=len(self.embeddings)):
+            matches = corpus.search(self.embeddings, k, exclude_doc_id=exclude_doc_id,
+                                    model_key=self.embedding_model_key)
+
+            novelty_scores = []
+            for i, similar in enumerate(matches):
+                avg_similarity = (float(np.mean([m['similarity'] for m in similar]))
+                                  if similar else 0.0)
+                prompt = self.chunk_prompts[i]
+                novelty_scores.append({
+                    'chunk_index': i,
+                    'novelty_score': 1.0 - avg_similarity,
+                    'avg_similarity': avg_similarity,
+                    'similar_chunks': similar,
+                    'text_preview': prompt[:100] + "..." if len(prompt) > 100 else prompt
+                })
         return novelty_scores
 
     def analyze_document(self, chunks: List[Dict], pdf_processor,
@@ -253,16 +756,82 @@ class NoveltyDetector:
         Returns:
             List of novelty scores for each chunk
         """
-        prompts = self.analyze_chunks(chunks, pdf_processor)
-        self.build_faiss_index(prompts)
+        print(f"Embedding chunks ({self.embedding_mode} mode)...")
+        contexts = [pdf_processor.get_chunk_context(chunks, i) for i in range(len(chunks))]
+        self.index_document(contexts, k)
         novelty_scores = self.calculate_novelty_scores(k)
         return novelty_scores
 
-    def analyze_document_multi(self, chunks: List[Dict], pdf_processor,
-                               provider_names: Optional[List[str]] = None,
-                               k: int = 5) -> Dict[str, List[Dict]]:
+    def analyze_stream(self, chunk_contexts: Iterable[Tuple[Dict, Tuple[str, str, str]]],
+                       k: int = 5,
+                       progress: Optional[Callable[[int, int], None]] = None
+                       ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Novelty pipeline over a chunk stream (see PDFProcessor.stream_chunks and
+        iter_chunk_contexts). Prompt generation starts on the first chunks while
+        later pages are still being extracted.
+
+        Args:
+            chunk_contexts: (chunk, (before, chunk_text, after)) pairs in order
+            k: Number of neighbors for novelty calculation
+            progress: Prompt progress callback (see generate_prompts)
+
+        Returns:
+            (chunks, novelty_scores)
         """
-        Run novelty analysis with multiple providers for comparison.
+        chunks: List[Dict] = []
+
+        def contexts():
+            for chunk, context in chunk_contexts:
+                chunks.append(chunk)
+                yield context
+
+        print(f"Embedding streamed chunks ({self.embedding_mode} mode)...")
+        self.index_document(contexts(), k, progress)
+        if not chunks:
+            return [], []
+        return chunks, self.calculate_novelty_scores(k)
+
+    def analyze_with_provider(self, contexts: List[Tuple[str, str, str]],
+                              provider: LLMProvider, k: int = 5) -> ProviderResult:
+        """
+        Full pipeline with one provider (in the detector's embedding_mode),
+        without touching its prompts, embeddings, index or prompted_chunks, so
+        several can run at once.
+
+        Args:
+            contexts: (before_context, chunk_text, after_context) per chunk
+            provider: Provider that generates the prompts
+            k: Number of neighbors for novelty calculation
+
+        Returns:
+            ProviderResult with prompts, embeddings, novelty scores and this
+            provider's own prompted chunk and LLM call counts
+        """
+        start = time.time()
+        # One batched embedding pass for all of this provider's prompts
+        prompts, embeddings, prompted, llm_calls = self._embed_contexts(contexts, provider, k)
+        with self.profiler.stage("index", items=len(embeddings)):
+            index = create_index(embeddings, self.index_type)
+        with self.profiler.stage("score", items=len(prompts)):
+            novelty_scores = score_novelty(embeddings, index, prompts, k)
+        return ProviderResult(
+            provider=provider.name,
+            prompts=prompts,
+            embeddings=embeddings,
+            novelty_scores=novelty_scores,
+            seconds=time.time() - start,
+            prompted_chunks=prompted,
+            llm_calls=llm_calls,
+        )
+
+    def analyze_providers(self, chunks: List[Dict], pdf_processor,
+                          provider_names: Optional[List[str]] = None,
+                          k: int = 5) -> Dict[str, Optional[ProviderResult]]:
+        """
+        Run analyze_with_provider for several providers concurrently. Each
+        provider gets its own thread, which runs that provider's prompt
+        worker pool, so the total time is that of the slowest provider.
 
         Args:
             chunks: List of text chunks
@@ -271,7 +840,7 @@ class NoveltyDetector:
             k: Number of neighbors for novelty calculation
 
         Returns:
-            Dict mapping provider name to list of novelty score dicts.
+            Dict mapping provider name to its ProviderResult (None if it failed)
         """
         if provider_names:
             providers_to_use = {
@@ -288,33 +857,56 @@ class NoveltyDetector:
             if not providers_to_use:
                 providers_to_use = {"fallback": self.providers["fallback"]}
 
+        contexts = [pdf_processor.get_chunk_context(chunks, i) for i in range(len(chunks))]
+        results: Dict[str, Optional[ProviderResult]] = {}
+        if not providers_to_use:
+            return results
+
+        with ThreadPoolExecutor(max_workers=len(providers_to_use),
+                                thread_name_prefix="compare") as pool:
+            futures = {
+                pool.submit(self.analyze_with_provider, contexts, provider, k): name
+                for name, provider in providers_to_use.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                    logger.info(f"Comparison with {name} took {results[name].seconds:.1f}s")
+                except Exception as e:
+                    logger.error(f"Error with provider {name}: {e}")
+                    results[name] = None
+
+        # Keep the requested provider order
+        return {name: results[name] for name in providers_to_use}
+
+    def analyze_document_multi(self, chunks: List[Dict], pdf_processor,
+                               provider_names: Optional[List[str]] = None,
+                               k: int = 5) -> Dict[str, List[Dict]]:
+        """
+        Run novelty analysis with multiple providers for comparison
+        (concurrently, see analyze_providers).
+
+        Args:
+            chunks: List of text chunks
+            pdf_processor: PDFProcessor instance
+            provider_names: List of provider names to use. If None, uses all discovered.
+            k: Number of neighbors for novelty calculation
+
+        Returns:
+            Dict mapping provider name to list of novelty score dicts.
+        """
         results = {}
-        for name, provider in providers_to_use.items():
-            logger.info(f"Running comparison analysis with provider: {name}")
-            try:
-                # Generate prompts with this specific provider
-                prompts = []
-                for i, chunk in enumerate(chunks):
-                    before_context, chunk_text, after_context = pdf_processor.get_chunk_context(
-                        chunks, i
-                    )
-                    prompt = self.generate_prompt_for_chunk(
-                        chunk_text, before_context, after_context, provider=provider
-                    )
-                    prompts.append(prompt)
-
-                self.chunk_prompts = prompts
-                self.build_faiss_index(prompts)
-                scores = self.calculate_novelty_scores(k)
-                results[name] = scores
-            except Exception as e:
-                logger.error(f"Error with provider {name}: {e}")
+        for name, result in self.analyze_providers(chunks, pdf_processor,
+                                                   provider_names, k).items():
+            if result is not None:
+                results[name] = result.novelty_scores
+            else:
                 results[name] = [
                     {"chunk_index": i, "novelty_score": 0.5, "avg_similarity": 0.5,
                      "similar_chunks": [], "text_preview": "Error during analysis"}
                     for i in range(len(chunks))
                 ]
-
         return results
 
     def get_summary_statistics(self, novelty_scores: List[Dict]) -> Dict:
@@ -341,3 +933,22 @@ class NoveltyDetector:
             'low_novelty_count': sum(1 for s in scores if 0.2 <= s < 0.4),
             'very_low_novelty_count': sum(1 for s in scores if s < 0.2)
         }
+
+
+def warm_up_models(registry: Optional[ModelRegistry] = None) -> float:
+    """
+    Load the default embedding model and provider clients into the registry
+    and run one encode, so the first request does not pay for loading.
+
+    Returns:
+        Seconds spent
+    """
+    start = time.time()
+    detector = NoveltyDetector(
+        llm_provider=os.getenv("DEFAULT_LLM_PROVIDER", "ollama"),
+        use_prompt_cache=False, use_embedding_cache=False, model_registry=registry)
+    if detector.embedding_provider in ("local", "onnx"):
+        detector.embedding_model.encode(["warm-up"], show_progress_bar=False)
+    elapsed = time.time() - start
+    logger.info(f"Warmed up {detector.embedding_model_key} in {elapsed:.1f}s")
+    return elapsed
@@ -1,42 +1,176 @@
 """
 HTTP client for Ollama LLM server.
 Handles text generation, embeddings, model listing, and health checks.
+
+OllamaClient (requests) and AsyncOllamaClient (aiohttp) keep a pool of
+keep-alive connections instead of opening one per call. Both stream
+/api/generate so a reply can be cut short as soon as a stop sequence or
+predicate matches, send whole batches to /api/embed, ask Ollama to keep the
+model loaded between calls (keep_alive), and share health-check results for
+OLLAMA_HEALTH_TTL seconds.
 """
 
 import os
+import json
+import time
+import threading
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import aiohttp
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
 
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+# How long Ollama keeps a model in memory after a call (Ollama duration string)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 16))
+OLLAMA_HEALTH_TTL = float(os.getenv("OLLAMA_HEALTH_TTL", 15))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 5))
+# Longest wait for the next streamed token (or a whole embed batch)
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", 120))
+
+# base_url -> (checked at, health result); shared by all clients
+_health_cache: Dict[str, Tuple[float, dict]] = {}
+_health_lock = threading.Lock()
+
+StopPredicate = Callable[[str], bool]
+
 
+def default_model() -> str:
+    return os.getenv("OLLAMA_DEFAULT_MODEL", "llama3.2")
 
-class OllamaClient:
-    """HTTP client for Ollama API."""
 
-    def __init__(self, base_url: str = None):
+def default_embed_model() -> str:
+    return os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+
+class _OllamaBase:
+    """Request payloads, stop handling and health caching shared by both clients."""
+
+    def __init__(self, base_url: str = None, keep_alive: Optional[str] = None,
+                 pool_size: int = None, health_ttl: float = None):
+        """
+        Args:
+            base_url: Ollama server URL (default: OLLAMA_BASE_URL)
+            keep_alive: How long Ollama keeps the model loaded (default: OLLAMA_KEEP_ALIVE)
+            pool_size: Max pooled connections (default: OLLAMA_POOL_SIZE)
+            health_ttl: Seconds a health result is reused (default: OLLAMA_HEALTH_TTL)
+        """
         self.base_url = (base_url or OLLAMA_BASE_URL).rstrip("/")
+        self.keep_alive = keep_alive or OLLAMA_KEEP_ALIVE
+        self.pool_size = pool_size or OLLAMA_POOL_SIZE
+        self.health_ttl = OLLAMA_HEALTH_TTL if health_ttl is None else health_ttl
+
+    def _cached_health(self) -> Optional[dict]:
+        with _health_lock:
+            entry = _health_cache.get(self.base_url)
+        if entry and time.monotonic() - entry[0] < self.health_ttl:
+            return entry[1]
+        return None
+
+    def last_health(self) -> Optional[dict]:
+        """Most recent health result for this server, however old (None if never checked)."""
+        with _health_lock:
+            entry = _health_cache.get(self.base_url)
+        return entry[1] if entry else None
+
+    def _store_health(self, result: dict) -> dict:
+        with _health_lock:
+            _health_cache[self.base_url] = (time.monotonic(), result)
+        return result
+
+    def _generate_payload(self, prompt: str, model: Optional[str], max_tokens: int,
+                          stop: Optional[Sequence[str]]) -> dict:
+        options = {"num_predict": max_tokens}
+        if stop:
+            options["stop"] = list(stop)
+        return {"model": model or default_model(), "prompt": prompt, "stream": True,
+                "keep_alive": self.keep_alive, "options": options}
+
+    def _embed_payload(self, texts: List[str], model: Optional[str]) -> dict:
+        return {"model": model or default_embed_model(), "input": list(texts),
+                "keep_alive": self.keep_alive}
+
+    @staticmethod
+    def _check_embeddings(data: dict, n: int) -> List[List[float]]:
+        embeddings = data.get("embeddings", [])
+        if len(embeddings) != n:
+            raise ValueError(f"Ollama returned {len(embeddings)} embeddings for {n} inputs")
+        return embeddings
+
+    @staticmethod
+    def _stop_at(text: str, stop: Optional[Sequence[str]],
+                 until: Optional[StopPredicate]) -> Optional[str]:
+        """text cut at the first stop sequence, text itself if until(text), else None."""
+        if stop:
+            cuts = [text.find(s) for s in stop if s and s in text]
+            if cuts:
+                return text[:min(cuts)]
+        if until is not None and until(text):
+            return text
+        return None
+
+
+class OllamaClient(_OllamaBase):
+    """HTTP client for Ollama API (pooled keep-alive connections)."""
+
+    def __init__(self, base_url: str = None, keep_alive: Optional[str] = None,
+                 pool_size: int = None, health_ttl: float = None):
+        super().__init__(base_url, keep_alive, pool_size, health_ttl)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-    def health(self) -> dict:
-        """Check if Ollama is reachable."""
+    def health(self, refresh: bool = False) -> dict:
+        """Check if Ollama is reachable (cached for health_ttl seconds)."""
+        cached = None if refresh else self._cached_health()
+        if cached is not None:
+            return cached
         try:
-            resp = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            return {"available": resp.status_code == 200}
+            resp = self.session.get(f"{self.base_url}/api/tags", timeout=OLLAMA_CONNECT_TIMEOUT)
+            return self._store_health({"available": resp.status_code == 200})
         except requests.RequestException:
-            return {"available": False}
+            return self._store_health({"available": False})
 
     def list_models(self) -> list:
         """List models pulled in Ollama."""
         try:
-            resp = requests.get(f"{self.base_url}/api/tags", timeout=10)
+            resp = self.session.get(f"{self.base_url}/api/tags",
+                                    timeout=(OLLAMA_CONNECT_TIMEOUT, 10))
             resp.raise_for_status()
             data = resp.json()
             return [m["name"] for m in data.get("models", [])]
         except requests.RequestException:
             return []
 
-    def generate(self, prompt: str, model: str = None,
-                 max_tokens: int = 200) -> str:
+    def stream_generate(self, prompt: str, model: str = None, max_tokens: int = 200,
+                        stop: Optional[Sequence[str]] = None) -> Iterator[str]:
+        """
+        Stream a completion from /api/generate.
+
+        Yields the text pieces as Ollama produces them. A fully read stream
+        returns its connection to the pool; closing the generator early
+        drops the connection instead, which makes Ollama stop generating.
+        """
+        with self.session.post(
+                f"{self.base_url}/api/generate",
+                json=self._generate_payload(prompt, model, max_tokens, stop),
+                stream=True, timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                if data.get("response"):
+                    yield data["response"]
+
+    def generate(self, prompt: str, model: str = None, max_tokens: int = 200,
+                 stop: Optional[Sequence[str]] = None,
+                 until: Optional[StopPredicate] = None) -> str:
         """
         Generate text completion.
 
@@ -44,23 +178,25 @@ class OllamaClient:
             prompt: Input prompt
             model: Model name (defaults to env OLLAMA_DEFAULT_MODEL)
             max_tokens: Maximum tokens in response
+            stop: Stop sequences (excluded from the result); generation ends
+                  as soon as one appears
+            until: Called with the text so far; generation ends when it returns True
 
         Returns:
             Generated text
         """
-        model = model or os.getenv("OLLAMA_DEFAULT_MODEL", "llama3.2")
-        resp = requests.post(
-            f"{self.base_url}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {"num_predict": max_tokens},
-            },
-            timeout=120,
-        )
-        resp.raise_for_status()
-        return resp.json().get("response", "").strip()
+        text = ""
+        pieces = self.stream_generate(prompt, model, max_tokens, stop)
+        try:
+            for piece in pieces:
+                text += piece
+                cut = self._stop_at(text, stop, until)
+                if cut is not None:
+                    text = cut
+                    break
+        finally:
+            pieces.close()
+        return text.strip()
 
     def embeddings(self, text: str, model: str = None) -> list:
         """
@@ -73,16 +209,147 @@ class OllamaClient:
         Returns:
             List of floats (embedding vector)
         """
-        model = model or os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
-        resp = requests.post(
+        return self.embed_batch([text], model=model)[0]
+
+    def embed_batch(self, texts: list, model: str = None) -> list:
+        """
+        Get embeddings for several texts in one /api/embed call.
+
+        Args:
+            texts: Input texts
+            model: Embedding model name
+
+        Returns:
+            List of embedding vectors, one per text
+        """
+        resp = self.session.post(
             f"{self.base_url}/api/embed",
-            json={"model": model, "input": text},
-            timeout=60,
+            json=self._embed_payload(texts, model),
+            timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT + 2 * len(texts)),
         )
         resp.raise_for_status()
-        data = resp.json()
-        # Handle both single and batch responses
-        embeddings = data.get("embeddings", [])
-        if embeddings:
-            return embeddings[0]
-        return data.get("embedding", [])
+        return self._check_embeddings(resp.json(), len(texts))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncOllamaClient(_OllamaBase):
+    """asyncio client for Ollama API (aiohttp, pooled keep-alive connections).
+
+    The aiohttp session is created on first use inside the running event
+    loop; use `async with AsyncOllamaClient() as client:` or call aclose().
+    """
+
+    def __init__(self, base_url: str = None, keep_alive: Optional[str] = None,
+                 pool_size: int = None, health_ttl: float = None):
+        super().__init__(base_url, keep_alive, pool_size, health_ttl)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=OLLAMA_CONNECT_TIMEOUT,
+                                              sock_read=OLLAMA_READ_TIMEOUT))
+        return self._session
+
+    async def health(self, refresh: bool = False) -> dict:
+        """Check if Ollama is reachable (cached for health_ttl seconds)."""
+        cached = None if refresh else self._cached_health()
+        if cached is not None:
+            return cached
+        try:
+            async with self._get_session().get(
+                    f"{self.base_url}/api/tags",
+                    timeout=aiohttp.ClientTimeout(total=OLLAMA_CONNECT_TIMEOUT)) as resp:
+                return self._store_health({"available": resp.status == 200})
+        except (aiohttp.ClientError, TimeoutError):
+            return self._store_health({"available": False})
+
+    async def list_models(self) -> list:
+        """List models pulled in Ollama."""
+        try:
+            async with self._get_session().get(f"{self.base_url}/api/tags") as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+                return [m["name"] for m in data.get("models", [])]
+        except (aiohttp.ClientError, TimeoutError):
+            return []
+
+    async def stream_generate(self, prompt: str, model: str = None, max_tokens: int = 200,
+                              stop: Optional[Sequence[str]] = None) -> AsyncIterator[str]:
+        """Stream a completion from /api/generate (see OllamaClient.stream_generate)."""
+        async with self._get_session().post(
+                f"{self.base_url}/api/generate",
+                json=self._generate_payload(prompt, model, max_tokens, stop)) as resp:
+            resp.raise_for_status()
+            async for line in resp.content:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                if data.get("response"):
+                    yield data["response"]
+
+    async def generate(self, prompt: str, model: str = None, max_tokens: int = 200,
+                       stop: Optional[Sequence[str]] = None,
+                       until: Optional[StopPredicate] = None) -> str:
+        """Generate text completion (see OllamaClient.generate)."""
+        text = ""
+        pieces = self.stream_generate(prompt, model, max_tokens, stop)
+        try:
+            async for piece in pieces:
+                text += piece
+                cut = self._stop_at(text, stop, until)
+                if cut is not None:
+                    text = cut
+                    break
+        finally:
+            await pieces.aclose()
+        return text.strip()
+
+    async def embeddings(self, text: str, model: str = None) -> list:
+        """Get the embedding vector for one text."""
+        return (await self.embed_batch([text], model=model))[0]
+
+    async def embed_batch(self, texts: list, model: str = None) -> list:
+        """Get embeddings for several texts in one /api/embed call."""
+        async with self._get_session().post(
+                f"{self.base_url}/api/embed", json=self._embed_payload(texts, model),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=OLLAMA_CONNECT_TIMEOUT,
+                    sock_read=OLLAMA_READ_TIMEOUT + 2 * len(texts))) as resp:
+            resp.raise_for_status()
+            return self._check_embeddings(await resp.json(), len(texts))
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    """Process-wide OllamaClient for the default server (shares its connection pool)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient()
+        return _client
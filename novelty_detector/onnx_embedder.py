@@ -0,0 +1,252 @@
+"""
+ONNX Runtime backend for local sentence-transformer embeddings.
+
+On CPU-only servers an int8, dynamically quantised ONNX export of the
+embedding model encodes several times faster than the PyTorch path and needs
+far less memory. The first load of a model exports and quantises it once into
+ONNX_MODEL_DIR; later loads (and other server workers) reuse those files. The
+export runs under a file lock into a temporary directory that is renamed into
+place when complete, so concurrent workers export once and never load a
+partially written model.
+Tokenisation, pooling and normalisation come from the model's own
+sentence-transformers config, so vectors match the PyTorch path up to
+quantisation error (check with bench_embeddings.py).
+
+ONNX Runtime sizes its thread pool from the host's cores, not the container's
+CPU quota, which oversubscribes a throttled container; threads default to the
+cores actually available (cgroup quota and CPU affinity).
+
+Requires the optional ONNX extras: pip install "sentence-transformers[onnx]"
+"""
+
+import os
+import re
+import shutil
+import logging
+import platform
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+try:
+    import fcntl
+except ImportError:  # Windows: exports are only serialised within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "onnx"))
+# int8 kernel set: auto (detect from the CPU), avx2, avx512, avx512_vnni or arm64
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "auto")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))  # 0: cores available to the container
+# Dynamic batching: texts per batch are capped so batch size x longest
+# sequence (in tokens) stays under this budget
+ONNX_MAX_BATCH_TOKENS = int(os.getenv("ONNX_MAX_BATCH_TOKENS", 16384))
+
+QUANTIZATION_CONFIGS = ("avx2", "avx512", "avx512_vnni", "arm64")
+
+
+def available_cpus() -> int:
+    """CPU cores this process may use: affinity mask capped by the cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS, Windows
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:  # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()[:2]
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:  # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def default_quantization() -> str:
+    """Best int8 kernel set for this CPU (see QUANTIZATION_CONFIGS)."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(re.search(r"^flags\s*:(.*)$", f.read(), re.M).group(1).split())
+    except (OSError, AttributeError):
+        return "avx2"
+    if "avx512_vnni" in flags or "avx512vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def quantized_model_path(model_name: str, model_dir: Optional[str] = None) -> str:
+    """Directory holding the ONNX export of model_name."""
+    return os.path.join(model_dir or ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def export_quantized_model(model_name: str, output_dir: str, quantization: str) -> str:
+    """
+    Export model_name to ONNX and quantise it to int8 (dynamic quantisation,
+    no calibration data needed).
+
+    Args:
+        model_name: HuggingFace model id or local sentence-transformers directory
+        output_dir: Where the exported model is saved
+        quantization: One of QUANTIZATION_CONFIGS
+
+    Returns:
+        The quantised model's file name, relative to output_dir
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    print(f"Exporting {model_name} to ONNX ({quantization} int8) in {output_dir}...")
+    model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+    model.save(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization, output_dir)
+    return os.path.join("onnx", f"model_qint8_{quantization}.onnx")
+
+
+def ensure_quantized_model(model_name: str, path: str, quantization: str) -> str:
+    """
+    Export model_name into path unless its int8 model is already there.
+
+    Exports are serialised across processes with a file lock next to path and
+    written to a temporary directory first. A new model directory is renamed
+    into place as a whole; for a further quantization of an existing export
+    only the finished .onnx file is moved in. Either way the file checked
+    below appears only once it is complete.
+
+    Args:
+        model_name: HuggingFace model id or local sentence-transformers directory
+        path: Export directory of the model (see quantized_model_path)
+        quantization: One of QUANTIZATION_CONFIGS
+
+    Returns:
+        The quantised model's file name, relative to path
+    """
+    file_name = os.path.join("onnx", f"model_qint8_{quantization}.onnx")
+    if os.path.exists(os.path.join(path, file_name)):
+        return file_name
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(os.path.join(path, file_name)):
+                return file_name  # exported by another worker while we waited
+            tmp_dir = tempfile.mkdtemp(dir=parent, prefix=f".{os.path.basename(path)}.")
+            try:
+                file_name = export_quantized_model(model_name, tmp_dir, quantization)
+                if os.path.isdir(path):
+                    os.makedirs(os.path.join(path, os.path.dirname(file_name)), exist_ok=True)
+                    os.replace(os.path.join(tmp_dir, file_name), os.path.join(path, file_name))
+                else:
+                    os.replace(tmp_dir, path)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return file_name
+
+
+class OnnxEmbedder:
+    """Int8 ONNX Runtime embedding model with the SentenceTransformer encode() interface."""
+
+    def __init__(self, model_name: str, model_dir: Optional[str] = None,
+                 quantization: Optional[str] = None, threads: Optional[int] = None,
+                 max_batch_tokens: Optional[int] = None):
+        """
+        Args:
+            model_name: HuggingFace model id or local sentence-transformers directory
+            model_dir: Export cache directory (default: ONNX_MODEL_DIR)
+            quantization: int8 kernel set (default: ONNX_QUANTIZATION, 'auto' detects)
+            threads: ONNX Runtime intra-op threads (default: ONNX_THREADS or available_cpus())
+            max_batch_tokens: Token budget per batch (default: ONNX_MAX_BATCH_TOKENS)
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError(
+                "The onnx embedding provider needs ONNX Runtime and Optimum: "
+                "pip install \"sentence-transformers[onnx]\"") from e
+
+        quantization = quantization or ONNX_QUANTIZATION
+        if quantization == "auto":
+            quantization = default_quantization()
+        if quantization not in QUANTIZATION_CONFIGS:
+            raise ValueError(f"Unknown ONNX quantization '{quantization}' "
+                             f"(expected auto or one of {', '.join(QUANTIZATION_CONFIGS)})")
+
+        self.model_name = model_name
+        self.quantization = quantization
+        self.threads = threads or ONNX_THREADS or available_cpus()
+        self.max_batch_tokens = max_batch_tokens or ONNX_MAX_BATCH_TOKENS
+        self.path = quantized_model_path(model_name, model_dir)
+
+        file_name = ensure_quantized_model(model_name, self.path, quantization)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.model = SentenceTransformer(
+            self.path, backend="onnx", device="cpu",
+            model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider",
+                          "session_options": options})
+        logger.info(f"Loaded {model_name} as {quantization} int8 ONNX "
+                    f"({self.threads} threads)")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def batches(self, texts: List[str], batch_size: int) -> List[List[int]]:
+        """
+        Group text indices into batches of similar length: at most batch_size
+        texts, and at most max_batch_tokens once padded to the longest text.
+        """
+        max_length = self.model.max_seq_length or 512
+        lengths = [len(ids) for ids in self.model.tokenizer(
+            texts, truncation=True, max_length=max_length)["input_ids"]]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True)
+        batches, current = [], []
+        for i in order:
+            # Longest first, so the batch's padded length is its first text's
+            if current and (len(current) >= batch_size
+                            or (len(current) + 1) * lengths[current[0]] > self.max_batch_tokens):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def encode(self, texts: List[str], batch_size: int = 64, show_progress_bar: bool = False,
+               **kwargs) -> np.ndarray:
+        """Embed texts (same arguments and output as SentenceTransformer.encode)."""
+        # The output is always a numpy array (set below)
+        kwargs.pop("convert_to_numpy", None)
+        kwargs.pop("convert_to_tensor", None)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype="float32")
+        out = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype="float32")
+        for batch in self.batches(texts, batch_size):
+            out[batch] = self.model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                           show_progress_bar=False, convert_to_numpy=True,
+                                           **kwargs)
+        return out
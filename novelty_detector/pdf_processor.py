@@ -4,21 +4,125 @@ Handles PDF processing and annotation with novelty scores.
 Supports both word-overlap chunking and paragraph-aware chunking.
 """
 
+import os
 import re
+import atexit
+import difflib
+import threading
+import multiprocessing
+from bisect import bisect_right
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.colors import Color, green, yellow, orange, red
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
 import io
 
+from profiler import StageProfiler
+
+
+# Page-parallel extraction: PDFs with at least PARALLEL_MIN_PAGES pages are
+# split into PAGES_PER_TASK page ranges and extracted in a process pool.
+EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 64))
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+
+
+# One pool per worker count, started on first use and reused by every document
+_extract_pools: Dict[int, ProcessPoolExecutor] = {}
+_extract_pools_lock = threading.Lock()
+
+
+def _get_extract_pool(workers: int) -> ProcessPoolExecutor:
+    """Process-wide extraction pool with the given number of workers."""
+    with _extract_pools_lock:
+        pool = _extract_pools.get(workers)
+        if pool is None:
+            # spawn, not fork: the server process may be running other threads
+            ctx = multiprocessing.get_context("spawn")
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+            _extract_pools[workers] = pool
+        return pool
+
+
+@atexit.register
+def _shutdown_extract_pools():
+    with _extract_pools_lock:
+        for pool in _extract_pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pools.clear()
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) (runs in a worker process)."""
+    with fitz.open(pdf_path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _iter_words(texts: Iterable[str]) -> Iterator[str]:
+    """Whitespace-separated words of concatenated texts, without joining them.
+    A word split across two texts (no whitespace at the boundary) is rejoined."""
+    carry = ""
+    for text in texts:
+        text = carry + text
+        words = text.split()
+        carry = words.pop() if words and not text[-1].isspace() else ""
+        yield from words
+    if carry:
+        yield carry
+
+
+def _track_page_words(texts: Iterable[str], pages: List[Tuple[int, int]]) -> Iterator[str]:
+    """Pass texts through, appending (first word index, word count) for each
+    to pages. Indices are positions in the _iter_words sequence of all texts,
+    i.e. the word_start/word_end space of chunks."""
+    next_word = 0
+    open_word = False  # last non-empty text ended mid-word
+    for text in texts:
+        if open_word and text[:1] and not text[0].isspace():
+            next_word -= 1  # first word continues the previous text's last
+        n_words = len(text.split())
+        pages.append((next_word, n_words))
+        next_word += n_words
+        if text:
+            open_word = not text[-1].isspace()
+        yield text
+
+
+def _align_word_boxes(tokens: List[str], boxes: List[tuple], first_word: int) -> List[Optional[int]]:
+    """Word index of each box where page.get_text("words") and the page text's
+    whitespace split disagree (e.g. on unusual spacing); None if unmatched."""
+    matcher = difflib.SequenceMatcher(None, tokens, [b[4] for b in boxes], autojunk=False)
+    indices: List[Optional[int]] = [None] * len(boxes)
+    for a, b, size in matcher.get_matching_blocks():
+        for k in range(size):
+            indices[b + k] = first_word + a + k
+    return indices
+
+
+def _iter_paragraphs(texts: Iterable[str]) -> Iterator[str]:
+    """Blank-line separated paragraphs of concatenated texts, as they complete."""
+    buffer = ""
+    for text in texts:
+        buffer += text
+        separators = list(re.finditer(r'\n\s*\n', buffer))
+        if not separators:
+            continue
+        # Keep the last separator: it may continue into the next text
+        cut = separators[-1].start()
+        yield from re.split(r'\n\s*\n', buffer[:cut])
+        buffer = buffer[cut:]
+    yield from re.split(r'\n\s*\n', buffer)
+
 
 class PDFProcessor:
     """Handles PDF text extraction, chunking, and annotation."""
 
     def __init__(self, chunk_size: int = 150, overlap: int = 20,
-                 chunking_mode: str = "overlap"):
+                 chunking_mode: str = "overlap", profiler: Optional[StageProfiler] = None):
         """
         Initialize PDF processor.
 
@@ -27,10 +131,15 @@ class PDFProcessor:
             overlap: Number of words to overlap between chunks (overlap mode only)
             chunking_mode: 'overlap' for word-level overlap chunking (default),
                            'paragraph' for paragraph-boundary-aware chunking
+            profiler: Records the extract, chunk and annotate stages
+                      (share one with the NoveltyDetector to profile a whole run)
         """
         self.chunk_size = chunk_size
         self.overlap = overlap
         self.chunking_mode = chunking_mode
+        self.profiler = profiler or StageProfiler()
+        # (pdf_path, [(first word index, word count) per page]) of the last extraction
+        self._page_words: Optional[Tuple[str, List[Tuple[int, int]]]] = None
 
     def extract_text(self, pdf_path: str) -> str:
         """
@@ -42,14 +151,93 @@ class PDFProcessor:
         Returns:
             Extracted text as string
         """
-        doc = fitz.open(pdf_path)
-        text = ""
+        return "".join(self.iter_page_texts(pdf_path))
+
+    def iter_page_texts(self, pdf_path: str, workers: Optional[int] = None) -> Iterator[str]:
+        """
+        Yield the text of each page in order, as it is extracted.
+
+        Large PDFs (PARALLEL_MIN_PAGES or more) are extracted in a process pool
+        over page ranges; earlier ranges are yielded as soon as they finish.
+        Each page's word range is kept so annotate_pdf can locate chunks.
+
+        Args:
+            pdf_path: Path to PDF file
+            workers: Worker processes (default: PDF_EXTRACT_WORKERS; 1 disables)
+
+        Yields:
+            Page text strings
+        """
+        # Keep each page's word range for annotate_pdf
+        pages: List[Tuple[int, int]] = []
+        self._page_words = (pdf_path, pages)
+        self.profiler.count("extract", bytes=os.path.getsize(pdf_path))
+        yield from _track_page_words(
+            self.profiler.iter("extract", self._read_page_texts(pdf_path, workers)), pages)
+
+    def _read_page_texts(self, pdf_path: str, workers: Optional[int]) -> Iterator[str]:
+        """Page texts in order, serially or from the extraction process pool."""
+        workers = EXTRACT_WORKERS if workers is None else workers
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+            if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+                for page in doc:
+                    yield page.get_text()
+                return
+
+        pool = _get_extract_pool(workers)
+        futures = [
+            pool.submit(_extract_page_range, pdf_path, start,
+                        min(start + PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, PAGES_PER_TASK)
+        ]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            # A consumer that stops early must not leave ranges queued in the shared pool
+            for future in futures:
+                future.cancel()
+
+    def stream_chunks(self, pdf_path: str, workers: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Extract and chunk a PDF incrementally. Yields the same chunks as
+        chunk_text(extract_text(pdf_path)), each as soon as its pages are read.
 
-        for page in doc:
-            text += page.get_text()
+        Args:
+            pdf_path: Path to PDF file
+            workers: Extraction worker processes (see iter_page_texts)
 
-        doc.close()
-        return text
+        Yields:
+            Chunk dictionaries
+        """
+        page_texts = self.iter_page_texts(pdf_path, workers)
+        if self.chunking_mode == "paragraph":
+            chunks = self._iter_paragraph_chunks(_iter_paragraphs(page_texts))
+        else:
+            chunks = self._iter_overlap_chunks(_iter_words(page_texts))
+        return self.profiler.iter("chunk", chunks)
+
+    def iter_chunk_contexts(self, chunks: Iterable[Dict], context_before: int = 50,
+                            context_after: int = 50) -> Iterator[Tuple[Dict, Tuple[str, str, str]]]:
+        """
+        Pair each chunk from a stream with its get_chunk_context() tuple.
+        Needs one chunk of lookahead for the after-context.
+
+        Yields:
+            (chunk, (before_context, chunk_text, after_context))
+        """
+        window: List[Dict] = []
+        for chunk in chunks:
+            window.append(chunk)
+            if len(window) == 3:
+                yield window[1], self.get_chunk_context(window, 1, context_before, context_after)
+                window.pop(0)
+            elif len(window) == 2:
+                yield window[0], self.get_chunk_context(window, 0, context_before, context_after)
+        if window:
+            last = len(window) - 1
+            yield window[last], self.get_chunk_context(window, last, context_before, context_after)
 
     def chunk_text(self, text: str) -> List[Dict[str, any]]:
         """
@@ -61,71 +249,130 @@ class PDFProcessor:
         Returns:
             List of chunk dictionaries with text and metadata
         """
-        if self.chunking_mode == "paragraph":
-            return self._chunk_text_paragraph(text)
-        return self._chunk_text_overlap(text)
+        with self.profiler.stage("chunk", bytes=len(text.encode("utf-8"))) as profiler:
+            if self.chunking_mode == "paragraph":
+                chunks = self._chunk_text_paragraph(text)
+            else:
+                chunks = self._chunk_text_overlap(text)
+            profiler.count("chunk", items=len(chunks))
+        return chunks
 
     def _chunk_text_overlap(self, text: str) -> List[Dict[str, any]]:
         """
         Split text into overlapping chunks of approximately chunk_size words.
+        Runs in linear time: word offsets come from one prefix-sum pass and each
+        chunk is a slice of the normalised text.
         """
-        # Clean and normalize text
+        # Clean and normalize text (words are now separated by single spaces)
         text = re.sub(r'\s+', ' ', text).strip()
         words = text.split()
+        n = len(words)
 
-        chunks = []
-        start_idx = 0
-        chunk_idx = 0
-
-        while start_idx < len(words):
-            # Get chunk of words
-            end_idx = min(start_idx + self.chunk_size, len(words))
-            chunk_words = words[start_idx:end_idx]
-            chunk_text = ' '.join(chunk_words)
-
-            # Calculate character positions in original text
-            char_start = len(' '.join(words[:start_idx]))
-            if start_idx > 0:
-                char_start += 1  # Account for space
-            char_end = char_start + len(chunk_text)
+        # offsets[i] = char offset of word i; offsets[n] = len(text) + 1
+        offsets = [0]
+        offsets.extend(accumulate(len(w) + 1 for w in words))
 
+        step = max(1, self.chunk_size - self.overlap)
+        chunks = []
+        for chunk_idx, start_idx in enumerate(range(0, n, step)):
+            end_idx = min(start_idx + self.chunk_size, n)
+            char_start = offsets[start_idx]
+            char_end = offsets[end_idx] - 1
             chunks.append({
                 'chunk_index': chunk_idx,
-                'text': chunk_text,
+                'text': text[char_start:char_end],
                 'word_start': start_idx,
                 'word_end': end_idx,
                 'char_start': char_start,
                 'char_end': char_end,
-                'word_count': len(chunk_words)
+                'word_count': end_idx - start_idx
             })
-
-            chunk_idx += 1
-
-            # Move to next chunk with overlap
-            start_idx += self.chunk_size - self.overlap
-
-            # Break if we're at the end
-            if end_idx >= len(words):
+            if end_idx >= n:
                 break
 
         return chunks
 
+    def _iter_overlap_chunks(self, words: Iterable[str]) -> Iterator[Dict[str, any]]:
+        """
+        Overlap-mode chunks from a stream of words, identical to
+        _chunk_text_overlap on the joined text. Only the words of the chunk
+        being assembled are held in memory.
+        """
+        size = self.chunk_size
+        step = max(1, self.chunk_size - self.overlap)
+        buf: List[str] = []       # words from word index buf_start onwards
+        offsets: List[int] = []   # char offset of each buffered word
+        buf_start = 0
+        next_offset = 0
+        start = 0
+        chunk_idx = 0
+        last_end = 0
+
+        def make_chunk(end):
+            chunk_words = buf[start - buf_start:end - buf_start]
+            chunk_text = ' '.join(chunk_words)
+            char_start = offsets[start - buf_start]
+            return {
+                'chunk_index': chunk_idx,
+                'text': chunk_text,
+                'word_start': start,
+                'word_end': end,
+                'char_start': char_start,
+                'char_end': char_start + len(chunk_text),
+                'word_count': len(chunk_words)
+            }
+
+        for word in words:
+            buf.append(word)
+            offsets.append(next_offset)
+            next_offset += len(word) + 1
+            if buf_start + len(buf) == start + size:
+                yield make_chunk(start + size)
+                last_end = start + size
+                chunk_idx += 1
+                start += step
+                # Drop words no later chunk can contain
+                drop = min(start, last_end) - buf_start
+                del buf[:drop], offsets[:drop]
+                buf_start += drop
+
+        # Trailing chunks, unless the last full chunk ended exactly at the end
+        total = buf_start + len(buf)
+        while start < total and last_end < total:
+            end = min(start + size, total)
+            yield make_chunk(end)
+            last_end = end
+            chunk_idx += 1
+            start += step
+
     def _chunk_text_paragraph(self, text: str) -> List[Dict[str, any]]:
         """
         Split text into chunks respecting paragraph boundaries.
         Accumulates paragraphs until reaching chunk_size words,
         producing more semantically coherent chunks.
         """
+        return list(self._iter_paragraph_chunks(re.split(r'\n\s*\n', text)))
+
+    def _iter_paragraph_chunks(self, paragraphs: Iterable[str]) -> Iterator[Dict[str, any]]:
+        """Paragraph-mode chunks from a stream of paragraphs."""
         min_words = max(self.chunk_size // 2, 50)
         max_words = max(self.chunk_size * 2, 200)
 
-        paragraphs = re.split(r'\n\s*\n', text)
-
-        chunks = []
         current_parts = []
         current_word_count = 0
+        current_start = 0  # word index of the current chunk's first word
+        word_pos = 0       # word index of the next paragraph's first word
         chunk_idx = 0
 
+        def make_chunk():
+            return {
+                'chunk_index': chunk_idx,
+                'text': ' '.join(current_parts),
+                'word_start': current_start,
+                'word_end': current_start + current_word_count,
+                'word_count': current_word_count,
+            }
+
         for para in paragraphs:
             para = para.strip()
             if not para:
@@ -133,6 +380,9 @@ class PDFProcessor:
 
             words = para.split()
             word_count = len(words)
+            if not current_parts:
+                current_start = word_pos
+            word_pos += word_count
 
             if current_word_count + word_count <= max_words:
                 current_parts.append(para)
@@ -140,40 +390,24 @@ class PDFProcessor:
             else:
                 # Save current chunk if it has enough words
                 if current_word_count >= min_words:
-                    chunk_text = ' '.join(current_parts)
-                    chunks.append({
-                        'chunk_index': chunk_idx,
-                        'text': chunk_text,
-                        'word_count': current_word_count,
-                    })
+                    yield make_chunk()
                     chunk_idx += 1
                     current_parts = [para]
+                    current_start += current_word_count
                     current_word_count = word_count
                 else:
                     # Current chunk is too small, keep accumulating
                     current_parts.append(para)
                     current_word_count += word_count
                     if current_word_count >= min_words:
-                        chunk_text = ' '.join(current_parts)
-                        chunks.append({
-                            'chunk_index': chunk_idx,
-                            'text': chunk_text,
-                            'word_count': current_word_count,
-                        })
+                        yield make_chunk()
                         chunk_idx += 1
                         current_parts = []
                         current_word_count = 0
 
         # Final chunk
         if current_parts:
-            chunk_text = ' '.join(current_parts)
-            chunks.append({
-                'chunk_index': chunk_idx,
-                'text': chunk_text,
-                'word_count': current_word_count,
-            })
-
-        return chunks
+            yield make_chunk()
 
     def get_chunk_context(self, chunks: List[Dict], chunk_idx: int,
                           context_before: int = 50, context_after: int = 50) -> Tuple[str, str, str]:
@@ -189,75 +423,141 @@ class PDFProcessor:
         Returns:
             Tuple of (before_context, chunk_text, after_context)
         """
-        chunk = chunks[chunk_idx]
-        chunk_text = chunk['text']
+        chunk_text = chunks[chunk_idx]['text']
 
-        # Get before context
+        # Only split off as many words as are needed from each neighbour
         before_context = ""
-        if chunk_idx > 0:
-            prev_chunk = chunks[chunk_idx - 1]
-            prev_words = prev_chunk['text'].split()
+        if chunk_idx > 0 and context_before > 0:
+            prev_words = chunks[chunk_idx - 1]['text'].rsplit(None, context_before)
             before_context = ' '.join(prev_words[-context_before:])
 
-        # Get after context
         after_context = ""
-        if chunk_idx < len(chunks) - 1:
-            next_chunk = chunks[chunk_idx + 1]
-            next_words = next_chunk['text'].split()
+        if chunk_idx < len(chunks) - 1 and context_after > 0:
+            next_words = chunks[chunk_idx + 1]['text'].split(None, context_after)
             after_context = ' '.join(next_words[:context_after])
 
         return before_context, chunk_text, after_context
 
     def annotate_pdf(self, input_pdf_path: str, output_pdf_path: str,
-                     novelty_scores: List[Dict]) -> str:
+                     novelty_scores: List[Dict], chunks: Optional[List[Dict]] = None) -> str:
         """
         Annotate PDF with color-coded novelty scores.
 
+        Each chunk's words are covered by a highlight annotation colored with
+        get_novelty_color(). Words are located through the page word ranges
+        recorded when input_pdf_path was extracted, and all highlights of a
+        page are built in a single pass over its word boxes.
+
         Args:
             input_pdf_path: Path to input PDF
             output_pdf_path: Path to save annotated PDF
             novelty_scores: List of dicts with chunk_index and novelty_score
+            chunks: The scored chunks (with word_start/word_end); without them
+                    only the legend is added
 
         Returns:
             Path to annotated PDF
         """
-        # Open the PDF
-        doc = fitz.open(input_pdf_path)
-
-        # Create a mapping of chunk index to color
-        score_map = {item['chunk_index']: item['novelty_score']
-                     for item in novelty_scores}
-
-        # Extract text with positions for annotation
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            blocks = page.get_text("dict")["blocks"]
-
-            # For now, add a simple color overlay based on page position
-            # This is a simplified version - more sophisticated text matching
-            # would be needed for precise highlighting
-
-            # Add a legend on the first page
-            if page_num == 0:
-                # Add legend rectangle
-                legend_rect = fitz.Rect(10, 10, 200, 100)
-                page.draw_rect(legend_rect, color=(0, 0, 0), width=1)
-
-                # Add legend text
-                legend_text = """Novelty Legend:
+        with self.profiler.stage("annotate", items=len(novelty_scores),
+                                 bytes=os.path.getsize(input_pdf_path)):
+            # Open the PDF
+            doc = fitz.open(input_pdf_path)
+
+            # Create a mapping of chunk index to score
+            score_map = {item['chunk_index']: item['novelty_score']
+                         for item in novelty_scores}
+
+            # Each word is highlighted once, for the first chunk containing it:
+            # chunk i owns words [word_start_i, min(word_end_i, word_start_i+1))
+            spans = sorted((c['word_start'], c['word_end'], c['chunk_index'])
+                           for c in chunks or []
+                           if 'word_start' in c and c['chunk_index'] in score_map)
+            starts = [start for start, _, _ in spans]
+            ends = [min(end, next_start) for (_, end, _), next_start
+                    in zip(spans, starts[1:] + [float('inf')])]
+            chunk_ids = [idx for _, _, idx in spans]
+            page_words = self._get_page_words(input_pdf_path, doc) if spans else None
+
+            for page_num, page in enumerate(doc):
+                if page_words:
+                    first_word, n_words = page_words[page_num]
+                    self._highlight_page(page, first_word, n_words,
+                                         starts, ends, chunk_ids, score_map)
+
+                # Add a legend on the first page
+                if page_num == 0:
+                    # Add legend rectangle
+                    legend_rect = fitz.Rect(10, 10, 200, 100)
+                    page.draw_rect(legend_rect, color=(0, 0, 0), width=1)
+
+                    # Add legend text
+                    legend_text = """Novelty Legend:
 Green: High (>0.7)
 Yellow: Medium (0.4-0.7)
 Orange: Low (0.2-0.4)
 Red: Very Low (<0.2)"""
 
-                page.insert_text((15, 25), legend_text, fontsize=10)
+                    page.insert_text((15, 25), legend_text, fontsize=10)
 
-        # Save annotated PDF
-        doc.save(output_pdf_path)
-        doc.close()
+            # Save annotated PDF
+            doc.save(output_pdf_path)
+            doc.close()
 
         return output_pdf_path
 
+    def _get_page_words(self, pdf_path: str, doc: fitz.Document) -> List[Tuple[int, int]]:
+        """Per-page (first word index, word count), reusing the last extraction
+        of pdf_path when it covered the whole document."""
+        if self._page_words and self._page_words[0] == pdf_path \
+                and len(self._page_words[1]) == len(doc):
+            return self._page_words[1]
+        pages: List[Tuple[int, int]] = []
+        for _ in _track_page_words((page.get_text() for page in doc), pages):
+            pass
+        return pages
+
+    def _highlight_page(self, page: fitz.Page, first_word: int, n_words: int,
+                        starts: List[int], ends: List[int], chunk_ids: List[int],
+                        score_map: Dict[int, float]):
+        """Add one highlight annotation per chunk on the page, merging the word
+        boxes of a chunk that share a text line into a single rectangle."""
+        boxes = page.get_text("words")
+        if len(boxes) == n_words:
+            indices = range(first_word, first_word + n_words)
+        else:
+            indices = _align_word_boxes(page.get_text().split(), boxes, first_word)
+
+        # Plain [x0, y0, x1, y1] lists: fitz.Rect arithmetic is slow per word
+        rects_by_chunk: Dict[int, List[List[float]]] = {}
+        last = None  # (span, block, line) of the previous highlighted word
+        for word_idx, box in zip(indices, boxes):
+            span = bisect_right(starts, word_idx) - 1 if word_idx is not None else -1
+            if span < 0 or word_idx >= ends[span]:
+                last = None
+                continue
+            key = (span, box[5], box[6])
+            rects = rects_by_chunk.setdefault(span, [])
+            if key == last:
+                rect = rects[-1]
+                rect[0] = min(rect[0], box[0])
+                rect[1] = min(rect[1], box[1])
+                rect[2] = max(rect[2], box[2])
+                rect[3] = max(rect[3], box[3])
+            else:
+                rects.append(list(box[:4]))
+            last = key
+
+        for span, rects in rects_by_chunk.items():
+            chunk_index = chunk_ids[span]
+            score = score_map[chunk_index]
+            color = self.get_novelty_color(score)
+            annot = page.add_highlight_annot([fitz.Rect(r) for r in rects])
+            annot.set_colors(stroke=(color.red, color.green, color.blue))
+            annot.set_opacity(color.alpha)
+            annot.set_info(title="Novelty",
+                           content=f"Chunk {chunk_index}: novelty {score:.2f}")
+            annot.update()
+
     def get_novelty_color(self, score: float) -> Color:
         """
         Get color for a novelty score.
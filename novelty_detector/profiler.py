@@ -0,0 +1,223 @@
+"""
+Lightweight per-stage profiling for the novelty pipeline.
+
+A StageProfiler records, per named stage (extract, chunk, prompts, embed,
+index, score, annotate), wall and CPU seconds, calls, items and bytes
+processed, and cache hits and misses. Stages nest per thread and are charged
+their exclusive time: a stage that pulls from a lazy upstream stage (prompt
+generation consuming streamed extraction) is not charged for the upstream
+work, even when the two are recorded by different profilers. CPU time is
+process CPU time, so it includes helper threads such as torch's intra-op
+pool, and the work of other requests running at the same time.
+
+Finished profiles are folded into PipelineMetrics, which the server exposes
+in the Prometheus text format. The totals live in SQLite (METRICS_DB_PATH,
+WAL mode), shared by all server workers. Every scrape therefore sees one
+monotonic set of counters, whichever gunicorn worker answers it.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+COUNTERS = ("calls", "items", "bytes", "cache_hits", "cache_misses")
+# Upper bounds (seconds) of the per-document duration histogram
+DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 3600)
+
+METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "metrics.sqlite"))
+
+# Open stage frames of the current thread, shared by all profilers:
+# [wall start, cpu start, nested wall, nested cpu]
+_frames = threading.local()
+
+
+def _stack() -> List[List[float]]:
+    stack = getattr(_frames, "stack", None)
+    if stack is None:
+        stack = _frames.stack = []
+    return stack
+
+
+class StageProfiler:
+    """Per-stage wall/CPU time and counters for one pipeline run."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, name: str) -> Dict[str, float]:
+        if name not in self._stages:
+            self._stages[name] = {"wall_s": 0.0, "cpu_s": 0.0, **dict.fromkeys(COUNTERS, 0)}
+        return self._stages[name]
+
+    def count(self, name: str, **counters: int):
+        """Add to a stage's counters (calls, items, bytes, cache_hits, cache_misses)."""
+        with self._lock:
+            entry = self._entry(name)
+            for key, value in counters.items():
+                entry[key] = entry.get(key, 0) + value
+
+    def _enter(self):
+        _stack().append([time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+    def _exit(self, name: str, **counters: int):
+        stack = _stack()
+        wall_start, cpu_start, nested_wall, nested_cpu = stack.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        if stack:
+            stack[-1][2] += wall
+            stack[-1][3] += cpu
+        with self._lock:
+            entry = self._entry(name)
+            entry["wall_s"] += wall - nested_wall
+            entry["cpu_s"] += cpu - nested_cpu
+            for key, value in counters.items():
+                entry[key] = entry.get(key, 0) + value
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0, bytes: int = 0):
+        """Time the enclosed block as one call of stage name."""
+        self._enter()
+        try:
+            yield self
+        finally:
+            self._exit(name, calls=1, items=items, bytes=bytes)
+
+    def iter(self, name: str, iterable: Iterable,
+             size: Optional[Callable[[object], int]] = None) -> Iterator:
+        """
+        Yield from iterable, charging the time spent producing each item to
+        stage name: one call in total, one item per element and size(item) bytes.
+        """
+        iterator = iter(iterable)
+        self.count(name, calls=1)
+        while True:
+            self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._exit(name)
+                return
+            except BaseException:
+                self._exit(name)
+                raise
+            self._exit(name, items=1, bytes=size(item) if size else 0)
+            yield item
+
+    def report(self) -> Dict:
+        """Total wall time since creation and the per-stage figures (JSON-serialisable)."""
+        with self._lock:
+            stages = {
+                name: {key: round(value, 4) if key.endswith("_s") else int(value)
+                       for key, value in entry.items()}
+                for name, entry in self._stages.items()
+            }
+        return {"wall_s": round(time.perf_counter() - self.started, 4), "stages": stages}
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(round(value, 4))
+
+
+class PipelineMetrics:
+    """Totals of finished profiles across all server workers, rendered for Prometheus."""
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: SQLite file shared by the workers (':memory:' for this process only)
+        """
+        self.path = path or METRICS_DB_PATH
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS stage_totals (
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (stage, key)
+            );
+            CREATE TABLE IF NOT EXISTS document_totals (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def observe(self, profile: Union[StageProfiler, Dict]):
+        """Add one finished run (a StageProfiler or its report())."""
+        report = profile.report() if isinstance(profile, StageProfiler) else profile
+        stage_rows = [(name, key, value) for name, figures in report["stages"].items()
+                      for key, value in figures.items()]
+        document_rows = [("documents", 1), ("seconds", report["wall_s"])]
+        document_rows += [(f"le_{bound}", 1) for bound in DURATION_BUCKETS
+                          if report["wall_s"] <= bound]
+        with self._lock:
+            # Additive upserts, so concurrent workers never lose each other's runs
+            self._conn.executemany(
+                "INSERT INTO stage_totals (stage, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (stage, key) DO UPDATE SET value = value + excluded.value",
+                stage_rows)
+            self._conn.executemany(
+                "INSERT INTO document_totals (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + excluded.value",
+                document_rows)
+            self._conn.commit()
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        metrics = [
+            ("wall_s", "novelty_stage_seconds_total",
+             "Wall time spent in each pipeline stage, excluding nested stages"),
+            ("cpu_s", "novelty_stage_cpu_seconds_total",
+             "Process CPU time spent in each pipeline stage, excluding nested stages"),
+            ("calls", "novelty_stage_calls_total", "Times each pipeline stage ran"),
+            ("items", "novelty_stage_items_total",
+             "Items processed per stage (pages, chunks, texts, scores)"),
+            ("bytes", "novelty_stage_bytes_total", "Bytes read per stage"),
+            ("cache_hits", "novelty_stage_cache_hits_total", "Cache hits per stage"),
+            ("cache_misses", "novelty_stage_cache_misses_total", "Cache misses per stage"),
+        ]
+        with self._lock:
+            stages: Dict[str, Dict[str, float]] = {}
+            for name, key, value in self._conn.execute(
+                    "SELECT stage, key, value FROM stage_totals ORDER BY rowid"):
+                stages.setdefault(name, {})[key] = value
+            documents = dict(self._conn.execute("SELECT key, value FROM document_totals"))
+        count = int(documents.get("documents", 0))
+        lines = []
+        for key, metric, help_text in metrics:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for name, totals in stages.items():
+                lines.append(f'{metric}{{stage="{name}"}} {_number(totals.get(key, 0))}')
+        lines += ["# HELP novelty_document_seconds Wall time of whole document analyses",
+                  "# TYPE novelty_document_seconds histogram"]
+        for bound in DURATION_BUCKETS:
+            lines.append(f'novelty_document_seconds_bucket{{le="{bound}"}} '
+                         f'{int(documents.get(f"le_{bound}", 0))}')
+        lines += [f'novelty_document_seconds_bucket{{le="+Inf"}} {count}',
+                  f"novelty_document_seconds_sum {_number(documents.get('seconds', 0))}",
+                  f"novelty_document_seconds_count {count}"]
+        return "\n".join(lines) + "\n"
+
+
+_metrics: Optional[PipelineMetrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_pipeline_metrics() -> PipelineMetrics:
+    """Process-wide PipelineMetrics (on the database shared by all workers)."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = PipelineMetrics()
+        return _metrics
@@ -0,0 +1,104 @@
+"""
+Persistent SQLite cache for LLM-generated chunk prompts.
+
+Prompts are keyed on a hash of (provider, model, chunk_text, before_context,
+after_context), so a resubmitted or re-run document only pays for chunks whose
+text or neighbourhood changed. The database is shared by all server workers
+(WAL mode) and trimmed least-recently-used first once it exceeds max_bytes.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from typing import Optional
+
+from sqlite_lru import SQLiteLRUStore
+
+# Relative defaults live next to this module, not in the working directory
+PROMPT_CACHE_PATH = os.getenv(
+    "PROMPT_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "prompt_cache.sqlite"))
+PROMPT_CACHE_MAX_MB = float(os.getenv("PROMPT_CACHE_MAX_MB", 256))
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+
+
+class PromptCache(SQLiteLRUStore):
+    """SQLite-backed prompt cache with size-based LRU eviction (see sqlite_lru)."""
+
+    table = "prompts"
+    schema = """
+        CREATE TABLE IF NOT EXISTS prompts (
+            key TEXT PRIMARY KEY,
+            provider TEXT,
+            model TEXT,
+            prompt TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL,
+            hit_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_prompts_last_used ON prompts(last_used)
+    """
+    key_columns = ("key",)
+    size_expr = "{row}.size"
+    hit_column = "hit_count"
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        """
+        Args:
+            path: SQLite file path (':memory:' for a throwaway cache)
+            max_bytes: Approximate size cap for stored prompts and keys
+        """
+        super().__init__(
+            path or PROMPT_CACHE_PATH,
+            max_bytes if max_bytes is not None else int(PROMPT_CACHE_MAX_MB * 1024 * 1024))
+
+    @staticmethod
+    def make_key(provider: str, model: Optional[str], chunk_text: str,
+                 before_context: str = "", after_context: str = "") -> str:
+        """Stable hash of everything that determines a generated prompt."""
+        h = hashlib.sha256()
+        for part in (provider, model or "", chunk_text, before_context, after_context):
+            data = part.encode("utf-8")
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached prompt for key, or None (counts a hit or miss)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT prompt FROM prompts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touch([(key,)])
+            return row[0]
+
+    def put(self, key: str, prompt: str, provider: str = "", model: Optional[str] = None):
+        """Store a prompt and evict old entries if the cache is over its size cap."""
+        size = len(prompt.encode("utf-8")) + len(key)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompts (key, provider, model, prompt, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, prompt, size, now, now))
+            self._evict()
+            self._conn.commit()
+
+
+_default_cache: Optional[PromptCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_prompt_cache() -> Optional[PromptCache]:
+    """Process-wide prompt cache, or None when PROMPT_CACHE_ENABLED=0."""
+    global _default_cache
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PromptCache()
+        return _default_cache
@@ -0,0 +1,139 @@
+"""
+Background health monitor for LLM providers.
+
+Live provider checks do network I/O (Ollama's is a GET /api/tags), which
+does not belong on the request path. ProviderMonitor probes the
+server-configured providers on a daemon thread every
+PROVIDER_MONITOR_INTERVAL seconds and keeps the last result per provider,
+with when it was taken and how long it took. The status endpoint, the
+provider router and provider selection read that cache.
+
+A provider that has not been probed yet counts as up, so a monitor that is
+disabled or still on its first round changes nothing.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from llm_providers import LLMProvider, discover_providers
+from model_registry import get_model_registry
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_MONITOR_ENABLED = os.getenv("PROVIDER_MONITOR_ENABLED", "1") == "1"
+PROVIDER_MONITOR_INTERVAL = float(os.getenv("PROVIDER_MONITOR_INTERVAL", 30))
+
+
+class ProviderMonitor:
+    """Probes providers on a background thread and caches timestamped status."""
+
+    def __init__(self, interval: float = None,
+                 discover: Optional[Callable[[], Dict[str, LLMProvider]]] = None):
+        """
+        Args:
+            interval: Seconds between probe rounds (default: PROVIDER_MONITOR_INTERVAL)
+            discover: Returns the providers to probe (default: discover_providers
+                      with the server's own keys and pooled clients)
+        """
+        self.interval = PROVIDER_MONITOR_INTERVAL if interval is None else interval
+        self._discover = discover or (lambda: discover_providers(registry=get_model_registry()))
+        self._status: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.rounds = 0
+
+    def probe(self, name: str, provider: LLMProvider) -> Dict:
+        """Probe one provider now and cache the result."""
+        start = time.monotonic()
+        error = None
+        try:
+            available = bool(provider.probe())
+        except Exception as e:
+            available, error = False, str(e)
+        entry = {
+            "available": available,
+            "model": getattr(provider, "model", None),
+            "checked_at": time.time(),
+            "latency_ms": round((time.monotonic() - start) * 1000, 1),
+            "error": error,
+        }
+        with self._lock:
+            previous = self._status.get(name)
+            self._status[name] = entry
+        if previous is not None and previous["available"] != available:
+            if available:
+                logger.info(f"Provider {name} is back up")
+            else:
+                logger.warning(f"Provider {name} is down{f': {error}' if error else ''}")
+        return self._with_age(entry)
+
+    def probe_all(self) -> Dict[str, Dict]:
+        """Run one probe round over the discovered providers."""
+        for name, provider in self._discover().items():
+            self.probe(name, provider)
+        self.rounds += 1
+        return self.snapshot()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.warning(f"Provider monitor round failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start probing in the background (the first round runs immediately)."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="provider-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _with_age(self, entry: Dict) -> Dict:
+        age = time.time() - entry["checked_at"]
+        # A result older than two rounds means probing has stalled or stopped
+        return {**entry, "age_s": round(age, 1), "stale": age > 2 * self.interval}
+
+    def status(self, name: str) -> Optional[Dict]:
+        """Cached status of a provider (None if it has not been probed)."""
+        with self._lock:
+            entry = self._status.get(name)
+        return self._with_age(entry) if entry else None
+
+    def is_up(self, name: str) -> bool:
+        """False only if the last probe found the provider down."""
+        with self._lock:
+            entry = self._status.get(name)
+        return entry is None or entry["available"]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            entries = dict(self._status)
+        return {name: self._with_age(entry) for name, entry in entries.items()}
+
+
+_monitor: Optional[ProviderMonitor] = None
+_monitor_lock = threading.Lock()
+
+
+def get_provider_monitor() -> ProviderMonitor:
+    """Process-wide ProviderMonitor (started by the server app, not on first use)."""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = ProviderMonitor()
+        return _monitor
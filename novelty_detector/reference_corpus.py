@@ -0,0 +1,481 @@
+"""
+Persistent reference corpus for cross-document novelty.
+
+Every chunk of every added document is stored as a vector, and a SQLite side
+table maps each chunk id back to its source document and chunk. New uploads
+can then be scored against everything previously submitted or published in a
+course, not only against their own chunks.
+
+Layout of a corpus directory (one per corpus name, e.g. per course):
+  shards/<n>.npy         one document's unit vectors, written once
+  index.<gen>.faiss      FAISS index of the documents up to generation <gen>
+  index.<gen>.ids.npy    chunk id of each row of that index
+  corpus.sqlite          documents, their shard, id -> (doc_id, chunk_index,
+                         preview), and the generation counters
+  corpus.lock            serialises writers across server workers
+
+The persisted index is chosen by vector_index.create_index for the corpus
+size (flat, HNSW or IVF-PQ). Readers memory-map it, so opening a large corpus
+costs almost nothing at server startup and workers share the pages. Adding a
+document only writes its shard. Readers search documents added since the
+index was written in a small in-memory flat index next to it. Once that delta
+exceeds REFERENCE_INDEX_DELTA_MAX vectors, the writer appends it to the
+persisted index and writes a new generation of the index file. A removal
+rebuilds the index from the remaining shards at once. Every change bumps a
+generation number in the database, which tells readers what to reload.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+
+from vector_index import choose_index_type, create_index
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_CORPUS_DIR = os.getenv("REFERENCE_CORPUS_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "corpus"))
+DEFAULT_CORPUS = "default"
+# Vectors added since the index file was written, searched from memory
+# before the writer folds them into a new index file
+REFERENCE_INDEX_DELTA_MAX = int(os.getenv("REFERENCE_INDEX_DELTA_MAX", 10_000))
+
+
+def _mmap_flag(kind: str) -> int:
+    """Read flag that maps an index's vectors instead of copying them."""
+    # Flat codes (flat and the HNSW storage) map zero-copy with MMAP_IFC;
+    # IVF inverted lists need MMAP, which refuses nothing else but copies codes
+    return faiss.IO_FLAG_MMAP if kind == "ivfpq" else faiss.IO_FLAG_MMAP_IFC
+
+
+def _index_kind(index: faiss.Index) -> str:
+    """Type of an index from create_index, which falls back to flat for small corpora."""
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "ivfpq"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class ReferenceCorpus:
+    """Memory-mapped FAISS index of reference document chunks with an id map."""
+
+    def __init__(self, name: str = DEFAULT_CORPUS, root: str = None,
+                 index_type: Optional[str] = None, delta_max: Optional[int] = None):
+        """
+        Args:
+            name: Corpus name (a directory under root), e.g. a course id
+            root: Parent directory of all corpora (default: REFERENCE_CORPUS_DIR)
+            index_type: 'auto', 'flat', 'hnsw' or 'ivfpq' (default: NOVELTY_INDEX_TYPE)
+            delta_max: Vectors kept out of the index file before it is rewritten
+                       (default: REFERENCE_INDEX_DELTA_MAX; 0 rewrites it on every add)
+        """
+        self.name = name
+        self.path = os.path.join(root or REFERENCE_CORPUS_DIR, name)
+        self.shard_dir = os.path.join(self.path, "shards")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.index_type = index_type
+        self.delta_max = REFERENCE_INDEX_DELTA_MAX if delta_max is None else delta_max
+        self._lock = threading.RLock()
+        # Memory-mapped index file, and the chunk id of each of its rows
+        self._main: Optional[faiss.Index] = None
+        self._main_ids = np.empty(0, dtype="int64")
+        self._main_kind: Optional[str] = None
+        self._main_generation = -1
+        # Documents added after the index file was written
+        self._delta: Optional[faiss.Index] = None
+        self._delta_ids = np.empty(0, dtype="int64")
+        self._loaded_generation = -1
+
+        self._conn = sqlite3.connect(os.path.join(self.path, "corpus.sqlite"),
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                title TEXT,
+                n_chunks INTEGER NOT NULL,
+                added REAL NOT NULL,
+                metadata TEXT,
+                first_id INTEGER NOT NULL,
+                generation INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                text_preview TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id);
+            CREATE INDEX IF NOT EXISTS idx_documents_generation ON documents(generation);
+        """)
+        self._conn.commit()
+
+    # ── Index loading ─────────────────────────────────────────────────────
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _meta_int(self, key: str) -> int:
+        return int(self._meta(key) or 0)
+
+    def _set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           (key, str(value)))
+
+    def _shard_path(self, first_id: int) -> str:
+        return os.path.join(self.shard_dir, f"{first_id}.npy")
+
+    def _index_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"index.{generation}.faiss")
+
+    def _ids_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"index.{generation}.ids.npy")
+
+    def _read_shards(self, since_generation: int):
+        """Chunk ids and vectors of documents added after since_generation, in add order."""
+        rows = self._conn.execute(
+            "SELECT first_id, n_chunks FROM documents WHERE generation > ? "
+            "ORDER BY generation", (since_generation,)).fetchall()
+        ids = [np.arange(first, first + n, dtype="int64") for first, n in rows]
+        vectors = [np.load(self._shard_path(first), mmap_mode="r") for first, _ in rows]
+        return ids, vectors
+
+    def _refresh(self):
+        """Bring the loaded index and delta up to the corpus generation in the database."""
+        with self._shared_lock():
+            generation = self._meta_int("generation")
+            if generation == self._loaded_generation:
+                return
+            index_generation = self._meta_int("index_generation")
+            if index_generation != self._main_generation:
+                kind = self._meta("index_type")
+                if index_generation and kind:
+                    self._main = faiss.read_index(self._index_path(index_generation),
+                                                  _mmap_flag(kind))
+                    self._main_ids = np.load(self._ids_path(index_generation))
+                else:
+                    self._main, self._main_ids = None, np.empty(0, dtype="int64")
+                self._main_kind = kind or None
+                self._main_generation = index_generation
+                self._delta, self._delta_ids = None, np.empty(0, dtype="int64")
+                since = index_generation
+            else:
+                since = self._loaded_generation
+            ids, vectors = self._read_shards(since)
+            if ids:
+                new_vectors = np.concatenate(vectors)
+                if self._delta is None:
+                    self._delta = faiss.IndexFlatIP(new_vectors.shape[1])
+                self._delta.add(new_vectors)
+                self._delta_ids = np.concatenate([self._delta_ids] + ids)
+            self._loaded_generation = generation
+
+    def _write_index(self, rebuild: bool):
+        """
+        Write the index file for the current generation (caller holds the writer lock).
+
+        Without rebuild, the documents added since the last index file are
+        appended to a writable copy of it, as long as the corpus still fits
+        the same index type; otherwise the index is built from all shards.
+        """
+        generation = self._meta_int("generation")
+        old_generation = self._meta_int("index_generation")
+        old_kind = self._meta("index_type")
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(n_chunks), 0) FROM documents").fetchone()[0]
+        kind = choose_index_type(total, self.index_type) if total else ""
+
+        # A flat fallback is rebuilt once the corpus is large enough for its type
+        index = None
+        if total and not rebuild and old_generation and old_kind == kind:
+            index = faiss.read_index(self._index_path(old_generation))
+            ids, vectors = self._read_shards(old_generation)
+            if vectors:
+                index.add(np.concatenate(vectors))
+            ids = np.concatenate([np.load(self._ids_path(old_generation))] + ids)
+        elif total:
+            ids, vectors = self._read_shards(0)
+            index = create_index(np.concatenate(vectors), kind)
+            ids = np.concatenate(ids)
+            kind = _index_kind(index)
+
+        if index is not None:
+            tmp = f".tmp{os.getpid()}"
+            faiss.write_index(index, self._index_path(generation) + tmp)
+            np.save(self._ids_path(generation) + tmp + ".npy", ids)
+            os.replace(self._index_path(generation) + tmp, self._index_path(generation))
+            os.replace(self._ids_path(generation) + tmp + ".npy", self._ids_path(generation))
+        self._set_meta("index_generation", generation if index is not None else 0)
+        self._set_meta("index_type", kind)
+        self._conn.commit()
+
+        # Readers that still map an older file keep it until they reload
+        current = {os.path.basename(self._index_path(generation)),
+                   os.path.basename(self._ids_path(generation))}
+        for name in os.listdir(self.path):
+            if name.startswith("index.") and name not in current:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        with open(os.path.join(self.path, "corpus.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _shared_lock(self):
+        """Readers: no shard is deleted while they load."""
+        return self._file_lock(fcntl.LOCK_SH if fcntl is not None else 0)
+
+    @contextmanager
+    def _writer(self):
+        """Exclusive write access: thread lock plus a file lock across processes."""
+        with self._lock, self._file_lock(fcntl.LOCK_EX if fcntl is not None else 0):
+            yield
+
+    # ── Metadata ──────────────────────────────────────────────────────────
+
+    @property
+    def model_key(self) -> Optional[str]:
+        """Embedding provider/model the corpus vectors were made with."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'model_key'").fetchone()
+        return row[0] if row else None
+
+    def _check_model(self, model_key: Optional[str]):
+        stored = self.model_key
+        if model_key and stored and model_key != stored:
+            raise ValueError(
+                f"Corpus '{self.name}' was built with embeddings from {stored}, "
+                f"not {model_key}")
+
+    def has_document(self, doc_id: str) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def list_documents(self) -> List[Dict]:
+        rows = self._conn.execute(
+            "SELECT doc_id, title, n_chunks, added, metadata FROM documents ORDER BY added")
+        return [
+            {"doc_id": d, "title": t, "n_chunks": n, "added": a,
+             "metadata": json.loads(m) if m else {}}
+            for d, t, n, a, m in rows
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refresh()
+            indexed = self._main.ntotal if self._main is not None else 0
+            pending = self._delta.ntotal if self._delta is not None else 0
+            index_kind = self._main_kind
+            mapped = self._main is not None
+        n_docs = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {
+            "name": self.name,
+            "documents": n_docs,
+            "chunks": indexed + pending,
+            "indexed_chunks": indexed,
+            "pending_chunks": pending,
+            "dimension": self._meta_int("dimension") or None,
+            "model_key": self.model_key,
+            "index_type": index_kind,
+            "memory_mapped": mapped,
+        }
+
+    # ── Updates ───────────────────────────────────────────────────────────
+
+    def add_document(self, doc_id: str, embeddings: np.ndarray,
+                     previews: Optional[List[str]] = None, title: str = None,
+                     metadata: Optional[Dict] = None, model_key: str = None) -> int:
+        """
+        Add (or replace) a document's chunk embeddings.
+
+        Args:
+            doc_id: Stable document identifier; re-adding replaces the old vectors
+            embeddings: (n_chunks, dim) chunk embeddings
+            previews: Short text per chunk, returned with matches
+            title: Human-readable document title
+            metadata: Extra JSON-serialisable fields stored with the document
+            model_key: Embedding provider/model (checked against the corpus)
+
+        Returns:
+            Number of chunks stored
+        """
+        vectors = _normalize(embeddings)
+        n = len(vectors)
+        previews = previews or [""] * n
+        with self._writer():
+            self._check_model(model_key)
+            dim = self._meta_int("dimension")
+            if dim and dim != vectors.shape[1]:
+                raise ValueError(f"Corpus '{self.name}' has dimension {dim}, "
+                                 f"got {vectors.shape[1]}")
+            replaced = self._remove_locked(doc_id)
+
+            # Ids are never reused, so a shard file name is never rewritten
+            start = self._meta_int("next_id")
+            shard_path = self._shard_path(start)
+            tmp_path = f"{shard_path}.tmp{os.getpid()}.npy"
+            np.save(tmp_path, vectors)
+            os.replace(tmp_path, shard_path)
+
+            generation = self._meta_int("generation") + 1
+            self._conn.executemany(
+                "INSERT INTO chunks (id, doc_id, chunk_index, text_preview) VALUES (?, ?, ?, ?)",
+                [(start + c, doc_id, c, previews[c][:200]) for c in range(n)])
+            self._conn.execute(
+                "INSERT INTO documents (doc_id, title, n_chunks, added, metadata, first_id, "
+                "generation) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, title, n, time.time(), json.dumps(metadata or {}), start, generation))
+            self._set_meta("next_id", start + n)
+            self._set_meta("generation", generation)
+            self._set_meta("dimension", vectors.shape[1])
+            if model_key:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO meta (key, value) VALUES ('model_key', ?)", (model_key,))
+            self._conn.commit()
+
+            pending = self._conn.execute(
+                "SELECT COALESCE(SUM(n_chunks), 0) FROM documents WHERE generation > ?",
+                (self._meta_int("index_generation"),)).fetchone()[0]
+            if replaced or pending > self.delta_max:
+                self._write_index(rebuild=bool(replaced))
+        logger.info(f"Added {n} chunks of '{doc_id}' to corpus '{self.name}'")
+        return n
+
+    def _remove_locked(self, doc_id: str) -> int:
+        row = self._conn.execute(
+            "SELECT first_id, n_chunks FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return 0
+        self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+        self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+        # Until the caller rewrites the index file, search skips the dropped ids
+        self._set_meta("generation", self._meta_int("generation") + 1)
+        self._conn.commit()
+        try:
+            os.remove(self._shard_path(row[0]))
+        except FileNotFoundError:
+            pass
+        return row[1]
+
+    def remove_document(self, doc_id: str) -> int:
+        """Remove a document's vectors; returns how many chunks were dropped."""
+        with self._writer():
+            removed = self._remove_locked(doc_id)
+            if removed:
+                # Index types here cannot drop rows cheaply: rebuild from the shards
+                self._write_index(rebuild=True)
+            return removed
+
+    # ── Queries ───────────────────────────────────────────────────────────
+
+    def search(self, embeddings: np.ndarray, k: int = 5,
+               exclude_doc_id: Optional[str] = None,
+               model_key: str = None) -> List[List[Dict]]:
+        """
+        Nearest corpus chunks for each query embedding.
+
+        Args:
+            embeddings: (n, dim) query embeddings
+            k: Matches per query
+            exclude_doc_id: Ignore chunks of this document (e.g. the query itself)
+            model_key: Embedding provider/model of the queries (checked)
+
+        Returns:
+            Per query, up to k dicts {doc_id, chunk_index, similarity, text_preview},
+            most similar first
+        """
+        self._check_model(model_key)
+        queries = _normalize(embeddings)
+        with self._lock:
+            self._refresh()
+            parts = [(index, row_ids) for index, row_ids in
+                     ((self._main, self._main_ids), (self._delta, self._delta_ids))
+                     if index is not None and index.ntotal]
+            if not parts:
+                return [[] for _ in range(len(queries))]
+            dim = parts[0][0].d
+            if dim != queries.shape[1]:
+                raise ValueError(f"Corpus '{self.name}' has dimension {dim}, "
+                                 f"got {queries.shape[1]}")
+            excluded = 0
+            if exclude_doc_id:
+                excluded = self._conn.execute(
+                    "SELECT COUNT(*) FROM chunks WHERE doc_id = ?", (exclude_doc_id,)).fetchone()[0]
+            all_distances, all_ids = [], []
+            for index, row_ids in parts:
+                distances, rows = index.search(queries, min(index.ntotal, k + excluded))
+                all_distances.append(distances)
+                all_ids.append(np.where(rows >= 0, row_ids[rows], -1))
+
+        # Merge the index file's and the delta's candidates by similarity
+        distances, ids = np.hstack(all_distances), np.hstack(all_ids)
+        order = np.argsort(-distances, axis=1, kind="stable")
+        distances = np.take_along_axis(distances, order, axis=1)
+        ids = np.take_along_axis(ids, order, axis=1)
+
+        wanted = sorted({int(i) for i in ids.ravel() if i >= 0})
+        info = {}
+        for start in range(0, len(wanted), 500):
+            part = wanted[start:start + 500]
+            marks = ",".join("?" * len(part))
+            for row in self._conn.execute(
+                    f"SELECT id, doc_id, chunk_index, text_preview FROM chunks WHERE id IN ({marks})",
+                    part):
+                info[row[0]] = row[1:]
+
+        results = []
+        for dist_row, id_row in zip(distances.tolist(), ids.tolist()):
+            matches = []
+            for sim, i in zip(dist_row, id_row):
+                if i < 0 or i not in info or info[i][0] == exclude_doc_id:
+                    continue
+                doc_id, chunk_index, preview = info[i]
+                matches.append({"doc_id": doc_id, "chunk_index": chunk_index,
+                                "similarity": sim, "text_preview": preview})
+                if len(matches) == k:
+                    break
+            results.append(matches)
+        return results
+
+
+_corpora: Dict[str, ReferenceCorpus] = {}
+_corpora_lock = threading.Lock()
+
+
+def get_reference_corpus(name: str = DEFAULT_CORPUS) -> ReferenceCorpus:
+    """Process-wide ReferenceCorpus for a corpus name."""
+    with _corpora_lock:
+        if name not in _corpora:
+            _corpora[name] = ReferenceCorpus(name)
+        return _corpora[name]
@@ -6,6 +6,9 @@ and downloading annotated results. Uses Blueprint at /novelty prefix.
 
 import os
 import json
+import uuid
+import tempfile
+import threading
 import numpy as np
 from pathlib import Path
 from flask import Flask, Blueprint, request, jsonify, send_file, render_template
@@ -15,12 +18,23 @@ from dotenv import load_dotenv
 import traceback
 
 from pdf_processor import PDFProcessor
-from novelty_detector import NoveltyDetector
-from ollama_client import OllamaClient
-from llm_providers import discover_providers
+from novelty_detector import EMBEDDING_MODE, EMBEDDING_MODES, NoveltyDetector, warm_up_models
+from ollama_client import get_ollama_client
+from llm_providers import (
+    ROUTER_POLICIES, ROUTER_POLICY, RouterProvider, discover_providers, provider_stats_snapshot,
+)
+from prompt_cache import get_prompt_cache
+from usage_log import get_usage_log
+from profiler import StageProfiler, get_pipeline_metrics
+from embedding_cache import get_embedding_cache
+from reference_corpus import get_reference_corpus
+from job_queue import get_job_queue
+from model_registry import MODEL_WARMUP, get_model_registry
+from provider_monitor import PROVIDER_MONITOR_ENABLED, get_provider_monitor
 from cost_config import (
     PROVIDERS, EMBEDDING_PROVIDERS,
-    estimate_cost, estimate_cost_all_providers,
+    estimate_cost, estimate_chunks_cost, estimate_cost_all_providers,
+    load_tiktoken_encodings,
 )
 
 # Load environment variables
@@ -116,6 +130,8 @@ def get_config():
         },
         'embedding_model': os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2'),
         'embedding_provider': os.getenv('EMBEDDING_PROVIDER', 'local'),
+        'embedding_mode': EMBEDDING_MODE,
+        'embedding_modes': list(EMBEDDING_MODES),
         'default_llm_provider': os.getenv('DEFAULT_LLM_PROVIDER', 'ollama'),
         'max_upload_size': MAX_CONTENT_LENGTH
     })
@@ -155,12 +171,107 @@ def list_providers():
     return jsonify({
         'llm_providers': llm_providers,
         'embedding_providers': embed_providers,
+        # llm_provider=router picks a provider per call; llm_model selects the policy
+        'router': {'policies': list(ROUTER_POLICIES), 'default_policy': ROUTER_POLICY},
     })
 
 
+def _analyze_upload(input_path, filename, run_id, params, api_keys, progress):
+    """Full upload pipeline (runs as a background job).
+
+    Extracts, chunks and scores the PDF, writes the annotated PDF and the
+    results JSON, and returns the upload response payload. progress(done=,
+    total=, stage=) reports chunk progress to the job queue. Output names
+    carry run_id, so jobs for files with the same name (in any worker) never
+    overwrite each other's results.
+    """
+    # One profiler for the whole run: per-stage timings go into the results
+    profiler = StageProfiler()
+    pdf_processor = PDFProcessor(chunk_size=params['chunk_size'], overlap=params['overlap'],
+                                 chunking_mode=params['chunking_mode'], profiler=profiler)
+    progress(stage='loading')
+    novelty_detector = NoveltyDetector(
+        llm_provider=params['llm_provider'],
+        llm_model=params['llm_model'],
+        embedding_provider=params['embedding_provider'],
+        embedding_model_name=params['embedding_model'],
+        api_keys=api_keys,
+        embedding_mode=params['embedding_mode'],
+        profiler=profiler,
+    )
+
+    # Extract, chunk and analyze as a stream: prompts for early chunks are
+    # generated while later pages are still being extracted
+    print(f"Processing {filename}...")
+    progress(stage='prompts')
+    chunks, novelty_scores = novelty_detector.analyze_stream(
+        pdf_processor.iter_chunk_contexts(pdf_processor.stream_chunks(input_path)),
+        k=params['k_neighbors'],
+        progress=lambda done, total: progress(done=done, total=total),
+    )
+    print(f"Extracted {len(chunks)} chunks from PDF")
+    if not chunks:
+        raise ValueError('No text could be extracted from the PDF')
+
+    # Get summary statistics
+    stats = novelty_detector.get_summary_statistics(novelty_scores)
+
+    # Create annotated PDF
+    progress(stage='annotating')
+    annotated_filename = f"annotated_{run_id}_{filename}"
+    output_path = os.path.join(UPLOAD_FOLDER, annotated_filename)
+    pdf_processor.annotate_pdf(input_path, output_path, novelty_scores, chunks)
+
+    # Save detailed results to JSON
+    results_filename = f"{run_id}_{Path(filename).stem}_results.json"
+    results_path = os.path.join(UPLOAD_FOLDER, results_filename)
+
+    results_data = {
+        'original_filename': filename,
+        'annotated_filename': annotated_filename,
+        'chunks_analyzed': len(chunks),
+        'word_count': sum(c['word_count'] for c in chunks),
+        'statistics': stats,
+        'novelty_scores': novelty_scores,
+        'parameters': {
+            'chunk_size': params['chunk_size'],
+            'overlap': params['overlap'],
+            'llm_provider': params['llm_provider'],
+            'llm_model': novelty_detector.llm_model,
+            'k_neighbors': params['k_neighbors'],
+            'embedding_provider': params['embedding_provider'],
+            'embedding_mode': novelty_detector.embedding_mode,
+            'llm_prompted_chunks': novelty_detector.prompted_chunks,
+        },
+        'profile': profiler.report(),
+    }
+    get_pipeline_metrics().observe(results_data['profile'])
+
+    with open(results_path, 'w') as f:
+        json.dump(results_data, f, indent=2)
+
+    return {
+        'success': True,
+        'original_filename': filename,
+        'annotated_filename': annotated_filename,
+        'results_filename': results_filename,
+        'chunks_analyzed': len(chunks),
+        'word_count': results_data['word_count'],
+        'statistics': stats,
+        'novelty_scores': novelty_scores[:10],
+        'profile': results_data['profile'],
+        'download_url': f'/novelty/api/download/{annotated_filename}',
+        'results_url': f'/novelty/api/download/{results_filename}'
+    }
+
+
 @novelty_bp.route('/api/upload', methods=['POST'])
 def upload_and_analyze():
-    """Upload a PDF and analyze it for novelty."""
+    """Upload a PDF and queue it for novelty analysis.
+
+    Returns 202 with a job id right away; poll /api/jobs/<job_id> for
+    progress and fetch /api/jobs/<job_id>/result when it is done.
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file part in request'}), 400
@@ -173,90 +284,46 @@ def upload_and_analyze():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Invalid file type. Only PDF files are allowed'}), 400
 
-        # Save uploaded file
+        # Save uploaded file under a unique name: it is read later by the job,
+        # after other uploads with the same filename may have arrived. The
+        # job's outputs use the same run id.
         filename = secure_filename(file.filename)
-        input_path = os.path.join(UPLOAD_FOLDER, filename)
+        run_id = uuid.uuid4().hex[:12]
+        input_path = os.path.join(UPLOAD_FOLDER, f"{run_id}_{filename}")
         file.save(input_path)
 
         # Get configuration from request
-        chunk_size = int(request.form.get('chunk_size', 150))
-        overlap = int(request.form.get('overlap', 20))
-        llm_provider = request.form.get('llm_provider', 'ollama')
-        llm_model = request.form.get('llm_model', '') or None
-        k_neighbors = int(request.form.get('k_neighbors', 5))
-        embedding_provider = request.form.get('embedding_provider', 'local')
-        embedding_model = request.form.get('embedding_model', '') or None
-        chunking_mode = request.form.get('chunking_mode', 'overlap')
+        params = {
+            'filename': filename,
+            'chunk_size': int(request.form.get('chunk_size', 150)),
+            'overlap': int(request.form.get('overlap', 20)),
+            'llm_provider': request.form.get('llm_provider', 'ollama'),
+            'llm_model': request.form.get('llm_model', '') or None,
+            'k_neighbors': int(request.form.get('k_neighbors', 5)),
+            'embedding_provider': request.form.get('embedding_provider', 'local'),
+            'embedding_model': request.form.get('embedding_model', '') or None,
+            'chunking_mode': request.form.get('chunking_mode', 'overlap'),
+            'embedding_mode': request.form.get('embedding_mode', '') or EMBEDDING_MODE,
+        }
+        if params['embedding_mode'] not in EMBEDDING_MODES:
+            return jsonify({'error': f"Invalid embedding_mode '{params['embedding_mode']}'"}), 400
 
-        # Extract user API keys from headers
+        # User API keys stay in memory with the job; they are not stored in the job table
         api_keys = extract_api_keys(request)
 
-        # Initialize processors
-        pdf_processor = PDFProcessor(chunk_size=chunk_size, overlap=overlap,
-                                     chunking_mode=chunking_mode)
-        novelty_detector = NoveltyDetector(
-            llm_provider=llm_provider,
-            llm_model=llm_model,
-            embedding_provider=embedding_provider,
-            embedding_model_name=embedding_model,
-            api_keys=api_keys,
-        )
-
-        # Extract and chunk text
-        print(f"Processing {filename}...")
-        text = pdf_processor.extract_text(input_path)
-        chunks = pdf_processor.chunk_text(text)
-        print(f"Extracted {len(chunks)} chunks from PDF")
-
-        # Analyze novelty
-        novelty_scores = novelty_detector.analyze_document(
-            chunks, pdf_processor, k=k_neighbors
-        )
-
-        # Get summary statistics
-        stats = novelty_detector.get_summary_statistics(novelty_scores)
-
-        # Create annotated PDF
-        annotated_filename = f"annotated_{filename}"
-        output_path = os.path.join(UPLOAD_FOLDER, annotated_filename)
-        pdf_processor.annotate_pdf(input_path, output_path, novelty_scores)
-
-        # Save detailed results to JSON
-        results_filename = f"{Path(filename).stem}_results.json"
-        results_path = os.path.join(UPLOAD_FOLDER, results_filename)
-
-        results_data = {
-            'original_filename': filename,
-            'annotated_filename': annotated_filename,
-            'chunks_analyzed': len(chunks),
-            'word_count': sum(c['word_count'] for c in chunks),
-            'statistics': stats,
-            'novelty_scores': novelty_scores,
-            'parameters': {
-                'chunk_size': chunk_size,
-                'overlap': overlap,
-                'llm_provider': llm_provider,
-                'llm_model': novelty_detector.llm_model,
-                'k_neighbors': k_neighbors,
-                'embedding_provider': embedding_provider,
-            }
-        }
-
-        with open(results_path, 'w') as f:
-            json.dump(results_data, f, indent=2)
+        job_id = get_job_queue().submit(
+            'upload', params['llm_provider'],
+            lambda progress: _analyze_upload(input_path, filename, run_id, params, api_keys,
+                                             progress),
+            params=params)
 
         return jsonify({
             'success': True,
-            'original_filename': filename,
-            'annotated_filename': annotated_filename,
-            'results_filename': results_filename,
-            'chunks_analyzed': len(chunks),
-            'word_count': results_data['word_count'],
-            'statistics': stats,
-            'novelty_scores': novelty_scores[:10],
-            'download_url': f'/novelty/api/download/{annotated_filename}',
-            'results_url': f'/novelty/api/download/{results_filename}'
-        })
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/novelty/api/jobs/{job_id}',
+            'result_url': f'/novelty/api/jobs/{job_id}/result',
+        }), 202
 
     except Exception as e:
         print(f"Error processing file: {e}")
@@ -264,6 +331,29 @@ def upload_and_analyze():
         return jsonify({'error': str(e)}), 500
 
 
+@novelty_bp.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status: stage, chunks done/total and ETA in seconds."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+@novelty_bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Result of a finished job (202 with the status while it is still running)."""
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'], 'job': job}), 500
+    if job['status'] != 'done':
+        return jsonify(job), 202
+    return jsonify(queue.result(job_id))
+
+
 @novelty_bp.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
     """Download a file from the uploads directory."""
@@ -291,6 +381,7 @@ def analyze_text():
         llm_provider = data.get('llm_provider', 'ollama')
         llm_model = data.get('llm_model')
         chunking_mode = data.get('chunking_mode', 'overlap')
+        embedding_mode = data.get('embedding_mode')
 
         api_keys = extract_api_keys(request)
 
@@ -300,6 +391,7 @@ def analyze_text():
             llm_provider=llm_provider,
             llm_model=llm_model,
             api_keys=api_keys,
+            embedding_mode=embedding_mode,
         )
 
         chunks = pdf_processor.chunk_text(text)
@@ -309,6 +401,8 @@ def analyze_text():
         return jsonify({
             'success': True,
             'chunks_analyzed': len(chunks),
+            'embedding_mode': novelty_detector.embedding_mode,
+            'llm_prompted_chunks': novelty_detector.prompted_chunks,
             'statistics': stats,
             'novelty_scores': novelty_scores
         })
@@ -321,33 +415,109 @@ def analyze_text():
 
 @novelty_bp.route('/api/estimate-cost', methods=['POST'])
 def estimate_cost_endpoint():
-    """Estimate cost for analyzing a document."""
+    """Estimate cost and duration of analyzing a document.
+
+    Multipart with the PDF ('file') or JSON with 'text': the document is
+    chunked as an upload would be and each prompt request's tokens are
+    counted. JSON with only word_count (or file_size) falls back to a
+    per-word estimate. Estimates are calibrated with recorded usage.
+    llm_provider=router is estimated as the provider its policy (llm_model)
+    ranks first, returned as routed_to.
+    """
     try:
-        data = request.get_json() or {}
+        if request.files.get('file'):
+            data = request.form
+        else:
+            data = request.get_json() or {}
+        chunk_size = int(data.get('chunk_size', 150))
+        overlap = int(data.get('overlap', 20))
+        provider = data.get('llm_provider')
+        llm_model = data.get('llm_model')
+        routed_to = None
+        if provider == 'router':
+            # Estimate a routed job as the provider the policy would try first
+            router = RouterProvider(
+                discover_providers(extract_api_keys(request), registry=get_model_registry()),
+                policy=llm_model or ROUTER_POLICY, health=get_provider_monitor().is_up)
+            ranking = router.ranking()
+            if not ranking:
+                return jsonify({'error': 'No provider available to route to'}), 503
+            provider = routed_to = ranking[0]
+            llm_model = getattr(router.providers[provider], 'model', None)
+        embedding_provider = data.get('embedding_provider') or os.getenv('EMBEDDING_PROVIDER', 'local')
+        processor = PDFProcessor(chunk_size=chunk_size, overlap=overlap,
+                                 chunking_mode=data.get('chunking_mode', 'overlap'))
+
+        contexts, word_count = None, 0
+        if request.files.get('file'):
+            file = request.files['file']
+            if not allowed_file(file.filename):
+                return jsonify({'error': 'Invalid file type. Only PDF files are allowed'}), 400
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'estimate.pdf')
+                file.save(path)
+                contexts = [context for _, context in processor.iter_chunk_contexts(
+                    processor.stream_chunks(path))]
+            basis = 'chunks'
+        elif data.get('text'):
+            contexts = [context for _, context in processor.iter_chunk_contexts(
+                processor.chunk_text(data['text']))]
+            basis = 'chunks'
+        else:
+            word_count = int(data.get('word_count', 0))
+            basis = 'word_count'
+            # Rough guess from the file size when nothing else is known
+            if not word_count and data.get('file_size'):
+                word_count = int(data['file_size']) // 6
+                basis = 'file_size'
 
-        word_count = data.get('word_count', 0)
-        file_size = data.get('file_size', 0)
+        usage_log = get_usage_log()
 
-        # If no word count, estimate from file size
-        if not word_count and file_size:
-            word_count = file_size // 6
-
-        chunk_size = data.get('chunk_size', 150)
-        overlap = data.get('overlap', 20)
-        provider = data.get('llm_provider')
+        def calibration(pid):
+            if usage_log is None:
+                return None
+            return usage_log.calibration(pid, llm_model if pid == provider else None,
+                                         embedding_provider)
 
         if provider:
-            result = estimate_cost(word_count, chunk_size, overlap, llm_provider=provider,
-                                   llm_model=data.get('llm_model'))
-            return jsonify(result)
+            if contexts is not None:
+                result = estimate_chunks_cost(contexts, llm_provider=provider,
+                                              llm_model=llm_model,
+                                              embedding_provider=embedding_provider,
+                                              calibration=calibration(provider))
+            else:
+                result = estimate_cost(word_count, chunk_size, overlap, llm_provider=provider,
+                                       llm_model=llm_model,
+                                       embedding_provider=embedding_provider,
+                                       calibration=calibration(provider))
+            if routed_to:
+                result['routed_to'] = routed_to
+            return jsonify({**result, 'basis': basis})
         else:
-            results = estimate_cost_all_providers(word_count, chunk_size, overlap)
-            return jsonify({'estimates': results})
+            results = estimate_cost_all_providers(
+                word_count, chunk_size, overlap, contexts=contexts,
+                calibrations={pid: calibration(pid) for pid in PROVIDERS})
+            return jsonify({'estimates': results, 'basis': basis})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@novelty_bp.route('/api/usage/stats', methods=['GET'])
+def usage_stats():
+    """Recorded LLM usage and stage throughput behind the calibrated estimates."""
+    usage_log = get_usage_log()
+    if usage_log is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **usage_log.stats()})
+
+
+@novelty_bp.route('/metrics', methods=['GET'])
+def pipeline_metrics():
+    """Per-stage pipeline totals of finished analyses, in the Prometheus text format."""
+    return get_pipeline_metrics().render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
 @novelty_bp.route('/api/compare', methods=['POST'])
 def compare_providers():
     """
@@ -378,19 +548,27 @@ def compare_providers():
         )
 
         chunks = pdf_processor.chunk_text(text)
-        results = novelty_detector.analyze_document_multi(
+        # Providers run concurrently: latency is that of the slowest one
+        results = novelty_detector.analyze_providers(
             chunks, pdf_processor, provider_names=provider_names
         )
 
-        # Summarize per provider
+        # Summarize per provider (a failed provider gets neutral 0.5 scores)
         provider_summaries = {}
-        for name, scores in results.items():
-            score_vals = [s['novelty_score'] for s in scores]
+        for name, result in results.items():
+            if result is not None:
+                score_vals = [s['novelty_score'] for s in result.novelty_scores]
+            else:
+                score_vals = [0.5] * len(chunks)
             provider_summaries[name] = {
                 'scores': score_vals,
                 'mean': float(np.mean(score_vals)) if score_vals else 0,
                 'high_count': sum(1 for s in score_vals if s > 0.7),
                 'low_count': sum(1 for s in score_vals if s < 0.2),
+                'seconds': round(result.seconds, 2) if result is not None else None,
+                'llm_prompted_chunks': result.prompted_chunks if result is not None else 0,
+                'llm_calls': result.llm_calls if result is not None else 0,
+                'error': None if result is not None else 'Analysis failed',
             }
 
         return jsonify({
@@ -411,31 +589,216 @@ def compare_providers():
 
 @novelty_bp.route('/api/providers/status', methods=['GET'])
 def providers_status():
-    """List discovered providers with live availability check."""
+    """Discovered providers with their last background health check.
+
+    Status comes from the provider monitor's cache; ?refresh=1 probes now.
+    Providers the monitor has not probed (e.g. only configured by this
+    request's keys) report is_available(), which does no network I/O.
+    """
     api_keys = extract_api_keys(request)
-    providers = discover_providers(api_keys)
+    refresh = request.args.get('refresh') in ('1', 'true')
+    providers = discover_providers(api_keys, registry=get_model_registry())
+    monitor = get_provider_monitor()
     info = {}
     for name, provider in providers.items():
+        status = monitor.probe(name, provider) if refresh else monitor.status(name)
+        if status is None:
+            status = {'available': provider.is_available(), 'checked_at': None}
         info[name] = {
             'name': name,
-            'available': provider.is_available(),
             'model': getattr(provider, 'model', None),
+            **status,
         }
-    return jsonify({'providers': info})
+    return jsonify({
+        'providers': info,
+        'monitor': {'running': monitor.running, 'interval': monitor.interval,
+                    'rounds': monitor.rounds},
+    })
+
+
+@novelty_bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Prompt and embedding cache hit/miss counters and size."""
+    cache = get_prompt_cache()
+    embed_cache = get_embedding_cache()
+    stats = {'enabled': True, **cache.stats()} if cache is not None else {'enabled': False}
+    stats['embeddings'] = (
+        {'enabled': True, **embed_cache.stats()} if embed_cache is not None else {'enabled': False})
+    return jsonify(stats)
+
+
+@novelty_bp.route('/api/router/stats', methods=['GET'])
+def router_stats():
+    """Rolling latency, error rate and circuit state of routed providers."""
+    return jsonify({'providers': provider_stats_snapshot()})
+
+
+@novelty_bp.route('/api/models/stats', methods=['GET'])
+def model_stats():
+    """Pooled embedding models and provider clients, with hit/miss counters."""
+    return jsonify(get_model_registry().stats())
+
+
+@novelty_bp.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    """Job counts by status and running jobs per provider."""
+    return jsonify(get_job_queue().stats())
+
+
+# ── Reference corpus ─────────────────────────────────────────────────
+
+def _corpus_or_404(name):
+    safe_name = secure_filename(name)
+    if not safe_name:
+        return None
+    return get_reference_corpus(safe_name)
+
+
+def _embed_uploaded_pdf():
+    """Chunk the uploaded PDF (read from a temporary copy) and compute prompt embeddings.
+
+    Returns (filename, chunks, novelty_detector) or a Flask error response.
+    """
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'error': 'No file provided'}), 400
+    file = request.files['file']
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Only PDF files are allowed'}), 400
+
+    # A temporary, uniquely named copy: concurrent uploads of the same
+    # filename must not read each other's file
+    filename = secure_filename(file.filename)
+    input_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex[:12]}_{filename}")
+    file.save(input_path)
+    try:
+        pdf_processor = PDFProcessor(
+            chunk_size=int(request.form.get('chunk_size', 150)),
+            overlap=int(request.form.get('overlap', 20)),
+            chunking_mode=request.form.get('chunking_mode', 'overlap'))
+        chunks = pdf_processor.chunk_text(pdf_processor.extract_text(input_path))
+    finally:
+        os.remove(input_path)
+
+    novelty_detector = NoveltyDetector(
+        llm_provider=request.form.get('llm_provider', 'ollama'),
+        llm_model=request.form.get('llm_model', '') or None,
+        embedding_provider=request.form.get('embedding_provider', 'local'),
+        embedding_model_name=request.form.get('embedding_model', '') or None,
+        api_keys=extract_api_keys(request),
+        embedding_mode=request.form.get('embedding_mode', '') or None,
+    )
+
+    novelty_detector.index_document(
+        [pdf_processor.get_chunk_context(chunks, i) for i in range(len(chunks))])
+    return filename, chunks, novelty_detector
+
+
+@novelty_bp.route('/api/corpus/<name>', methods=['GET'])
+def corpus_info(name):
+    """Reference corpus size, embedding model and documents."""
+    corpus = _corpus_or_404(name)
+    if corpus is None:
+        return jsonify({'error': 'Invalid corpus name'}), 404
+    return jsonify({**corpus.stats(), 'documents_list': corpus.list_documents()})
+
+
+@novelty_bp.route('/api/corpus/<name>/documents', methods=['POST'])
+def corpus_add_document(name):
+    """Add an uploaded PDF to a reference corpus (form fields: doc_id, title)."""
+    corpus = _corpus_or_404(name)
+    if corpus is None:
+        return jsonify({'error': 'Invalid corpus name'}), 404
+    try:
+        prepared = _embed_uploaded_pdf()
+        if not isinstance(prepared[0], str):
+            return prepared
+        filename, chunks, novelty_detector = prepared
+        doc_id = request.form.get('doc_id') or Path(filename).stem
+        added = novelty_detector.add_to_corpus(
+            corpus, doc_id,
+            previews=[c['text'] for c in chunks],
+            title=request.form.get('title') or filename,
+            metadata={'filename': filename, 'llm_provider': novelty_detector.llm_provider})
+        return jsonify({'success': True, 'doc_id': doc_id, 'chunks_added': added,
+                        'corpus': corpus.stats()})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error adding document to corpus: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+@novelty_bp.route('/api/corpus/<name>/documents/<doc_id>', methods=['DELETE'])
+def corpus_remove_document(name, doc_id):
+    """Remove a document from a reference corpus."""
+    corpus = _corpus_or_404(name)
+    if corpus is None:
+        return jsonify({'error': 'Invalid corpus name'}), 404
+    removed = corpus.remove_document(doc_id)
+    if not removed:
+        return jsonify({'error': 'Document not found'}), 404
+    return jsonify({'success': True, 'chunks_removed': removed})
+
+
+@novelty_bp.route('/api/corpus/<name>/score', methods=['POST'])
+def corpus_score(name):
+    """Score an uploaded PDF against a reference corpus.
+
+    Form fields: k_neighbors, doc_id (excluded from matches), add ('true' to
+    store the document in the corpus after scoring).
+    """
+    corpus = _corpus_or_404(name)
+    if corpus is None:
+        return jsonify({'error': 'Invalid corpus name'}), 404
+    try:
+        prepared = _embed_uploaded_pdf()
+        if not isinstance(prepared[0], str):
+            return prepared
+        filename, chunks, novelty_detector = prepared
+        doc_id = request.form.get('doc_id') or Path(filename).stem
+        k_neighbors = int(request.form.get('k_neighbors', 5))
+
+        novelty_scores = novelty_detector.calculate_corpus_novelty(
+            corpus, k=k_neighbors, exclude_doc_id=doc_id)
+        stats = novelty_detector.get_summary_statistics(novelty_scores) if novelty_scores else {}
+
+        added = 0
+        if request.form.get('add', 'false').lower() == 'true':
+            added = novelty_detector.add_to_corpus(
+                corpus, doc_id,
+                previews=[c['text'] for c in chunks],
+                title=request.form.get('title') or filename,
+                metadata={'filename': filename, 'llm_provider': novelty_detector.llm_provider})
+
+        return jsonify({
+            'success': True,
+            'doc_id': doc_id,
+            'chunks_analyzed': len(chunks),
+            'statistics': stats,
+            'novelty_scores': novelty_scores,
+            'chunks_added': added,
+            'corpus': corpus.stats(),
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error scoring against corpus: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
 
 @novelty_bp.route('/api/ollama/status', methods=['GET'])
 def ollama_status():
-    """Check Ollama connectivity."""
-    client = OllamaClient()
-    return jsonify(client.health())
+    """Check Ollama connectivity (cached briefly; ?refresh=1 re-checks)."""
+    refresh = request.args.get('refresh') in ('1', 'true')
+    return jsonify(get_ollama_client().health(refresh=refresh))
 
 
 @novelty_bp.route('/api/ollama/models', methods=['GET'])
 def ollama_models():
     """List pulled Ollama models."""
-    client = OllamaClient()
-    models = client.list_models()
+    models = get_ollama_client().list_models()
     return jsonify({'models': models})
 
 
@@ -456,9 +819,29 @@ def create_app():
     except ImportError as e:
         print(f"Validator API not available: {e}")
 
+    # Load the default embedding model and clients in the background; early
+    # requests for the same model wait for this load instead of starting another
+    if MODEL_WARMUP:
+        threading.Thread(target=_warm_up, name="model-warmup", daemon=True).start()
+
+    # The first tiktoken load may download BPE files; estimates made before it
+    # finishes use character counts
+    load_tiktoken_encodings(background=True)
+
+    # Provider health is probed in the background; requests read the cached status
+    if PROVIDER_MONITOR_ENABLED:
+        get_provider_monitor().start()
+
     return app
 
 
+def _warm_up():
+    try:
+        print(f"Models warmed up in {warm_up_models(get_model_registry()):.1f}s")
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+
+
 if __name__ == '__main__':
     app = create_app()
     port = int(os.getenv('PORT', 5000))
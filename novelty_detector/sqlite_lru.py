@@ -0,0 +1,160 @@
+"""
+SQLite table with size-based least-recently-used eviction, shared by the
+prompt and embedding caches.
+
+The caches' hot paths must not scan the table. Triggers keep the total row
+size and count in a one-row-per-table lru_size table. Every writer maintains
+it, including other server workers on the same database. A put then only
+reads that row to decide whether to evict. Lookups do not write either: hits
+are queued in memory and their last_used times are flushed in one batch
+every LRU_TOUCH_BATCH hits or LRU_TOUCH_INTERVAL seconds, and always before
+an eviction. A crash loses at most that batch of recency updates, never
+cached data.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+LRU_TOUCH_BATCH = int(os.getenv("LRU_TOUCH_BATCH", 256))
+LRU_TOUCH_INTERVAL = float(os.getenv("LRU_TOUCH_INTERVAL", 30))
+
+
+class SQLiteLRUStore:
+    """
+    Base class of the SQLite caches: connection, size accounting, batched
+    last-used updates and eviction. Subclasses set the class attributes below
+    and run their own queries on self._conn while holding self._lock.
+    """
+
+    table = ""  # cached rows; must have a REAL last_used column
+    schema = ""  # CREATE statements for table and its indexes
+    key_columns: Tuple[str, ...] = ()  # primary key
+    size_expr = ""  # a row's size in bytes, with {row} standing for the row
+    hit_column: Optional[str] = None  # optional INTEGER hit counter
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Args:
+            path: SQLite file path (':memory:' for a throwaway cache)
+            max_bytes: Approximate size cap for stored rows
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[Tuple, list] = {}  # key -> [last_used, hits]
+        self._last_flush = time.monotonic()
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # INSERT OR REPLACE must fire the delete trigger for the replaced row
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        t = self.table
+        new, old = self.size_expr.format(row="NEW"), self.size_expr.format(row="OLD")
+        # One transaction, so the seeded total matches the rows the triggers see
+        self._conn.executescript(f"""
+            BEGIN IMMEDIATE;
+            {self.schema};
+            CREATE TABLE IF NOT EXISTS lru_size (
+                tbl TEXT PRIMARY KEY,
+                total INTEGER NOT NULL,
+                entries INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS {t}_lru_insert AFTER INSERT ON {t} BEGIN
+                UPDATE lru_size SET total = total + {new}, entries = entries + 1
+                WHERE tbl = '{t}';
+            END;
+            CREATE TRIGGER IF NOT EXISTS {t}_lru_delete AFTER DELETE ON {t} BEGIN
+                UPDATE lru_size SET total = total - {old}, entries = entries - 1
+                WHERE tbl = '{t}';
+            END;
+            INSERT OR IGNORE INTO lru_size (tbl, total, entries)
+                SELECT '{t}', COALESCE(SUM({self.size_expr.format(row=t)}), 0), COUNT(*) FROM {t};
+            COMMIT;
+        """)
+
+    def _size(self) -> Tuple[int, int]:
+        """(total bytes, entries) from the running totals."""
+        return self._conn.execute(
+            "SELECT total, entries FROM lru_size WHERE tbl = ?", (self.table,)).fetchone()
+
+    def _touch(self, keys: Iterable[Tuple]):
+        """Queue last-used updates for hit keys (caller holds _lock)."""
+        now = time.time()
+        for key in keys:
+            entry = self._touched.setdefault(key, [now, 0])
+            entry[0] = now
+            entry[1] += 1
+        if (len(self._touched) >= LRU_TOUCH_BATCH
+                or time.monotonic() - self._last_flush >= LRU_TOUCH_INTERVAL):
+            self._flush_touches()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        """Write queued last-used updates, without committing (caller holds _lock)."""
+        self._last_flush = time.monotonic()
+        if not self._touched:
+            return
+        where = " AND ".join(f"{c} = ?" for c in self.key_columns)
+        sets = "last_used = MAX(last_used, ?)"
+        if self.hit_column:
+            sets += f", {self.hit_column} = {self.hit_column} + ?"
+            rows = [(used, hits, *key) for key, (used, hits) in self._touched.items()]
+        else:
+            rows = [(used, *key) for key, (used, _) in self._touched.items()]
+        self._conn.executemany(f"UPDATE {self.table} SET {sets} WHERE {where}", rows)
+        self._touched.clear()
+
+    def _evict(self):
+        """Drop least-recently-used rows until under 90% of max_bytes (caller holds _lock)."""
+        total = self._size()[0]
+        if total <= self.max_bytes:
+            return
+        self._flush_touches()
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        keys = ", ".join(self.key_columns)
+        for row in self._conn.execute(
+                f"SELECT {keys}, {self.size_expr.format(row=self.table)} FROM {self.table} "
+                f"ORDER BY last_used ASC"):
+            doomed.append(row[:-1])
+            freed += row[-1]
+            if freed >= target:
+                break
+        where = " AND ".join(f"{c} = ?" for c in self.key_columns)
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE {where}", doomed)
+
+    def flush(self):
+        """Write queued last-used updates now."""
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus current cache size."""
+        with self._lock:
+            size, entries = self._size()
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "path": self.path,
+        }
@@ -154,6 +154,12 @@ function updateApiKeySection() {
 }
 
 // ── Cost Estimation ─────────────────────────────────────────────────
+function formatDuration(seconds) {
+    if (seconds < 60) return `${Math.max(1, Math.round(seconds))}s`;
+    if (seconds < 3600) return `${Math.round(seconds / 60)} min`;
+    return `${(seconds / 3600).toFixed(1)} h`;
+}
+
 function updateCostEstimate() {
     const fileInput = document.getElementById('file-input');
     const file = fileInput.files[0];
@@ -162,11 +168,15 @@ function updateCostEstimate() {
     const chunkSize = parseInt(document.getElementById('chunk-size').value) || 150;
     const overlap = parseInt(document.getElementById('overlap').value) || 20;
 
-    fetch(BASE + '/api/estimate-cost', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ file_size: file.size, chunk_size: chunkSize, overlap: overlap }),
-    })
+    // The server chunks the PDF and counts tokens per request
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('chunk_size', chunkSize);
+    formData.append('overlap', overlap);
+    formData.append('embedding_provider', document.getElementById('embed-provider').value);
+    formData.append('chunking_mode', document.getElementById('chunking-mode').value);
+
+    fetch(BASE + '/api/estimate-cost', { method: 'POST', body: formData })
     .then(r => r.json())
     .then(d => {
         const el = document.getElementById('cost-estimates');
@@ -179,7 +189,7 @@ function updateCostEstimate() {
                             <span class="font-medium text-sm">${e.provider_name}</span>
                             <span class="font-mono text-sm font-bold ${e.total_cost === 0 ? 'text-green-600' : 'text-gray-800'}">${e.formatted_cost}</span>
                         </div>
-                        <div class="text-xs text-gray-500 mt-1">${e.tier} &middot; ${e.chunks} chunks</div>
+                        <div class="text-xs text-gray-500 mt-1">${e.tier} &middot; ${e.chunks} chunks &middot; ~${formatDuration(e.estimated_seconds)}</div>
                     </div>
                 `;
             }).join('');
@@ -233,17 +243,55 @@ function doAnalyze() {
     progressBar.style.width = '10%';
     progressStatus.textContent = 'Uploading...';
 
-    // Simulate progress (actual analysis is server-side)
-    let progress = 10;
-    const progressInterval = setInterval(() => {
-        if (progress < 90) {
-            progress += Math.random() * 3;
-            progressBar.style.width = progress + '%';
-            if (progress > 30) progressStatus.textContent = 'Generating prompts...';
-            if (progress > 60) progressStatus.textContent = 'Computing embeddings...';
-            if (progress > 80) progressStatus.textContent = 'Calculating novelty...';
-        }
-    }, 1000);
+    const stageLabels = {
+        queued: 'Waiting in queue...',
+        starting: 'Starting...',
+        loading: 'Loading models...',
+        prompts: 'Generating prompts...',
+        annotating: 'Annotating PDF...',
+    };
+
+    const fail = err => {
+        hide('progress-section');
+        show('error-section');
+        document.getElementById('error-message').textContent = err.message;
+        document.getElementById('analyze-btn').disabled = false;
+    };
+
+    // Analysis runs as a background job: poll its status until it finishes
+    const poll = jobId => {
+        fetch(BASE + '/api/jobs/' + jobId)
+            .then(r => r.json())
+            .then(job => {
+                if (job.status === 'failed') throw new Error(job.error || 'Analysis failed');
+                if (job.status === 'done') {
+                    return fetch(BASE + '/api/jobs/' + jobId + '/result')
+                        .then(r => r.json())
+                        .then(data => {
+                            progressBar.style.width = '100%';
+                            progressStatus.textContent = 'Complete!';
+                            setTimeout(() => {
+                                hide('progress-section');
+                                renderResults(data);
+                                document.getElementById('analyze-btn').disabled = false;
+                            }, 500);
+                        });
+                }
+                let text = stageLabels[job.stage] || 'Processing...';
+                if (job.status === 'queued' && job.queue_position) {
+                    text = 'Waiting in queue (position ' + job.queue_position + ')...';
+                }
+                if (job.chunks_total) {
+                    const pct = 10 + 85 * job.chunks_done / job.chunks_total;
+                    progressBar.style.width = pct + '%';
+                    text += ' ' + job.chunks_done + '/' + job.chunks_total + ' chunks';
+                    if (job.eta_seconds != null) text += ', ~' + Math.ceil(job.eta_seconds) + 's left';
+                }
+                progressStatus.textContent = text;
+                setTimeout(() => poll(jobId), 1000);
+            })
+            .catch(fail);
+    };
 
     fetch(BASE + '/api/upload', { method: 'POST', headers, body: formData })
         .then(r => {
@@ -251,24 +299,10 @@ function doAnalyze() {
             return r.json();
         })
         .then(data => {
-            clearInterval(progressInterval);
-            progressBar.style.width = '100%';
-            progressStatus.textContent = 'Complete!';
-
-            setTimeout(() => {
-                hide('progress-section');
-                renderResults(data);
-            }, 500);
-        })
-        .catch(err => {
-            clearInterval(progressInterval);
-            hide('progress-section');
-            show('error-section');
-            document.getElementById('error-message').textContent = err.message;
+            progressStatus.textContent = stageLabels.queued;
+            poll(data.job_id);
         })
-        .finally(() => {
-            document.getElementById('analyze-btn').disabled = false;
-        });
+        .catch(fail);
 }
 
 // ── Results Rendering ───────────────────────────────────────────────
@@ -8,12 +8,56 @@ import unittest
 from unittest.mock import Mock, patch, MagicMock
 import tempfile
 import json
+import re
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Caches, logs, job and corpus databases of the modules under test go to a
+# throwaway directory, never to the real ones next to the modules
+import atexit
+import shutil
+_test_data_dir = tempfile.mkdtemp(prefix="novelty-tests-")
+atexit.register(shutil.rmtree, _test_data_dir, ignore_errors=True)
+for _var, _name in (("PROMPT_CACHE_PATH", "prompt_cache.sqlite"),
+                    ("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite"),
+                    ("USAGE_LOG_PATH", "usage.sqlite"),
+                    ("JOB_DB_PATH", "jobs.sqlite"),
+                    ("METRICS_DB_PATH", "metrics.sqlite"),
+                    ("ONNX_MODEL_DIR", "onnx"),
+                    ("REFERENCE_CORPUS_DIR", "corpus")):
+    os.environ[_var] = os.path.join(_test_data_dir, _name)
+
+import threading
+import time
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import novelty_detector as nd_module
+import pdf_processor
 from pdf_processor import PDFProcessor
-from novelty_detector import NoveltyDetector
+from novelty_detector import NOVELTY_THRESHOLDS, NoveltyDetector
+import llm_providers
+from llm_providers import (FallbackProvider, LLMProvider, OllamaProvider, RouterProvider,
+                           prompt_text)
+import cost_config
+import usage_log
+from usage_log import UsageLog
+from provider_monitor import ProviderMonitor
+from profiler import PipelineMetrics, StageProfiler
+from prompt_cache import PromptCache
+from embedding_cache import EmbeddingCache, encode_with_cache
+from vector_index import choose_index_type, create_index, set_search_params
+import vector_index
+from job_queue import JobQueue
+from model_registry import ModelPool, ModelRegistry, pool_key
+from reference_corpus import ReferenceCorpus
+import ollama_client
+from ollama_client import AsyncOllamaClient, OllamaClient
+from onnx_embedder import (OnnxEmbedder, QUANTIZATION_CONFIGS, available_cpus,
+                           default_quantization, ensure_quantized_model)
+
+import numpy as np
 
 
 class TestPDFProcessor(unittest.TestCase):
@@ -107,6 +151,25 @@ class TestPDFProcessor(unittest.TestCase):
             self.assertGreater(len(before), 0)
             self.assertEqual(after, "")
 
+    def test_chunk_offsets_index_normalized_text(self):
+        """Test char offsets point at each chunk in the normalized text."""
+        text = "\n".join(f"word{i}  x{i % 7}\t" for i in range(1000))
+        normalized = " ".join(text.split())
+        chunks = self.processor.chunk_text(text)
+        for chunk in chunks:
+            self.assertEqual(normalized[chunk['char_start']:chunk['char_end']], chunk['text'])
+            self.assertEqual(chunk['word_count'], len(chunk['text'].split()))
+        self.assertEqual(chunks[-1]['char_end'], len(normalized))
+
+    def test_get_chunk_context_word_limits(self):
+        """Test context takes the last/first N words of the neighbours."""
+        text = " ".join([f"word{i}" for i in range(300)])
+        chunks = self.processor.chunk_text(text)
+        before, _, after = self.processor.get_chunk_context(chunks, 1, 5, 3)
+        self.assertEqual(before.split(), chunks[0]['text'].split()[-5:])
+        self.assertEqual(after.split(), chunks[2]['text'].split()[:3])
+        self.assertEqual(self.processor.get_chunk_context(chunks, 1, 0, 0)[::2], ("", ""))
+
     def test_get_novelty_color(self):
         """Test novelty score to color mapping."""
         # High novelty - green
@@ -300,6 +363,1708 @@ class TestIntegration(unittest.TestCase):
             self.assertIsInstance(score['novelty_score'], float)
 
 
+def make_offline_detector(**kwargs):
+    """NoveltyDetector without loading a SentenceTransformer model."""
+    kwargs.setdefault('use_prompt_cache', 'prompt_cache' in kwargs)
+    kwargs.setdefault('use_embedding_cache', 'embedding_cache' in kwargs)
+    kwargs.setdefault('use_model_registry', 'model_registry' in kwargs)
+    kwargs.setdefault('use_usage_log', 'usage_log' in kwargs)
+    kwargs.setdefault('llm_provider', 'fallback')
+    with patch('novelty_detector.SentenceTransformer'):
+        return NoveltyDetector(**kwargs)
+
+
+class SlowProvider(LLMProvider):
+    """Provider with variable latency that records peak concurrency."""
+
+    name = "ollama"
+
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def generate_prompt(self, chunk, context_before="", context_after=""):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(0.01 * (hash(chunk) % 3))
+            if chunk in self.fail_on:
+                raise RuntimeError("provider down")
+            return f"prompt:{chunk}"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class TestConcurrentPromptGeneration(unittest.TestCase):
+    """Test cases for NoveltyDetector.generate_prompts."""
+
+    def setUp(self):
+        self.detector = make_offline_detector()
+        self.contexts = [("", f"chunk{i}", "") for i in range(20)]
+
+    def test_preserves_chunk_order(self):
+        provider = SlowProvider()
+        prompts = self.detector.generate_prompts(self.contexts, provider=provider, max_workers=8)
+        self.assertEqual(prompts, [f"prompt:chunk{i}" for i in range(20)])
+
+    def test_respects_provider_concurrency_cap(self):
+        provider = SlowProvider()
+        with patch.dict(os.environ, {'NOVELTY_MAX_CONCURRENCY': '2'}), \
+                patch.dict(nd_module._provider_slots, clear=True):
+            self.detector.generate_prompts(self.contexts, provider=provider, max_workers=8)
+        self.assertLessEqual(provider.peak, 2)
+
+    def test_failed_chunk_retries_then_falls_back(self):
+        provider = SlowProvider(fail_on={"chunk3"})
+        with patch.object(nd_module, 'LLM_RETRY_BACKOFF', 0):
+            prompts = self.detector.generate_prompts(self.contexts, provider=provider)
+        self.assertEqual(prompts[3], "Write about: chunk3")
+        self.assertEqual(prompts[4], "prompt:chunk4")
+        self.assertEqual(provider.calls, 20 + nd_module.LLM_MAX_RETRIES)
+
+
+class TestPromptCache(unittest.TestCase):
+    """Test cases for the persistent prompt cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'prompts.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_depends_on_context(self):
+        k1 = PromptCache.make_key('ollama', 'm', 'chunk', 'before', 'after')
+        k2 = PromptCache.make_key('ollama', 'm', 'chunk', 'before', 'other')
+        k3 = PromptCache.make_key('openai', 'm', 'chunk', 'before', 'after')
+        self.assertEqual(k1, PromptCache.make_key('ollama', 'm', 'chunk', 'before', 'after'))
+        self.assertNotEqual(k1, k2)
+        self.assertNotEqual(k1, k3)
+
+    def test_persists_and_counts(self):
+        cache = PromptCache(self.path)
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', 'prompt text', 'ollama', 'm')
+        reopened = PromptCache(self.path)
+        self.assertEqual(reopened.get('k'), 'prompt text')
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(reopened.stats()['hits'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = PromptCache(self.path, max_bytes=400)
+        for i in range(4):
+            cache.put(f'key{i}', 'x' * 90)
+            time.sleep(0.01)
+        cache.get('key0')  # refresh key0 so key1 is the oldest
+        cache.put('key4', 'x' * 90)
+        self.assertIsNotNone(cache.get('key0'))
+        self.assertIsNone(cache.get('key1'))
+        self.assertLessEqual(cache.stats()['size_bytes'], 400)
+
+    def test_running_total_tracks_every_writer(self):
+        cache = PromptCache(self.path, max_bytes=10_000)
+        other = PromptCache(self.path, max_bytes=10_000)
+        cache.put('a', 'x' * 100)
+        other.put('b', 'y' * 50)
+        cache.put('a', 'z' * 10)  # replacing a row subtracts its old size
+        expected = cache._conn.execute("SELECT SUM(size), COUNT(*) FROM prompts").fetchone()
+        self.assertEqual((cache.stats()['size_bytes'], cache.stats()['entries']), expected)
+        self.assertEqual(other.stats()['size_bytes'], expected[0])
+        other.clear()
+        self.assertEqual((cache.stats()['size_bytes'], cache.stats()['entries']), (0, 0))
+
+    def test_hits_update_last_used_in_batches(self):
+        cache = PromptCache(self.path)
+        cache.put('k', 'prompt text')
+
+        def hit_count():
+            return cache._conn.execute(
+                "SELECT hit_count FROM prompts WHERE key = 'k'").fetchone()[0]
+
+        with patch('sqlite_lru.LRU_TOUCH_BATCH', 3):
+            cache.get('k')
+            cache.get('k')
+            self.assertEqual(hit_count(), 0)
+            cache.get('k2')  # a miss queues nothing
+            cache.put('k3', 'other')  # a put below the cap does not flush either
+            self.assertEqual(hit_count(), 0)
+            cache.flush()
+        self.assertEqual(hit_count(), 2)
+
+    def test_detector_only_calls_llm_for_new_chunks(self):
+        detector = make_offline_detector(prompt_cache=PromptCache(self.path))
+        provider = SlowProvider(fail_on={"chunk2"})
+        contexts = [("", f"chunk{i}", "") for i in range(4)]
+        with patch.object(nd_module, 'LLM_RETRY_BACKOFF', 0):
+            detector.generate_prompts(contexts, provider=provider)
+            first_calls = provider.calls
+            prompts = detector.generate_prompts(contexts, provider=provider)
+        # Successful chunks are cached; the failed one is retried, not cached
+        self.assertEqual(provider.calls - first_calls, 1 + nd_module.LLM_MAX_RETRIES)
+        self.assertEqual(prompts[0], "prompt:chunk0")
+        self.assertEqual(prompts[2], "Write about: chunk2")
+
+
+class FakeEncoder:
+    """Deterministic stand-in for SentenceTransformer that records batch sizes."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.batches = []
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(len(texts))
+        return np.array([[float(len(t) + j) for j in range(self.dim)] for t in texts],
+                        dtype=np.float32)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """Test cases for the embedding cache and batched encoding."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'embeddings.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip_is_per_model(self):
+        cache = EmbeddingCache(self.path)
+        vecs = np.arange(6, dtype=np.float32).reshape(2, 3)
+        cache.put_many('local:a', ['x', 'y'], vecs)
+        reopened = EmbeddingCache(self.path)
+        got = reopened.get_many('local:a', ['y', 'z', 'x'])
+        np.testing.assert_array_equal(got[0], vecs[1])
+        self.assertIsNone(got[1])
+        np.testing.assert_array_equal(got[2], vecs[0])
+        self.assertEqual(reopened.get_many('local:b', ['x']), [None])
+
+    def test_eviction_uses_running_total_and_queued_hits(self):
+        cache = EmbeddingCache(self.path, max_bytes=40)  # three 12-byte vectors fit
+        vecs = np.ones((4, 3), dtype=np.float32)
+        for text, vec in zip('xyz', vecs):
+            cache.put_many('m', [text], vec[None])
+            time.sleep(0.01)
+        cache.get_many('m', ['x'])  # only queued, flushed before evicting
+        cache.put_many('m', ['w'], vecs[3:])
+        self.assertEqual([v is not None for v in cache.get_many('m', ['x', 'y', 'z', 'w'])],
+                         [True, False, True, True])
+        expected = cache._conn.execute(
+            "SELECT SUM(LENGTH(vector)), COUNT(*) FROM embeddings").fetchone()
+        self.assertEqual((cache.stats()['size_bytes'], cache.stats()['entries']), expected)
+
+    def test_concurrent_lookups_count_every_hit_and_miss(self):
+        cache = EmbeddingCache(self.path)
+        cache.put_many('m', ['x'], np.ones((1, 3), dtype=np.float32))
+        threads = [threading.Thread(target=lambda: [cache.get_many('m', ['x', 'y'])
+                                                    for _ in range(50)])
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (400, 400))
+
+    def test_only_misses_are_encoded_in_batches(self):
+        cache = EmbeddingCache(self.path)
+        encoder = FakeEncoder()
+        texts = [f'text {i}' for i in range(10)]
+        first = encode_with_cache(texts[:4], 'm', encoder.encode, cache, batch_size=3)
+        self.assertEqual(encoder.batches, [3, 1])
+
+        encoder.batches = []
+        # Duplicates are embedded once; cached texts are not re-sent
+        result = encode_with_cache(texts + [texts[5]], 'm', encoder.encode, cache, batch_size=4)
+        self.assertEqual(encoder.batches, [4, 2])
+        self.assertEqual(result.shape, (11, 8))
+        np.testing.assert_array_equal(result[:4], first)
+        np.testing.assert_array_equal(result[10], result[5])
+
+    def test_detector_reuses_cached_embeddings(self):
+        detector = make_offline_detector(embedding_cache=EmbeddingCache(self.path),
+                                         embed_batch_size=2)
+        encoder = FakeEncoder()
+        detector.embedding_model = encoder
+        prompts = ['alpha', 'beta', 'gamma']
+        first = detector._encode_texts(prompts)
+        second = detector._encode_texts(prompts + ['delta'])
+        self.assertEqual(encoder.batches, [2, 1, 1])
+        np.testing.assert_array_equal(second[:3], first)
+
+    def test_ollama_embeddings_are_batched(self):
+        with patch('novelty_detector.OllamaClient') as client_cls:
+            detector = make_offline_detector(embedding_provider='ollama', embed_batch_size=3)
+        client = client_cls.return_value
+        client.embed_batch.side_effect = lambda texts, model=None: [[1.0, 2.0]] * len(texts)
+        result = detector._encode_texts([f't{i}' for i in range(7)])
+        self.assertEqual(result.shape, (7, 2))
+        self.assertEqual([len(c.args[0]) for c in client.embed_batch.call_args_list], [3, 3, 1])
+
+
+class TestBatchedScoring(unittest.TestCase):
+    """Test cases for batched kNN novelty scoring."""
+
+    def make_detector(self, embeddings):
+        detector = make_offline_detector()
+        detector.embedding_model = Mock()
+        detector.embedding_model.encode.return_value = embeddings
+        detector.chunk_prompts = [f'prompt {i}' for i in range(len(embeddings))]
+        detector.build_faiss_index(detector.chunk_prompts)
+        return detector
+
+    def test_matches_per_row_search(self):
+        rng = np.random.default_rng(0)
+        detector = self.make_detector(rng.standard_normal((50, 16)).astype('float32'))
+        scores = detector.calculate_novelty_scores(k=3)
+        for i, result in enumerate(scores):
+            distances, indices = detector.index.search(detector.embeddings[i:i+1], 4)
+            mask = indices[0] != i
+            expected = [int(x) for x in indices[0][mask][:3]]
+            self.assertEqual([c['index'] for c in result['similar_chunks']], expected)
+            self.assertAlmostEqual(result['novelty_score'],
+                                   1.0 - float(np.mean(distances[0][mask][:3])), places=5)
+
+    def test_small_corpus_and_duplicates(self):
+        vecs = np.array([[1, 0], [1, 0], [0, 1]], dtype='float32')
+        scores = self.make_detector(vecs).calculate_novelty_scores(k=5)
+        # k is capped at n-1 and a chunk never lists itself
+        for i, result in enumerate(scores):
+            indices = [c['index'] for c in result['similar_chunks']]
+            self.assertEqual(len(indices), 2)
+            self.assertNotIn(i, indices)
+        self.assertEqual(scores[0]['similar_chunks'][0]['index'], 1)
+
+
+class TestIndexSelection(unittest.TestCase):
+    """Test cases for FAISS index selection by corpus size."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centres = rng.standard_normal((500, 32)).astype('float32')
+        vecs = centres[rng.integers(0, 500, 12000)] + 0.3 * rng.standard_normal((12000, 32)).astype('float32')
+        self.vecs = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+    def test_auto_selection_by_size(self):
+        with patch.object(vector_index, 'INDEX_FLAT_MAX', 100), \
+                patch.object(vector_index, 'INDEX_HNSW_MAX', 1000):
+            self.assertEqual(choose_index_type(100, 'auto'), 'flat')
+            self.assertEqual(choose_index_type(101, 'auto'), 'hnsw')
+            self.assertEqual(choose_index_type(1001, 'auto'), 'ivfpq')
+            self.assertEqual(choose_index_type(10, 'hnsw'), 'hnsw')
+        with self.assertRaises(ValueError):
+            choose_index_type(10, 'lsh')
+
+    def test_approximate_indexes_recall(self):
+        queries = self.vecs[:200]
+        exact = np.argsort(-(queries @ self.vecs.T), axis=1)[:, :5]
+        for kind, params in (('hnsw', {'ef_search': 64}), ('ivfpq', {'nprobe': 16})):
+            index = create_index(self.vecs, kind, nlist=64)
+            set_search_params(index, **params)
+            self.assertEqual(index.ntotal, len(self.vecs))
+            _, found = index.search(queries, 5)
+            recall = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(found.tolist(), exact.tolist())])
+            self.assertGreater(recall, 0.8, kind)
+
+    def test_too_small_for_ivfpq_falls_back_to_flat(self):
+        index = create_index(self.vecs[:500], 'ivfpq')
+        self.assertIsInstance(index, vector_index.faiss.IndexFlatIP)
+
+    def test_detector_scores_with_hnsw(self):
+        detector = make_offline_detector(index_type='hnsw')
+        detector.embedding_model = Mock()
+        detector.embedding_model.encode.return_value = self.vecs[:300]
+        detector.chunk_prompts = [f'prompt {i}' for i in range(300)]
+        detector.build_faiss_index(detector.chunk_prompts)
+        scores = detector.calculate_novelty_scores(k=3)
+        self.assertEqual(len(scores), 300)
+        for i, result in enumerate(scores):
+            self.assertNotIn(i, [c['index'] for c in result['similar_chunks']])
+
+
+class TestReferenceCorpus(unittest.TestCase):
+    """Test cases for the persistent reference corpus."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.doc_a = rng.standard_normal((6, 16)).astype('float32')
+        self.doc_b = rng.standard_normal((4, 16)).astype('float32')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def corpus(self, **kwargs):
+        return ReferenceCorpus('course1', root=self.tmpdir.name, **kwargs)
+
+    def test_persists_and_maps_ids_to_documents(self):
+        corpus = self.corpus(delta_max=0)
+        corpus.add_document('a', self.doc_a, previews=[f'a{i}' for i in range(6)], model_key='local:m')
+        corpus.add_document('b', self.doc_b, model_key='local:m')
+        self.assertTrue(os.path.exists(os.path.join(corpus.path, 'index.2.faiss')))
+
+        reopened = self.corpus()
+        stats = reopened.stats()
+        self.assertEqual((stats['chunks'], stats['pending_chunks']), (10, 0))
+        self.assertEqual(stats['index_type'], 'flat')
+        self.assertTrue(stats['memory_mapped'])
+        matches = reopened.search(self.doc_a[2:3], k=1)[0]
+        self.assertEqual((matches[0]['doc_id'], matches[0]['chunk_index']), ('a', 2))
+        self.assertEqual(matches[0]['text_preview'], 'a2')
+        self.assertAlmostEqual(matches[0]['similarity'], 1.0, places=5)
+
+        # Excluding the matching document returns only other documents
+        others = reopened.search(self.doc_a[2:3], k=3, exclude_doc_id='a')[0]
+        self.assertEqual({m['doc_id'] for m in others}, {'b'})
+        self.assertEqual(len(others), 3)
+
+    def test_replace_and_remove_document(self):
+        corpus = self.corpus()
+        corpus.add_document('a', self.doc_a)
+        corpus.add_document('a', self.doc_a[:2])
+        self.assertEqual(corpus.stats()['chunks'], 2)
+        self.assertEqual(corpus.list_documents()[0]['n_chunks'], 2)
+        self.assertEqual(corpus.remove_document('a'), 2)
+        self.assertEqual(corpus.search(self.doc_a[:1], k=3), [[]])
+
+    def test_sees_updates_from_other_instances(self):
+        reader = self.corpus()
+        writer = self.corpus()
+        writer.add_document('a', self.doc_a)
+        self.assertEqual(reader.stats()['chunks'], 6)
+        writer.add_document('b', self.doc_b)
+        self.assertEqual(reader.search(self.doc_b[:1], k=1)[0][0]['doc_id'], 'b')
+
+    def test_recent_adds_stay_in_the_delta_until_the_index_is_rewritten(self):
+        corpus = self.corpus(index_type='hnsw', delta_max=8)
+        corpus.add_document('a', self.doc_a)
+        shard_a = os.path.join(corpus.shard_dir, '0.npy')
+        before = os.stat(shard_a).st_mtime_ns
+        self.assertEqual(corpus.search(self.doc_a[:1], k=1)[0][0]['doc_id'], 'a')
+        self.assertEqual(corpus.stats()['pending_chunks'], 6)
+        self.assertFalse([f for f in os.listdir(corpus.path) if f.startswith('index.')])
+
+        # Past delta_max the writer folds the delta into an index file
+        corpus.add_document('b', self.doc_b)
+        self.assertEqual(os.stat(shard_a).st_mtime_ns, before)
+        self.assertEqual(sorted(os.listdir(corpus.shard_dir)), ['0.npy', '6.npy'])
+        reader = self.corpus()
+        stats = reader.stats()
+        self.assertEqual((stats['indexed_chunks'], stats['pending_chunks']), (10, 0))
+        self.assertEqual(stats['index_type'], 'hnsw')
+        self.assertTrue(stats['memory_mapped'])
+
+        # Results from the mapped index and a new delta are merged
+        doc_c = self.doc_a[:2] * -1
+        corpus.add_document('c', doc_c)
+        self.assertEqual(reader.stats()['pending_chunks'], 2)
+        self.assertEqual(reader.search(doc_c[1:2], k=1)[0][0]['doc_id'], 'c')
+        self.assertEqual(reader.search(self.doc_b[1:2], k=1)[0][0]['chunk_index'], 1)
+
+        # A removal rewrites the index file at once
+        corpus.remove_document('a')
+        self.assertEqual(sorted(os.listdir(corpus.shard_dir)), ['10.npy', '6.npy'])
+        self.assertEqual(sorted(f for f in os.listdir(corpus.path) if f.startswith('index.')),
+                         ['index.4.faiss', 'index.4.ids.npy'])
+        stats = reader.stats()
+        self.assertEqual((stats['indexed_chunks'], stats['pending_chunks']), (6, 0))
+
+    def test_rejects_other_embedding_model(self):
+        corpus = self.corpus()
+        corpus.add_document('a', self.doc_a, model_key='local:m')
+        with self.assertRaises(ValueError):
+            corpus.search(self.doc_a[:1], model_key='openai:other')
+        with self.assertRaises(ValueError):
+            corpus.add_document('b', self.doc_b[:, :8], model_key='local:m')
+
+    def test_detector_scores_against_corpus(self):
+        corpus = self.corpus()
+        detector = make_offline_detector()
+        detector.embedding_model = Mock()
+        detector.chunk_prompts = [f'prompt {i}' for i in range(6)]
+        detector.embedding_model.encode.return_value = self.doc_a
+        detector.build_faiss_index(detector.chunk_prompts)
+
+        empty = detector.calculate_corpus_novelty(corpus, k=2)
+        self.assertTrue(all(s['novelty_score'] == 1.0 for s in empty))
+
+        detector.add_to_corpus(corpus, 'a')
+        scores = detector.calculate_corpus_novelty(corpus, k=1)
+        self.assertAlmostEqual(scores[0]['novelty_score'], 0.0, places=5)
+        self.assertEqual(scores[0]['similar_chunks'][0]['doc_id'], 'a')
+        excluded = detector.calculate_corpus_novelty(corpus, k=1, exclude_doc_id='a')
+        self.assertEqual(excluded[0]['similar_chunks'], [])
+
+
+def make_test_pdf(path, pages, words_per_page=120):
+    """Write a PDF whose page i holds words 'p{i}w{j}' over several lines."""
+    import fitz
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        words = [f"p{i}w{j}" for j in range(words_per_page)]
+        lines = [" ".join(words[j:j + 10]) for j in range(0, len(words), 10)]
+        page.insert_text((50, 60), "\n".join(lines), fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+class TestStreamingExtraction(unittest.TestCase):
+    """Test cases for streaming PDF extraction and chunking."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmpdir.name, 'doc.pdf')
+        make_test_pdf(self.pdf_path, pages=6)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stream_matches_batch_chunking(self):
+        for mode in ('overlap', 'paragraph'):
+            processor = PDFProcessor(chunk_size=70, overlap=15, chunking_mode=mode)
+            expected = processor.chunk_text(processor.extract_text(self.pdf_path))
+            self.assertTrue(expected)
+            self.assertEqual(list(processor.stream_chunks(self.pdf_path, workers=1)), expected)
+
+    def test_parallel_extraction_preserves_page_order(self):
+        processor = PDFProcessor()
+        serial = list(processor.iter_page_texts(self.pdf_path, workers=1))
+        with patch('pdf_processor.PARALLEL_MIN_PAGES', 2), patch('pdf_processor.PAGES_PER_TASK', 2):
+            parallel = list(processor.iter_page_texts(self.pdf_path, workers=2))
+            pool = pdf_processor._get_extract_pool(2)
+            again = list(processor.iter_page_texts(self.pdf_path, workers=2))
+        self.assertEqual(parallel, serial)
+        self.assertEqual(again, serial)
+        self.assertIn('p5w0', parallel[5])
+        # Later documents reuse the process pool instead of spawning a new one
+        self.assertIs(pdf_processor._get_extract_pool(2), pool)
+
+    def test_chunk_contexts_match_list_contexts(self):
+        processor = PDFProcessor(chunk_size=40, overlap=5)
+        chunks = processor.chunk_text(processor.extract_text(self.pdf_path))
+        streamed = list(processor.iter_chunk_contexts(iter(chunks)))
+        self.assertEqual([c for c, _ in streamed], chunks)
+        for i, (_, context) in enumerate(streamed):
+            self.assertEqual(context, processor.get_chunk_context(chunks, i))
+
+    def test_prompts_start_before_extraction_finishes(self):
+        detector = make_offline_detector()
+        events = []
+
+        class RecordingProvider(SlowProvider):
+            def generate_prompt(self, chunk, context_before="", context_after=""):
+                events.append('prompt')
+                return super().generate_prompt(chunk, context_before, context_after)
+
+        def contexts():
+            for i in range(6):
+                events.append('chunk')
+                time.sleep(0.02)
+                yield ("", f"chunk{i}", "")
+
+        prompts = detector.generate_prompts(contexts(), provider=RecordingProvider())
+        self.assertEqual(prompts, [f"prompt:chunk{i}" for i in range(6)])
+        self.assertLess(events.index('prompt'), len(events) - 1 - events[::-1].index('chunk'))
+
+    def test_analyze_stream(self):
+        detector = make_offline_detector()
+        detector.embedding_model = FakeEncoder()
+        processor = PDFProcessor(chunk_size=60, overlap=10)
+        chunks, scores = detector.analyze_stream(
+            processor.iter_chunk_contexts(processor.stream_chunks(self.pdf_path, workers=1)), k=2)
+        self.assertEqual(chunks, processor.chunk_text(processor.extract_text(self.pdf_path)))
+        self.assertEqual(len(scores), len(chunks))
+
+
+class TestSpanAnnotation(unittest.TestCase):
+    """Test cases for chunk highlight annotations."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmpdir.name, 'doc.pdf')
+        self.out_path = os.path.join(self.tmpdir.name, 'annotated.pdf')
+        make_test_pdf(self.pdf_path, pages=4)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _highlights(self):
+        """{word: (chunk_index, stroke color)} for every highlighted word."""
+        import fitz
+        covered = {}
+        with fitz.open(self.out_path) as doc:
+            for page in doc:
+                # Skip the legend, which is drawn over the first page's text
+                words = [w for w in page.get_text("words") if re.fullmatch(r'p\d+w\d+', w[4])]
+                for annot in page.annots():
+                    chunk_index = int(annot.info['content'].split()[1].rstrip(':'))
+                    points = annot.vertices
+                    quads = [fitz.Quad(points[i:i + 4]).rect for i in range(0, len(points), 4)]
+                    for w in words:
+                        center = fitz.Point((w[0] + w[2]) / 2, (w[1] + w[3]) / 2)
+                        if any(center in q for q in quads):
+                            self.assertNotIn(w[4], covered)
+                            covered[w[4]] = (chunk_index, annot.colors['stroke'])
+        return covered
+
+    def test_highlights_follow_chunk_word_ranges(self):
+        processor = PDFProcessor(chunk_size=50, overlap=10)
+        chunks = list(processor.stream_chunks(self.pdf_path, workers=1))
+        scores = [{'chunk_index': c['chunk_index'], 'novelty_score': 0.9 if i % 2 else 0.1}
+                  for i, c in enumerate(chunks)]
+        processor.annotate_pdf(self.pdf_path, self.out_path, scores, chunks)
+
+        covered = self._highlights()
+        self.assertEqual(len(covered), 4 * 120)
+        starts = [c['word_start'] for c in chunks]
+        for word, (chunk_index, stroke) in covered.items():
+            page, idx = word[1:].split('w')
+            word_idx = int(page) * 120 + int(idx)
+            self.assertEqual(chunk_index, max(i for i, s in enumerate(starts) if s <= word_idx))
+            color = processor.get_novelty_color(scores[chunk_index]['novelty_score'])
+            self.assertEqual(tuple(stroke), (color.red, color.green, color.blue))
+
+    def test_annotation_without_prior_extraction(self):
+        processor = PDFProcessor(chunk_size=50, overlap=10)
+        chunks = processor.chunk_text(processor.extract_text(self.pdf_path))
+        scores = [{'chunk_index': c['chunk_index'], 'novelty_score': 0.5} for c in chunks]
+        PDFProcessor(chunk_size=50, overlap=10).annotate_pdf(
+            self.pdf_path, self.out_path, scores, chunks)
+        self.assertEqual(len(self._highlights()), 4 * 120)
+
+        # Without chunks only the legend is drawn
+        processor.annotate_pdf(self.pdf_path, self.out_path, scores)
+        self.assertEqual(self._highlights(), {})
+
+    def test_paragraph_chunks_carry_word_ranges(self):
+        text = "\n\n".join(" ".join(f"w{p}_{i}" for i in range(30 + p)) for p in range(12))
+        processor = PDFProcessor(chunk_size=60, chunking_mode='paragraph')
+        chunks = processor.chunk_text(text)
+        words = text.split()
+        self.assertEqual(chunks[0]['word_start'], 0)
+        self.assertEqual(chunks[-1]['word_end'], len(words))
+        for prev, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(prev['word_end'], chunk['word_start'])
+        for chunk in chunks:
+            self.assertEqual(' '.join(words[chunk['word_start']:chunk['word_end']]), chunk['text'])
+
+    def test_align_word_boxes_skips_unmatched(self):
+        from pdf_processor import _align_word_boxes
+        boxes = [(0, 0, 1, 1, w, 0, 0, i) for i, w in enumerate(["a", "b-", "c", "d"])]
+        self.assertEqual(_align_word_boxes(["a", "b", "c", "d"], boxes, 10), [10, None, 12, 13])
+
+
+class TestJobQueue(unittest.TestCase):
+    """Test cases for the background job queue."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'jobs.sqlite')
+        self.queue = JobQueue(self.db_path, workers=3, limit=lambda p: 1 if p == 'ollama' else 2)
+
+    def tearDown(self):
+        self.queue.shutdown()
+        self.tmpdir.cleanup()
+
+    def wait_for(self, job_id, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.queue.get(job_id)
+            if job['status'] in ('done', 'failed'):
+                return job
+            time.sleep(0.01)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_job_result_and_progress(self):
+        def work(progress):
+            progress(stage='prompts')
+            for i in range(1, 5):
+                progress(done=i, total=4)
+            return {'answer': 42}
+
+        job_id = self.queue.submit('upload', 'openai', work, params={'chunk_size': 150})
+        job = self.wait_for(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['chunks_done'], job['chunks_total']), (4, 4))
+        self.assertEqual(job['params'], {'chunk_size': 150})
+        self.assertEqual(self.queue.result(job_id), {'answer': 42})
+
+    def test_running_job_reports_eta(self):
+        release = threading.Event()
+
+        def work(progress):
+            progress(stage='prompts', done=1, total=3)
+            release.wait(5)
+            return {}
+
+        job_id = self.queue.submit('upload', 'openai', work)
+        deadline = time.time() + 5
+        while self.queue.get(job_id)['chunks_done'] != 1 and time.time() < deadline:
+            time.sleep(0.01)
+        job = self.queue.get(job_id)
+        self.assertEqual(job['status'], 'running')
+        self.assertEqual(job['stage'], 'prompts')
+        self.assertIsNotNone(job['eta_seconds'])
+        self.assertIsNone(self.queue.result(job_id))
+        release.set()
+        self.wait_for(job_id)
+
+    def test_per_provider_limit(self):
+        lock = threading.Lock()
+        running = {'ollama': 0, 'openai': 0}
+        peak = {'ollama': 0, 'openai': 0}
+
+        def work(provider):
+            def run(progress):
+                with lock:
+                    running[provider] += 1
+                    peak[provider] = max(peak[provider], running[provider])
+                time.sleep(0.05)
+                with lock:
+                    running[provider] -= 1
+                return {}
+            return run
+
+        ids = [self.queue.submit('upload', p, work(p))
+               for p in ('ollama', 'ollama', 'ollama', 'openai', 'openai')]
+        for job_id in ids:
+            self.assertEqual(self.wait_for(job_id)['status'], 'done')
+        self.assertEqual(peak['ollama'], 1)
+        self.assertEqual(peak['openai'], 2)
+
+    def test_failure_and_restart(self):
+        def broken(progress):
+            raise ValueError('No text could be extracted from the PDF')
+
+        job = self.wait_for(self.queue.submit('upload', 'openai', broken))
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('No text', job['error'])
+
+        # Simulate a job that was running when its process stopped
+        stuck = self.queue.submit('upload', 'openai', lambda progress: {})
+        self.wait_for(stuck)
+        with self.queue._lock:
+            self.queue._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = 'stopped-process' WHERE id = ?",
+                (stuck,))
+            self.queue._conn.commit()
+        restarted = JobQueue(self.db_path, workers=1)
+        try:
+            job = restarted.get(stuck)
+            self.assertEqual(job['status'], 'failed')
+            self.assertIn('restart', job['error'])
+        finally:
+            restarted.shutdown()
+
+    def test_other_workers_leave_live_jobs_alone(self):
+        release = threading.Event()
+
+        def work(progress):
+            release.wait(5)
+            return {}
+
+        job_id = self.queue.submit('upload', 'openai', work)
+        deadline = time.time() + 5
+        while self.queue.get(job_id)['status'] != 'running' and time.time() < deadline:
+            time.sleep(0.01)
+        # A second server worker starting on the same database
+        other = JobQueue(self.db_path, workers=1)
+        try:
+            self.assertEqual(other.get(job_id)['status'], 'running')
+            release.set()
+            self.assertEqual(self.wait_for(job_id)['status'], 'done')
+        finally:
+            other.shutdown()
+
+        # A job of a worker whose heartbeat stopped is failed by the next live heartbeat
+        with self.queue._lock:
+            self.queue._conn.execute("INSERT INTO job_owners VALUES ('killed', 1, 0)")
+            self.queue._conn.execute(
+                "INSERT INTO jobs (id, kind, status, created, owner) "
+                "VALUES ('orphan', 'upload', 'running', ?, 'killed')", (time.time(),))
+            self.queue._conn.commit()
+        self.queue._heartbeat()
+        self.assertEqual(self.queue.get('orphan')['status'], 'failed')
+
+    def test_generate_prompts_reports_progress(self):
+        detector = make_offline_detector()
+        calls = []
+        detector.generate_prompts([("", f"chunk{i}", "") for i in range(5)],
+                                  provider=SlowProvider(),
+                                  progress=lambda done, total: calls.append((done, total)))
+        self.assertEqual(sorted(d for d, _ in calls), [1, 2, 3, 4, 5])
+        self.assertEqual(calls[-1], (5, 5))
+
+
+class TestModelRegistry(unittest.TestCase):
+    """Test cases for pooled embedding models and provider clients."""
+
+    def test_concurrent_gets_load_once(self):
+        pool = ModelPool(2)
+        loads = []
+
+        def factory():
+            loads.append(1)
+            time.sleep(0.05)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.get(('local', 'm', ''), factory)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len({id(r) for r in results}), 1)
+
+    def test_lru_eviction(self):
+        pool = ModelPool(2)
+        for name in ('a', 'b', 'a', 'c'):
+            pool.get(('local', name, ''), object)
+        self.assertIn(('local', 'a', ''), pool)
+        self.assertNotIn(('local', 'b', ''), pool)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_failed_load_is_retried(self):
+        pool = ModelPool(2)
+
+        def broken():
+            raise OSError("model not found")
+
+        with self.assertRaises(OSError):
+            pool.get(('local', 'x', ''), broken)
+        self.assertEqual(pool.get(('local', 'x', ''), lambda: 'loaded'), 'loaded')
+
+    def test_keys_hash_api_keys(self):
+        key_a = pool_key('openai', 'gpt-4o-mini', 'sk-secret-a')
+        self.assertNotEqual(key_a, pool_key('openai', 'gpt-4o-mini', 'sk-secret-b'))
+        self.assertEqual(pool_key('ollama'), ('ollama', '', ''))
+        pool = ModelPool(2)
+        pool.get(key_a, object)
+        self.assertNotIn('sk-secret-a', json.dumps(pool.stats()))
+
+    def test_detectors_share_models_and_clients(self):
+        registry = ModelRegistry()
+        with patch('novelty_detector.SentenceTransformer') as mock_st:
+            first = NoveltyDetector(llm_provider='fallback', use_prompt_cache=False,
+                                    use_embedding_cache=False, model_registry=registry)
+            second = NoveltyDetector(llm_provider='fallback', use_prompt_cache=False,
+                                     use_embedding_cache=False, model_registry=registry)
+        mock_st.assert_called_once()
+        self.assertIs(first.embedding_model, second.embedding_model)
+        self.assertIs(first.providers['ollama'], second.providers['ollama'])
+
+    def test_pooled_google_providers_keep_their_own_keys(self):
+        import types
+
+        class FakeClient:
+            def __init__(self, api_key):
+                self.api_key = api_key
+                self.models = self
+
+            def generate_content(self, model, contents):
+                return types.SimpleNamespace(text=f" {self.api_key} ", usage_metadata=None)
+
+        genai = types.SimpleNamespace(Client=FakeClient)
+        registry = ModelRegistry()
+        with patch.dict(sys.modules, {'google': types.SimpleNamespace(genai=genai),
+                                      'google.genai': genai}):
+            first = llm_providers.discover_providers({'google': 'key-a'}, registry=registry)
+            second = llm_providers.discover_providers({'google': 'key-b'}, registry=registry)
+            again = llm_providers.discover_providers({'google': 'key-a'}, registry=registry)
+        self.assertIs(first['google'], again['google'])
+        # The second user's key does not leak into the first user's pooled provider
+        self.assertEqual(first['google'].generate_prompt('chunk'), 'key-a')
+        self.assertEqual(second['google'].generate_prompt('chunk'), 'key-b')
+
+    def test_pooled_model_is_locked_for_every_caller(self):
+        import validator_api
+
+        class BorrowCheckingEncoder(FakeEncoder):
+            """Fails like a HuggingFace fast tokenizer on overlapping calls."""
+
+            def __init__(self):
+                super().__init__()
+                self.busy = threading.Lock()
+
+            def encode(self, texts, **kwargs):
+                if not self.busy.acquire(blocking=False):
+                    raise RuntimeError("Already borrowed")
+                try:
+                    time.sleep(0.01)
+                    return super().encode(texts, **kwargs)
+                finally:
+                    self.busy.release()
+
+        registry = ModelRegistry()
+        encoder = BorrowCheckingEncoder()
+        with patch('novelty_detector.SentenceTransformer', return_value=encoder), \
+                patch('validator_api.SentenceTransformer', return_value=encoder), \
+                patch('validator_api.get_model_registry', return_value=registry), \
+                patch('validator_api.get_embedding_cache', return_value=None):
+            detector = NoveltyDetector(llm_provider='fallback', use_prompt_cache=False,
+                                       use_embedding_cache=False, model_registry=registry,
+                                       embedding_model_name='all-MiniLM-L6-v2')
+            self.assertIs(detector.embedding_model,
+                          validator_api.get_embed_model('all-MiniLM-L6-v2'))
+            errors = []
+
+            def run(embed):
+                try:
+                    for i in range(5):
+                        embed([f"text {i}"])
+                except RuntimeError as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run, args=(detector._encode_batch,)),
+                       threading.Thread(target=run, args=(
+                           lambda texts: validator_api.embed_texts(texts, 'all-MiniLM-L6-v2'),))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(encoder.batches), 10)
+
+
+class TestMultiProviderComparison(unittest.TestCase):
+    """Test cases for concurrent multi-provider analysis."""
+
+    def setUp(self):
+        self.processor = PDFProcessor(chunk_size=20, overlap=5)
+        text = " ".join(f"word{i % 37} topic{i % 11}" for i in range(120))
+        self.chunks = self.processor.chunk_text(text)
+
+    def make_detector(self, providers):
+        detector = make_offline_detector()
+        detector.embedding_model = FakeEncoder()
+        detector.providers = providers
+        return detector
+
+    def test_providers_run_concurrently(self):
+        lock = threading.Lock()
+        in_flight = {}
+        overlaps = []
+
+        class TimedProvider(LLMProvider):
+            def __init__(self, name):
+                self.name = name
+
+            def generate_prompt(self, chunk, context_before="", context_after=""):
+                with lock:
+                    if any(n != self.name and c for n, c in in_flight.items()):
+                        overlaps.append(self.name)
+                    in_flight[self.name] = in_flight.get(self.name, 0) + 1
+                time.sleep(0.02)
+                with lock:
+                    in_flight[self.name] -= 1
+                return f"{self.name}:{chunk}"
+
+        detector = self.make_detector({'a': TimedProvider('a'), 'b': TimedProvider('b')})
+        with patch.dict(os.environ, {'NOVELTY_MAX_CONCURRENCY': '1'}):
+            results = detector.analyze_providers(self.chunks, self.processor, ['a', 'b'], k=2)
+        self.assertEqual(list(results), ['a', 'b'])
+        self.assertTrue(overlaps)
+        for name, result in results.items():
+            self.assertEqual(result.provider, name)
+            self.assertEqual(len(result.novelty_scores), len(self.chunks))
+            self.assertEqual(result.embeddings.shape, (len(self.chunks), 8))
+
+    def test_results_match_single_provider_and_leave_state(self):
+        provider = SlowProvider()
+        detector = self.make_detector({'ollama': provider})
+        multi = detector.analyze_document_multi(self.chunks, self.processor, ['ollama'], k=3)
+        self.assertIsNone(detector.index)
+        self.assertEqual(detector.chunk_prompts, [])
+
+        detector.active_provider = provider
+        single = detector.analyze_document(self.chunks, self.processor, k=3)
+        self.assertEqual(multi['ollama'], single)
+
+    def test_results_count_their_own_llm_calls(self):
+        detector = self.make_detector({'ollama': SlowProvider(),
+                                       'fallback': FallbackProvider()})
+        detector.embedding_mode = 'hybrid'
+        with patch('novelty_detector.HYBRID_MARGIN', 1.0):
+            results = detector.analyze_providers(self.chunks, self.processor,
+                                                 ['ollama', 'fallback'], k=3)
+        n = len(self.chunks)
+        self.assertEqual((results['ollama'].prompted_chunks, results['ollama'].llm_calls), (n, n))
+        # Keyword fallback prompts are not LLM calls
+        self.assertEqual((results['fallback'].prompted_chunks, results['fallback'].llm_calls),
+                         (n, 0))
+        self.assertEqual(detector.prompted_chunks, 0)
+
+
+class TestEmbeddingModes(unittest.TestCase):
+    """Test cases for the raw and hybrid embedding modes."""
+
+    def setUp(self):
+        self.processor = PDFProcessor(chunk_size=20, overlap=5)
+        text = " ".join(f"word{i % 37} topic{i % 11}" for i in range(120))
+        self.chunks = self.processor.chunk_text(text)
+
+    def make_detector(self, mode):
+        detector = make_offline_detector(embedding_mode=mode)
+        detector.embedding_model = FakeEncoder()
+        detector.active_provider = self.provider = SlowProvider()
+        return detector
+
+    def test_invalid_mode_raises(self):
+        with self.assertRaises(ValueError):
+            make_offline_detector(embedding_mode='summaries')
+
+    def test_raw_mode_skips_the_llm(self):
+        detector = self.make_detector('raw')
+        scores = detector.analyze_document(self.chunks, self.processor, k=3)
+        self.assertEqual(self.provider.calls, 0)
+        self.assertEqual(detector.prompted_chunks, 0)
+        self.assertEqual(len(scores), len(self.chunks))
+        self.assertEqual(detector.chunk_prompts, [c['text'] for c in self.chunks])
+
+    def test_prompt_mode_prompts_every_chunk(self):
+        detector = self.make_detector('prompt')
+        detector.analyze_document(self.chunks, self.processor, k=3)
+        self.assertEqual(self.provider.calls, len(self.chunks))
+        self.assertEqual(detector.prompted_chunks, len(self.chunks))
+
+    def test_hybrid_prompts_only_borderline_chunks(self):
+        detector = self.make_detector('hybrid')
+        with patch('novelty_detector.HYBRID_MARGIN', 0.0):
+            raw = detector.analyze_document(self.chunks, self.processor, k=3)
+        self.assertEqual(self.provider.calls, 0)
+
+        detector = self.make_detector('hybrid')
+        with patch('novelty_detector.HYBRID_MARGIN', 1.0):
+            detector.analyze_document(self.chunks, self.processor, k=3)
+        self.assertEqual(self.provider.calls, len(self.chunks))
+        self.assertTrue(all(p.startswith('prompt:') for p in detector.chunk_prompts))
+
+        thresholds = np.array(NOVELTY_THRESHOLDS)
+        raw_scores = np.array([s['novelty_score'] for s in raw])
+        expected = int((np.abs(raw_scores[:, None] - thresholds).min(axis=1) < 0.1).sum())
+        detector = self.make_detector('hybrid')
+        with patch('novelty_detector.HYBRID_MARGIN', 0.1):
+            detector.analyze_document(self.chunks, self.processor, k=3)
+        self.assertEqual(self.provider.calls, expected)
+        self.assertEqual(detector.prompted_chunks, expected)
+        self.assertEqual(sum(p.startswith('prompt:') for p in detector.chunk_prompts), expected)
+        norms = np.linalg.norm(detector.embeddings, axis=1)
+        np.testing.assert_allclose(norms, 1.0, rtol=1e-5)
+
+
+class TestOnnxEmbedder(unittest.TestCase):
+    """Test cases for the int8 ONNX embedding backend (no model is loaded)."""
+
+    def make_embedder(self, max_batch_tokens):
+        embedder = OnnxEmbedder.__new__(OnnxEmbedder)
+        embedder.max_batch_tokens = max_batch_tokens
+        embedder.model = MagicMock(max_seq_length=8)
+        embedder.model.tokenizer.side_effect = lambda texts, truncation, max_length: {
+            'input_ids': [t.split()[:max_length] for t in texts]}
+        embedder.model.get_sentence_embedding_dimension.return_value = 4
+        embedder.model.encode.side_effect = lambda texts, **kw: np.array(
+            [[len(t.split())] * 4 for t in texts], dtype=np.float32)
+        return embedder
+
+    def test_batches_group_by_length_within_token_budget(self):
+        texts = [" ".join(["w"] * n) for n in (1, 8, 3, 20, 2, 8, 5)]
+        embedder = self.make_embedder(max_batch_tokens=16)
+        batches = embedder.batches(texts, batch_size=3)
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(len(texts))))
+        lengths = [min(len(t.split()), 8) for t in texts]
+        for batch in batches:
+            self.assertLessEqual(len(batch), 3)
+            padded = len(batch) * max(lengths[i] for i in batch)
+            self.assertTrue(padded <= 16 or len(batch) == 1)
+        self.assertEqual(lengths[batches[0][0]], 8)  # longest texts first
+
+    def test_encode_restores_input_order(self):
+        texts = [" ".join(["w"] * n) for n in (3, 1, 6, 2)]
+        embedder = self.make_embedder(max_batch_tokens=8)
+        vectors = embedder.encode(texts, batch_size=2)
+        self.assertEqual(vectors[:, 0].tolist(), [3, 1, 6, 2])
+        self.assertEqual(embedder.encode([]).shape, (0, 4))
+        embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        self.assertTrue(embedder.model.encode.call_args.kwargs['normalize_embeddings'])
+
+    def test_concurrent_exports_run_once_and_appear_whole(self):
+        exports = []
+
+        def fake_export(model_name, output_dir, quantization):
+            exports.append(quantization)
+            time.sleep(0.05)
+            file_name = os.path.join('onnx', f'model_qint8_{quantization}.onnx')
+            os.makedirs(os.path.join(output_dir, 'onnx'), exist_ok=True)
+            with open(os.path.join(output_dir, file_name), 'w') as f:
+                f.write(quantization)
+            return file_name
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch('onnx_embedder.export_quantized_model', side_effect=fake_export):
+            path = os.path.join(tmp, 'all-MiniLM-L6-v2')
+            names = []
+            threads = [threading.Thread(target=lambda: names.append(
+                ensure_quantized_model('all-MiniLM-L6-v2', path, 'avx2'))) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(exports, ['avx2'])
+            self.assertEqual(set(names), {os.path.join('onnx', 'model_qint8_avx2.onnx')})
+
+            # A second kernel set is moved into the existing export
+            ensure_quantized_model('all-MiniLM-L6-v2', path, 'arm64')
+            self.assertEqual(sorted(os.listdir(os.path.join(path, 'onnx'))),
+                             ['model_qint8_arm64.onnx', 'model_qint8_avx2.onnx'])
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ['all-MiniLM-L6-v2', 'all-MiniLM-L6-v2.lock'])
+
+    def test_thread_and_quantization_defaults(self):
+        self.assertGreaterEqual(available_cpus(), 1)
+        self.assertIn(default_quantization(), QUANTIZATION_CONFIGS)
+
+    def test_missing_onnxruntime_raises_import_error(self):
+        with patch.dict(sys.modules, {'onnxruntime': None}):
+            with self.assertRaises(ImportError):
+                OnnxEmbedder('all-MiniLM-L6-v2')
+
+    def test_detector_uses_pooled_onnx_model(self):
+        registry = ModelRegistry()
+        with patch('novelty_detector.OnnxEmbedder', return_value=FakeEncoder()) as onnx:
+            first = make_offline_detector(embedding_provider='onnx', model_registry=registry,
+                                          embedding_model_name='all-MiniLM-L6-v2')
+            second = make_offline_detector(embedding_provider='onnx', model_registry=registry,
+                                           embedding_model_name='all-MiniLM-L6-v2')
+        onnx.assert_called_once_with('all-MiniLM-L6-v2')
+        self.assertIs(first.embedding_model, second.embedding_model)
+        self.assertEqual(first.embedding_model_key, 'onnx:all-MiniLM-L6-v2')
+        self.assertEqual(first._encode_texts(['a', 'bb']).shape, (2, 8))
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal Ollama API: /api/tags, streaming /api/generate and batched /api/embed."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.record(self, None)
+        self.send_json({"models": [{"name": "llama3.2"}, {"name": "nomic-embed-text"}]})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.record(self, payload)
+        if self.path == "/api/embed":
+            self.send_json({"embeddings": [[float(len(t)), 1.0] for t in payload["input"]]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(self.server.tokens):
+                line = json.dumps({"response": f"t{i} ", "done": False}).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+                self.server.sent += 1
+                time.sleep(self.server.token_delay)
+            line = json.dumps({"response": "", "done": True}).encode() + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(line), line))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """Local fake Ollama server recording requests and client connections."""
+
+    daemon_threads = True
+
+    def __init__(self, tokens=10, token_delay=0.0):
+        super().__init__(("127.0.0.1", 0), FakeOllamaHandler)
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.sent = 0
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def record(self, handler, payload):
+        with self.lock:
+            self.requests.append((handler.path, payload))
+            self.connections.add(handler.client_address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestOllamaClient(unittest.TestCase):
+    """Test cases for the pooled sync and async Ollama clients."""
+
+    def setUp(self):
+        self.server = FakeOllamaServer()
+        self.client = OllamaClient(self.server.url, keep_alive="10m")
+        ollama_client._health_cache.clear()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.assertEqual(self.client.generate("hi", model="m"), " ".join(
+                f"t{i}" for i in range(10)))
+        self.client.embed_batch(["a", "b"])
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_embed_batch_sends_one_request_with_keep_alive(self):
+        vectors = self.client.embed_batch(["a", "bbb", "cc"], model="nomic-embed-text")
+        self.assertEqual(vectors, [[1.0, 1.0], [3.0, 1.0], [2.0, 1.0]])
+        self.assertEqual(self.client.embeddings("abcd"), [4.0, 1.0])
+        path, payload = self.server.requests[0]
+        self.assertEqual(path, "/api/embed")
+        self.assertEqual(payload["input"], ["a", "bbb", "cc"])
+        self.assertEqual(payload["keep_alive"], "10m")
+
+    def test_generate_streams_and_stops_early(self):
+        self.server.tokens, self.server.token_delay = 200, 0.01
+        start = time.time()
+        text = self.client.generate("hi", stop=["t3"])
+        self.assertEqual(text, "t0 t1 t2")
+        self.assertLess(time.time() - start, 1.0)
+        payload = self.server.requests[0][1]
+        self.assertTrue(payload["stream"])
+        self.assertEqual(payload["options"]["stop"], ["t3"])
+        self.assertEqual(self.client.generate("hi", until=lambda t: t.count("t") >= 2), "t0 t1")
+        time.sleep(0.1)
+        self.assertLess(self.server.sent, 50)  # server saw the disconnect
+
+    def test_health_is_cached(self):
+        self.assertEqual(self.client.health(), {"available": True})
+        self.assertEqual(OllamaClient(self.server.url).health(), {"available": True})
+        self.assertEqual(len(self.server.requests), 1)
+        self.client.health(refresh=True)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.client.list_models(), ["llama3.2", "nomic-embed-text"])
+
+        down = OllamaClient("http://127.0.0.1:9", health_ttl=60)
+        self.assertEqual(down.health(), {"available": False})
+        self.assertEqual(down.list_models(), [])
+
+    def test_async_client(self):
+        self.server.tokens = 20
+
+        async def run():
+            async with AsyncOllamaClient(self.server.url) as client:
+                results = await asyncio.gather(
+                    client.generate("a", stop=["t2"]),
+                    client.embed_batch(["x", "yy"]),
+                    client.health(),
+                    client.list_models())
+                return results + [await client.generate("b", max_tokens=5)]
+
+        short, vectors, health, models, full = asyncio.run(run())
+        self.assertEqual(short, "t0 t1")
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 1.0]])
+        self.assertEqual(health, {"available": True})
+        self.assertEqual(models, ["llama3.2", "nomic-embed-text"])
+        self.assertEqual(full, " ".join(f"t{i}" for i in range(20)))
+        self.assertEqual(self.server.requests[-1][1]["options"]["num_predict"], 5)
+
+
+class NamedProvider(LLMProvider):
+    """Provider posing as a cost_config provider, optionally failing or slow."""
+
+    def __init__(self, name, fail=False, delay=0.0):
+        self.name = name
+        self.fail = fail
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate_prompt(self, chunk, context_before="", context_after=""):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} down")
+        return f"{self.name}:{chunk}"
+
+
+class TestProviderRouter(unittest.TestCase):
+    """Test cases for RouterProvider policies, failover and circuit breakers."""
+
+    def setUp(self):
+        llm_providers._provider_stats.clear()
+        self.providers = {name: NamedProvider(name)
+                          for name in ('ollama', 'google', 'openai', 'anthropic')}
+        self.providers['fallback'] = NamedProvider('fallback')
+
+    def record(self, name, seconds, ok=True, n=5):
+        for _ in range(n):
+            llm_providers.get_provider_stats(name).record(seconds, ok)
+
+    def test_policies(self):
+        self.assertEqual(RouterProvider(self.providers, policy='cheapest').ranking(),
+                         ['ollama', 'google', 'openai', 'anthropic'])
+        self.assertEqual(RouterProvider(self.providers, policy='quality').ranking(),
+                         ['anthropic', 'openai', 'google', 'ollama'])
+        self.assertEqual(RouterProvider(self.providers, policy='quality', min_tier='Mid').ranking(),
+                         ['anthropic', 'openai'])
+
+        # Ollama is free but misses the SLA: the cheapest provider within it goes first
+        self.record('ollama', 20.0)
+        self.record('google', 1.0)
+        self.record('openai', 0.5)
+        self.record('anthropic', 2.0)
+        self.assertEqual(RouterProvider(self.providers, policy='cheapest', sla_seconds=5).ranking(),
+                         ['google', 'openai', 'anthropic', 'ollama'])
+        self.assertEqual(RouterProvider(self.providers, policy='fastest').ranking(),
+                         ['openai', 'google', 'anthropic', 'ollama'])
+        with self.assertRaises(ValueError):
+            RouterProvider(self.providers, policy='random')
+
+    def test_failover_and_circuit_breaker(self):
+        self.providers['ollama'].fail = True
+        router = RouterProvider(self.providers, policy='cheapest')
+        stats = llm_providers.get_provider_stats('ollama')
+        stats.breaker.base_cooldown = stats.breaker.cooldown = 0.1
+        for i in range(10):
+            self.assertEqual(router.generate_prompt(f'c{i}'), f'google:c{i}')
+        # A provider with only failures goes to the back, not the front (latency unknown)
+        self.assertEqual(self.providers['ollama'].calls, 1)
+        self.assertEqual(router.ranking()[-1], 'ollama')
+        self.assertEqual(RouterProvider(self.providers, policy='fastest').ranking()[-1], 'ollama')
+
+        for _ in range(llm_providers.BREAKER_FAILURES - 1):
+            stats.record(1.0, ok=False)
+        self.assertEqual(stats.snapshot()['circuit'], 'open')
+        self.assertNotIn('ollama', router.ranking())
+
+        # After the cooldown one trial call goes through; success closes the circuit
+        time.sleep(0.15)
+        self.providers['ollama'].fail = False
+        self.assertEqual(router.generate_prompt('again'), 'ollama:again')
+        self.assertEqual(stats.snapshot()['circuit'], 'closed')
+
+        for provider in self.providers.values():
+            provider.fail = True
+        with self.assertRaises(RuntimeError):
+            router.generate_prompt('x')
+
+        # Every breaker refuses the call (trial already claimed): say so
+        only = RouterProvider({'ollama': self.providers['ollama']}, policy='cheapest')
+        with patch.object(llm_providers.CircuitBreaker, 'allow', return_value=False):
+            with self.assertRaisesRegex(RuntimeError, 'every circuit was open'):
+                only.generate_prompt('x')
+
+    def test_spills_over_when_preferred_provider_is_busy(self):
+        slots = {name: threading.BoundedSemaphore(1) for name in self.providers}
+        router = RouterProvider(self.providers, policy='cheapest', slot=slots.__getitem__)
+        slots['ollama'].acquire()
+        try:
+            self.assertEqual(router.generate_prompt('c'), 'google:c')
+        finally:
+            slots['ollama'].release()
+        self.assertEqual(router.generate_prompt('c'), 'ollama:c')
+
+    def test_throughput_holds_when_a_provider_degrades(self):
+        self.providers['ollama'].fail = True
+        self.providers['ollama'].delay = 0.05
+        detector = make_offline_detector()
+        detector.active_provider = RouterProvider(self.providers, policy='cheapest')
+        contexts = [('', f'chunk{i}', '') for i in range(40)]
+        with patch('novelty_detector.LLM_MAX_RETRIES', 0):
+            prompts = detector.generate_prompts(contexts)
+        self.assertTrue(all(not p.startswith('Write about') for p in prompts))
+        self.assertEqual([p.split(':')[1] for p in prompts], [f'chunk{i}' for i in range(40)])
+        self.assertLessEqual(self.providers['ollama'].calls,
+                             llm_providers.BREAKER_FAILURES + detector.active_provider.max_concurrency)
+        self.assertEqual(self.providers['fallback'].calls, 0)
+
+
+class ProbedProvider(LLMProvider):
+    """Provider whose live probe result can be flipped; counts probes."""
+
+    def __init__(self, name, up=True):
+        self.name = name
+        self.model = f"{name}-model"
+        self.up = up
+        self.probes = 0
+
+    def probe(self):
+        self.probes += 1
+        if self.up is None:
+            raise ConnectionError("unreachable")
+        return self.up
+
+    def generate_prompt(self, chunk, context_before="", context_after=""):
+        return f"{self.name}:{chunk}"
+
+
+class TestProviderMonitor(unittest.TestCase):
+    """Test cases for the background provider health monitor."""
+
+    def setUp(self):
+        llm_providers._provider_stats.clear()
+        self.providers = {'ollama': ProbedProvider('ollama'),
+                          'openai': ProbedProvider('openai')}
+        self.monitor = ProviderMonitor(interval=0.05, discover=lambda: self.providers)
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def test_probe_round_caches_timestamped_status(self):
+        self.providers['openai'].up = None
+        self.assertTrue(self.monitor.is_up('ollama'))  # unknown counts as up
+        self.assertIsNone(self.monitor.status('ollama'))
+
+        before = time.time()
+        snapshot = self.monitor.probe_all()
+        self.assertEqual(set(snapshot), {'ollama', 'openai'})
+        self.assertTrue(snapshot['ollama']['available'])
+        self.assertGreaterEqual(snapshot['ollama']['checked_at'], before)
+        self.assertEqual(snapshot['ollama']['model'], 'ollama-model')
+        self.assertFalse(snapshot['ollama']['stale'])
+        self.assertFalse(snapshot['openai']['available'])
+        self.assertIn('unreachable', snapshot['openai']['error'])
+        self.assertFalse(self.monitor.is_up('openai'))
+
+        # Reads come from the cache: no further probes
+        for _ in range(5):
+            self.monitor.status('ollama')
+            self.monitor.is_up('openai')
+        self.assertEqual(self.providers['ollama'].probes, 1)
+
+    def test_background_thread_tracks_changes(self):
+        self.monitor.start()
+        self.assertTrue(self.monitor.running)
+        deadline = time.time() + 5
+        while self.monitor.status('ollama') is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.monitor.is_up('ollama'))
+
+        self.providers['ollama'].up = False
+        while self.monitor.is_up('ollama') and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.monitor.is_up('ollama'))
+
+        self.monitor.stop()
+        self.assertFalse(self.monitor.running)
+        rounds = self.monitor.rounds
+        time.sleep(0.15)
+        self.assertEqual(self.monitor.rounds, rounds)
+        self.assertTrue(self.monitor.status('ollama')['stale'])
+
+    def test_ollama_availability_is_cached_not_live(self):
+        class CountingClient:
+            def __init__(self):
+                self.checks = []
+                self.last = None
+
+            def health(self, refresh=False):
+                self.checks.append(refresh)
+                self.last = {"available": False}
+                return self.last
+
+            def last_health(self):
+                return self.last
+
+        client = CountingClient()
+        provider = OllamaProvider(client=client)
+        self.assertTrue(provider.is_available())  # never checked
+        self.assertEqual(client.checks, [])
+
+        monitor = ProviderMonitor(discover=lambda: {'ollama': provider})
+        monitor.probe_all()
+        self.assertEqual(client.checks, [True])
+        self.assertFalse(provider.is_available())
+        self.assertEqual(client.checks, [True])
+
+    def test_selection_skips_providers_reported_down(self):
+        self.providers['ollama'].up = False
+        self.monitor.probe_all()
+        router = RouterProvider(self.providers, policy='cheapest', health=self.monitor.is_up)
+        self.assertEqual(router.ranking(), ['openai'])
+        self.assertEqual(router.generate_prompt('c'), 'openai:c')
+
+        with patch('novelty_detector.get_provider_monitor', return_value=self.monitor):
+            with patch('novelty_detector.discover_providers',
+                       return_value={**self.providers, 'fallback': FallbackProvider()}):
+                down = make_offline_detector(llm_provider='ollama')
+                up = make_offline_detector(llm_provider='openai')
+        self.assertEqual(down.active_provider.name, 'fallback')
+        self.assertIs(up.active_provider, self.providers['openai'])
+
+
+class UsageReportingProvider(SlowProvider):
+    """SlowProvider that reports API token usage like the cloud SDK providers."""
+
+    name = "openai"
+    model = "gpt-4o-mini"
+
+    def generate_prompt(self, chunk, context_before="", context_after=""):
+        prompt = super().generate_prompt(chunk, context_before, context_after)
+        llm_providers._report_usage(300, 25)
+        return prompt
+
+
+class TestCostEstimation(unittest.TestCase):
+    """Test cases for token counting, usage recording and calibrated estimates."""
+
+    def setUp(self):
+        self.log = UsageLog(':memory:')
+        processor = PDFProcessor(chunk_size=50, overlap=10)
+        chunks = processor.chunk_text(" ".join(f"word{i}" for i in range(400)))
+        self.contexts = [processor.get_chunk_context(chunks, i) for i in range(len(chunks))]
+
+    def test_count_tokens(self):
+        self.assertEqual(cost_config.count_tokens("", "ollama"), 0)
+        self.assertEqual(cost_config.count_tokens("a" * 38, "ollama"), 10)
+        self.assertEqual(cost_config.token_counter("anthropic"), "approx")
+
+        class Encoding:
+            def encode(self, text):
+                return text.split()
+
+        with patch.dict(cost_config._tiktoken_encodings, {"gpt-4o-mini": Encoding()}):
+            self.assertEqual(cost_config.count_tokens("one two three", "openai"), 3)
+            self.assertEqual(cost_config.token_counter("openai"), "tiktoken")
+
+    def test_count_tokens_does_not_wait_for_tiktoken(self):
+        class Encoding:
+            def encode(self, text):
+                return text.split()
+
+        release = threading.Event()
+
+        def slow_load(models):
+            release.wait(5)  # e.g. downloading the BPE file
+            for model in models:
+                cost_config._tiktoken_encodings[model] = Encoding()
+
+        with patch.dict(cost_config._tiktoken_encodings, clear=True), \
+                patch.object(cost_config, '_tiktoken_requested', set()), \
+                patch('cost_config._load_tiktoken', side_effect=slow_load):
+            # Character estimate while the encoding loads in the background
+            self.assertEqual(cost_config.count_tokens("one two three", "openai", "m1"), 4)
+            self.assertEqual(cost_config.token_counter("openai", "m1"), "approx")
+            release.set()
+            deadline = time.time() + 5
+            while "m1" not in cost_config._tiktoken_encodings and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(cost_config.count_tokens("one two three", "openai", "m1"), 3)
+
+    def test_estimate_counts_actual_requests(self):
+        est = cost_config.estimate_chunks_cost(self.contexts, llm_provider="openai")
+        expected = sum(cost_config.count_tokens(prompt_text(chunk, before, after), "openai")
+                       for before, chunk, after in self.contexts)
+        self.assertEqual(est["chunks"], len(self.contexts))
+        self.assertEqual(est["input_tokens"], expected)
+        self.assertEqual(est["output_tokens"], len(self.contexts) * cost_config.DEFAULT_OUTPUT_TOKENS)
+        self.assertGreater(est["total_cost"], 0)
+        self.assertGreater(est["estimated_seconds"], 0)
+        self.assertFalse(est["calibrated"])
+        self.assertEqual(cost_config.estimate_chunks_cost([], "openai")["chunks"], 0)
+
+        # Free provider: no cost, but still a duration
+        free = cost_config.estimate_chunks_cost(self.contexts, llm_provider="ollama")
+        self.assertEqual(free["formatted_cost"], "Free")
+        self.assertGreater(free["estimated_seconds"], 0)
+
+    def test_calibration_from_recorded_usage(self):
+        for _ in range(4):
+            self.log.record_call("openai", "gpt-4o-mini", 100, 50, 1.0, reported=(200, 40))
+        self.log.record_run("prompts", "openai", "gpt-4o-mini", 20, 10.0)
+        self.log.record_run("embed", "local", "all-MiniLM-L6-v2", 50, 5.0)
+        calibration = self.log.calibration("openai", embedding_provider="local")
+        self.assertEqual(calibration["calls"], 4)
+        self.assertAlmostEqual(calibration["input_ratio"], 2.0)
+        self.assertAlmostEqual(calibration["output_tokens"], 40)
+        self.assertAlmostEqual(calibration["prompt_chunks_per_second"], 2.0)
+        self.assertAlmostEqual(calibration["embed_chunks_per_second"], 10.0)
+
+        plain = cost_config.estimate_chunks_cost(self.contexts, "openai")
+        calibrated = cost_config.estimate_chunks_cost(self.contexts, "openai",
+                                                      calibration=calibration)
+        n = len(self.contexts)
+        self.assertTrue(calibrated["calibrated"])
+        self.assertAlmostEqual(calibrated["input_tokens"], 2 * plain["input_tokens"], delta=1)
+        self.assertEqual(calibrated["output_tokens"], 40 * n)
+        self.assertAlmostEqual(calibrated["estimated_seconds"], n / 2.0 + n / 10.0, places=1)
+        self.assertGreater(calibrated["total_cost"], plain["total_cost"])
+
+        # Older runs fade: a slower recent run weighs more than the first one
+        self.log.record_run("prompts", "openai", "gpt-4o-mini", 20, 40.0)
+        slower = self.log.calibration("openai")["prompt_chunks_per_second"]
+        decay = usage_log.RUN_DECAY
+        self.assertAlmostEqual(slower, (20 * decay + 20) / (10 * decay + 40))
+        self.assertLess(slower, 40 / 50)
+
+    def test_detector_records_calls_and_throughput(self):
+        detector = make_offline_detector(usage_log=self.log, prompt_cache=PromptCache(':memory:'))
+        detector.embedding_model = FakeEncoder()
+        provider = UsageReportingProvider()
+        contexts = [("before", f"chunk{i}", "after") for i in range(6)]
+        detector.generate_prompts(contexts, provider=provider)
+        detector._encode_texts([f"chunk{i}" for i in range(6)])
+        self.assertEqual(detector.llm_calls, 6)
+
+        stats = self.log.stats()
+        (calls,) = stats["calls"]
+        self.assertEqual((calls["provider"], calls["model"], calls["calls"]),
+                         ("openai", "gpt-4o-mini", 6))
+        self.assertEqual(calls["reported_input_tokens"], 6 * 300)
+        self.assertEqual(calls["output_tokens"], 6 * 25)
+        runs = {(r["stage"], r["provider"]): r for r in stats["runs"]}
+        self.assertEqual(runs[("prompts", "openai")]["chunks"], 6)
+        self.assertEqual(runs[("embed", "local")]["chunks"], 6)
+
+        # Prompt cache hits are not LLM calls
+        detector.generate_prompts(contexts, provider=provider)
+        self.assertEqual(detector.llm_calls, 6)
+        self.assertEqual(self.log.stats()["calls"][0]["calls"], 6)
+
+    def test_routed_calls_recorded_under_serving_provider(self):
+        llm_providers._provider_stats.clear()
+        detector = make_offline_detector(usage_log=self.log)
+        router = RouterProvider({'openai': UsageReportingProvider()}, policy='cheapest')
+        detector.generate_prompts([("", f"chunk{i}", "") for i in range(3)], provider=router)
+        (calls,) = self.log.stats()["calls"]
+        self.assertEqual((calls["provider"], calls["model"], calls["calls"]),
+                         ("openai", "gpt-4o-mini", 3))
+        self.assertEqual(calls["reported_input_tokens"], 3 * 300)
+
+    def test_prompt_runs_count_their_own_calls_and_time(self):
+        detector = make_offline_detector(usage_log=self.log)
+        records = []
+        detector.usage_log = Mock(record_run=lambda *args: records.append(args))
+
+        def slow_stream(n):
+            for i in range(n):
+                time.sleep(0.05)  # extraction, not prompt work
+                yield ("", f"chunk{n}-{i}", "")
+
+        # Two concurrent runs on one detector, as analyze_providers does
+        threads = [threading.Thread(target=detector.generate_prompts, args=(slow_stream(n),),
+                                    kwargs={'provider': UsageReportingProvider()})
+                   for n in (3, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(r[3] for r in records), [3, 5])
+        for _, _, _, chunks, seconds in records:
+            # Prompts take at most 20 ms each; the stream takes 50 ms per chunk
+            self.assertLess(seconds, chunks * 0.05)
+        self.assertEqual(detector.llm_calls, 8)
+
+
+class TestStageProfiler(unittest.TestCase):
+    """Test cases for per-stage pipeline profiling and metrics."""
+
+    def test_nested_stages_get_exclusive_time(self):
+        profiler = StageProfiler()
+        with profiler.stage("outer"):
+            time.sleep(0.05)
+            with profiler.stage("inner", items=3):
+                time.sleep(0.1)
+        stages = profiler.report()["stages"]
+        self.assertGreaterEqual(stages["inner"]["wall_s"], 0.09)
+        self.assertGreaterEqual(stages["outer"]["wall_s"], 0.04)
+        self.assertLess(stages["outer"]["wall_s"], 0.09)
+        self.assertEqual((stages["inner"]["calls"], stages["inner"]["items"]), (1, 3))
+
+    def test_iter_charges_upstream_to_its_own_stage(self):
+        upstream = StageProfiler()
+        downstream = StageProfiler()
+
+        def produce():
+            for i in range(4):
+                time.sleep(0.03)
+                yield "x" * i
+
+        with downstream.stage("consume"):
+            items = list(upstream.iter("produce", produce(), size=len))
+        self.assertEqual(items, ["", "x", "xx", "xxx"])
+        produce_stats = upstream.report()["stages"]["produce"]
+        self.assertEqual((produce_stats["calls"], produce_stats["items"], produce_stats["bytes"]),
+                         (1, 4, 6))
+        self.assertGreaterEqual(produce_stats["wall_s"], 0.11)
+        self.assertLess(downstream.report()["stages"]["consume"]["wall_s"], 0.05)
+
+    def test_metrics_render(self):
+        profiler = StageProfiler()
+        with profiler.stage("embed", items=5):
+            pass
+        profiler.count("embed", cache_hits=2, cache_misses=3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Two server workers on one database: either answers with the totals of both
+            path = os.path.join(tmpdir, 'metrics.sqlite')
+            worker_a, worker_b = PipelineMetrics(path), PipelineMetrics(path)
+            worker_a.observe(profiler)
+            worker_b.observe({"wall_s": 20.0, "stages": {"embed": {"wall_s": 1.5, "items": 5}}})
+            text = worker_a.render()
+            self.assertEqual(worker_b.render(), text)
+        self.assertIn('novelty_stage_items_total{stage="embed"} 10', text)
+        self.assertIn('novelty_stage_cache_hits_total{stage="embed"} 2', text)
+        self.assertIn('novelty_document_seconds_bucket{le="1"} 1', text)
+        self.assertIn('novelty_document_seconds_bucket{le="60"} 2', text)
+        self.assertIn("novelty_document_seconds_count 2", text)
+        self.assertIn("# TYPE novelty_stage_seconds_total counter", text)
+
+    def test_pipeline_profile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pdf_path = os.path.join(tmpdir, 'doc.pdf')
+            make_test_pdf(pdf_path, pages=4)
+            profiler = StageProfiler()
+            processor = PDFProcessor(chunk_size=60, overlap=10, profiler=profiler)
+            detector = make_offline_detector(embedding_cache=EmbeddingCache(':memory:'),
+                                             profiler=profiler)
+            detector.embedding_model = FakeEncoder()
+            chunks, scores = detector.analyze_stream(
+                processor.iter_chunk_contexts(processor.stream_chunks(pdf_path, workers=1)), k=2)
+            processor.annotate_pdf(pdf_path, os.path.join(tmpdir, 'out.pdf'), scores, chunks)
+            detector._encode_texts(detector.chunk_prompts)
+
+        report = profiler.report()
+        stages = report["stages"]
+        self.assertEqual(set(stages),
+                         {"extract", "chunk", "prompts", "embed", "index", "score", "annotate"})
+        self.assertEqual(stages["extract"]["items"], 4)
+        self.assertGreater(stages["extract"]["bytes"], 0)
+        self.assertEqual(stages["chunk"]["items"], len(chunks))
+        self.assertEqual(stages["prompts"]["items"], len(chunks))
+        self.assertEqual(stages["score"]["items"], len(chunks))
+        # The second pass over the same prompts is served from the embedding cache
+        self.assertEqual(stages["embed"]["calls"], 2)
+        self.assertEqual(stages["embed"]["cache_hits"], len(chunks))
+        self.assertLessEqual(stages["embed"]["cache_misses"], len(chunks))
+        self.assertLessEqual(sum(s["wall_s"] for s in stages.values()), report["wall_s"] + 0.01)
+        json.dumps(report)
+
+
 def run_tests():
     """Run all tests."""
     # Create test suite
@@ -310,6 +2075,24 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestPDFProcessor))
     suite.addTests(loader.loadTestsFromTestCase(TestNoveltyDetector))
     suite.addTests(loader.loadTestsFromTestCase(TestIntegration))
+    suite.addTests(loader.loadTestsFromTestCase(TestConcurrentPromptGeneration))
+    suite.addTests(loader.loadTestsFromTestCase(TestPromptCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchedScoring))
+    suite.addTests(loader.loadTestsFromTestCase(TestIndexSelection))
+    suite.addTests(loader.loadTestsFromTestCase(TestReferenceCorpus))
+    suite.addTests(loader.loadTestsFromTestCase(TestStreamingExtraction))
+    suite.addTests(loader.loadTestsFromTestCase(TestSpanAnnotation))
+    suite.addTests(loader.loadTestsFromTestCase(TestJobQueue))
+    suite.addTests(loader.loadTestsFromTestCase(TestModelRegistry))
+    suite.addTests(loader.loadTestsFromTestCase(TestMultiProviderComparison))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmbeddingModes))
+    suite.addTests(loader.loadTestsFromTestCase(TestOnnxEmbedder))
+    suite.addTests(loader.loadTestsFromTestCase(TestOllamaClient))
+    suite.addTests(loader.loadTestsFromTestCase(TestProviderRouter))
+    suite.addTests(loader.loadTestsFromTestCase(TestProviderMonitor))
+    suite.addTests(loader.loadTestsFromTestCase(TestCostEstimation))
+    suite.addTests(loader.loadTestsFromTestCase(TestStageProfiler))
 
     # Run tests
     runner = unittest.TextTestRunner(verbosity=2)
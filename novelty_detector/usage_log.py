@@ -0,0 +1,213 @@
+"""
+Recorded LLM usage and stage throughput, used to calibrate cost and time
+estimates (cost_config.estimate_cost / estimate_chunks_cost).
+
+Per provider and model it keeps, for prompt-generation calls: estimated
+input tokens against the tokens the API reported, reply length and call
+latency. Per pipeline stage ('prompts', 'embed') it keeps chunks processed
+against wall time, which captures concurrency and cache hits as they occur
+in real jobs. All sums decay exponentially, so the calibration follows the
+recent past when a model, host or network changes.
+
+Calls are buffered in memory and written when a run is recorded. The
+database is shared by all server workers (WAL mode).
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+from cost_config import PROVIDERS
+
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "usage.sqlite"))
+USAGE_LOG_ENABLED = os.getenv("USAGE_LOG_ENABLED", "1") == "1"
+
+# Weight kept by the old sums on each update: ~200 calls or ~10 runs of memory
+CALL_DECAY = 0.995
+RUN_DECAY = 0.9
+
+CALL_FIELDS = ("calls", "est_input_tokens", "reported_calls", "reported_est_input_tokens",
+               "reported_input_tokens", "output_tokens", "seconds")
+
+
+class UsageLog:
+    """SQLite-backed, exponentially decayed usage aggregates."""
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: SQLite file path (':memory:' for a throwaway log)
+        """
+        self.path = path or USAGE_LOG_PATH
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS calls (
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                {", ".join(f"{f} REAL NOT NULL DEFAULT 0" for f in CALL_FIELDS)},
+                updated REAL NOT NULL,
+                PRIMARY KEY (provider, model)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                stage TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                runs REAL NOT NULL DEFAULT 0,
+                chunks REAL NOT NULL DEFAULT 0,
+                seconds REAL NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (stage, provider, model)
+            )
+        """)
+        self._conn.commit()
+
+    def record_call(self, provider: str, model: Optional[str], est_input_tokens: int,
+                    output_tokens: int, seconds: float,
+                    reported: Optional[Tuple[int, int]] = None):
+        """
+        Buffer one prompt-generation call.
+
+        Args:
+            provider: Provider name
+            model: Model name
+            est_input_tokens: Input tokens as counted by cost_config.count_tokens
+            output_tokens: Reply tokens (as reported by the API if it did, else counted)
+            seconds: Call latency
+            reported: (input, output) tokens reported by the API, if any
+        """
+        with self._lock:
+            entry = self._pending.setdefault((provider, model or ""), dict.fromkeys(CALL_FIELDS, 0))
+            entry["calls"] += 1
+            entry["est_input_tokens"] += est_input_tokens
+            entry["seconds"] += seconds
+            if reported is not None:
+                entry["reported_calls"] += 1
+                entry["reported_est_input_tokens"] += est_input_tokens
+                entry["reported_input_tokens"] += reported[0]
+                entry["output_tokens"] += reported[1]
+            else:
+                entry["output_tokens"] += output_tokens
+
+    def flush(self):
+        """Write buffered calls."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            now = time.time()
+            for (provider, model), entry in pending.items():
+                # Decay once per call folded in, as if they had arrived one by one
+                decay = CALL_DECAY ** entry["calls"]
+                self._conn.execute(
+                    f"INSERT INTO calls (provider, model, {', '.join(CALL_FIELDS)}, updated) "
+                    f"VALUES (?, ?, {', '.join('?' * len(CALL_FIELDS))}, ?) "
+                    f"ON CONFLICT(provider, model) DO UPDATE SET "
+                    + ", ".join(f"{f} = {f} * ? + excluded.{f}" for f in CALL_FIELDS)
+                    + ", updated = excluded.updated",
+                    (provider, model, *(entry[f] for f in CALL_FIELDS), now,
+                     *([decay] * len(CALL_FIELDS))))
+            self._conn.commit()
+
+    def record_run(self, stage: str, provider: str, model: Optional[str],
+                   chunks: int, seconds: float):
+        """Record one pipeline stage run (and write buffered calls)."""
+        self.flush()
+        if chunks <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO runs (stage, provider, model, runs, chunks, seconds, updated) "
+                "VALUES (?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT(stage, provider, model) DO UPDATE SET "
+                "runs = runs * ? + 1, chunks = chunks * ? + excluded.chunks, "
+                "seconds = seconds * ? + excluded.seconds, updated = excluded.updated",
+                (stage, provider, model or "", chunks, seconds, time.time(),
+                 RUN_DECAY, RUN_DECAY, RUN_DECAY))
+            self._conn.commit()
+
+    def _throughput(self, stage: str, provider: str,
+                    model: Optional[str]) -> Tuple[float, Optional[float]]:
+        """(runs, chunks per second) of a stage; all models of the provider if model is None."""
+        query = "SELECT SUM(runs), SUM(chunks), SUM(seconds) FROM runs WHERE stage = ? AND provider = ?"
+        args = [stage, provider]
+        if model is not None:
+            query += " AND model = ?"
+            args.append(model)
+        runs, chunks, seconds = self._conn.execute(query, args).fetchone()
+        return runs or 0.0, (chunks / seconds) if seconds else None
+
+    def calibration(self, llm_provider: str, llm_model: Optional[str] = None,
+                    embedding_provider: Optional[str] = None,
+                    embedding_model: Optional[str] = None) -> Dict:
+        """
+        Corrections for cost_config estimates from recorded usage; None values
+        mean no data (the estimator's defaults apply).
+        """
+        model = llm_model or PROVIDERS.get(llm_provider, {}).get("default_model", "")
+        self.flush()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(CALL_FIELDS)} FROM calls WHERE provider = ? AND model = ?",
+                (llm_provider, model)).fetchone()
+            runs, prompt_rate = self._throughput("prompts", llm_provider, model)
+            embed_runs, embed_rate = (
+                self._throughput("embed", embedding_provider, embedding_model)
+                if embedding_provider else (0.0, None))
+        calls = dict(zip(CALL_FIELDS, row)) if row else dict.fromkeys(CALL_FIELDS, 0.0)
+        n = calls["calls"]
+        return {
+            "calls": round(n, 1),
+            "runs": round(runs + embed_runs, 1),
+            "input_ratio": (calls["reported_input_tokens"] / calls["reported_est_input_tokens"]
+                            if calls["reported_est_input_tokens"] else None),
+            "output_tokens": calls["output_tokens"] / n if n else None,
+            "call_seconds": calls["seconds"] / n if n else None,
+            "prompt_chunks_per_second": prompt_rate,
+            "embed_chunks_per_second": embed_rate,
+        }
+
+    def stats(self) -> Dict:
+        """All recorded aggregates (after writing buffered calls)."""
+        self.flush()
+        with self._lock:
+            calls = [dict(zip(("provider", "model", *CALL_FIELDS), row)) for row in
+                     self._conn.execute(f"SELECT provider, model, {', '.join(CALL_FIELDS)} "
+                                        f"FROM calls ORDER BY provider, model")]
+            runs = [dict(zip(("stage", "provider", "model", "runs", "chunks", "seconds"), row))
+                    for row in self._conn.execute(
+                        "SELECT stage, provider, model, runs, chunks, seconds FROM runs "
+                        "ORDER BY stage, provider, model")]
+        return {"calls": calls, "runs": runs, "path": self.path}
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._conn.execute("DELETE FROM calls")
+            self._conn.execute("DELETE FROM runs")
+            self._conn.commit()
+
+
+_default_log: Optional[UsageLog] = None
+_default_log_lock = threading.Lock()
+
+
+def get_usage_log() -> Optional[UsageLog]:
+    """Process-wide usage log, or None when USAGE_LOG_ENABLED=0."""
+    global _default_log
+    if not USAGE_LOG_ENABLED:
+        return None
+    with _default_log_lock:
+        if _default_log is None:
+            _default_log = UsageLog()
+        return _default_log
@@ -15,30 +15,41 @@ import re
 import json
 import sqlite3
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Optional
 from flask import Blueprint, request, jsonify
 from sentence_transformers import SentenceTransformer
 import faiss
 
 from pdf_processor import PDFProcessor
-from llm_providers import discover_providers, LLMProvider
+from llm_providers import discover_providers, LLMProvider, RouterProvider
+from provider_monitor import get_provider_monitor
+from model_registry import LockedModel, get_model_registry
+from embedding_cache import get_embedding_cache, encode_with_cache, EMBED_BATCH_SIZES
 
 validator_bp = Blueprint('validator', __name__, url_prefix='/api/validator')
 
-# Embedding models are cached per model name (the question bank may have been
-# embedded with a different model than the current default — see match_questions).
-_embed_models: Dict[str, SentenceTransformer] = {}
-
 
 def default_embedding_model() -> str:
     return os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 
 
-def get_embed_model(model_name: Optional[str] = None) -> SentenceTransformer:
+# Embedding models are pooled per model name in the shared model registry (the
+# question bank may have been embedded with a different model than the current
+# default — see match_questions).
+def get_embed_model(model_name: Optional[str] = None) -> LockedModel:
+    name = model_name or default_embedding_model()
+    return get_model_registry().embedding_model("local", name, lambda: SentenceTransformer(name))
+
+
+def embed_texts(texts: List[str], model_name: Optional[str] = None) -> np.ndarray:
+    """Embed texts with a local model, reusing vectors from the shared embedding cache."""
     name = model_name or default_embedding_model()
-    if name not in _embed_models:
-        _embed_models[name] = SentenceTransformer(name)
-    return _embed_models[name]
+    model = get_embed_model(name)
+    batch_size = EMBED_BATCH_SIZES["local"]
+    return encode_with_cache(
+        texts, f"local:{name}",
+        lambda batch: model.encode(batch, batch_size=batch_size, show_progress_bar=False),
+        cache=get_embedding_cache(), batch_size=batch_size)
 
 
 def get_db_path() -> str:
@@ -53,22 +64,34 @@ def get_llm_provider() -> LLMProvider:
     never leaves the server. Cloud providers are only used when the operator
     explicitly opts in with VALIDATOR_ALLOW_CLOUD=1, because generation feeds
     student work to the model. The keyword 'fallback' is always last resort.
+
+    With cloud allowed, a RouterProvider picks per call by
+    VALIDATOR_ROUTER_POLICY (default 'quality': highest tier first, the old
+    static order) and fails over past providers that error or are circuit-open.
+    Providers the background monitor last found down are skipped.
     """
-    providers = discover_providers()
+    providers = discover_providers(registry=get_model_registry())
     allow_cloud = os.getenv("VALIDATOR_ALLOW_CLOUD", "0") == "1"
 
-    if allow_cloud:
-        order = ["anthropic", "openai", "google", "ollama", "fallback"]
-    else:
-        order = ["ollama", "fallback"]
-
     # An explicit override always wins (e.g. VALIDATOR_LLM_PROVIDER=anthropic).
     forced = os.getenv("VALIDATOR_LLM_PROVIDER", "").strip().lower()
     if forced and forced in providers:
         return providers[forced]
 
+    # Up/down from the background provider monitor (no network I/O here)
+    monitor = get_provider_monitor()
+    if allow_cloud:
+        routable = {name: p for name, p in providers.items() if name != "fallback"}
+        if len(routable) > 1:
+            return RouterProvider(routable,
+                                  policy=os.getenv("VALIDATOR_ROUTER_POLICY", "quality"),
+                                  health=monitor.is_up)
+        order = ["anthropic", "openai", "google", "ollama", "fallback"]
+    else:
+        order = ["ollama", "fallback"]
+
     for name in order:
-        if name in providers:
+        if name in providers and (name == "fallback" or monitor.is_up(name)):
             return providers[name]
     return providers.get("fallback", list(providers.values())[0])
 
@@ -210,7 +233,6 @@ def match_questions():
     # otherwise vector dimensions/geometry differ. Use the model recorded on the
     # stored embeddings (assume consistent across a course's bank).
     bank_model_name = bank_rows[0]['embedding_model'] or default_embedding_model()
-    model = get_embed_model(bank_model_name)
 
     # Build FAISS index from question bank embeddings
     bank_embeddings = []
@@ -246,7 +268,7 @@ def match_questions():
 
     # Embed submission chunks (same model as the bank)
     chunk_texts = [c['text'] for c in chunks]
-    chunk_embeddings = np.asarray(model.encode(chunk_texts), dtype='float32')
+    chunk_embeddings = embed_texts(chunk_texts, bank_model_name)
     chunk_norms = np.linalg.norm(chunk_embeddings, axis=1, keepdims=True)
     chunk_norms[chunk_norms == 0] = 1
     chunk_embeddings = chunk_embeddings / chunk_norms
@@ -513,7 +535,6 @@ def embed_question_bank():
     expand = bool(data.get('expand', os.getenv('VALIDATOR_EXPAND_TOPICS', '0') == '1'))
 
     model_name = default_embedding_model()
-    model = get_embed_model(model_name)
     db_path = get_db_path()
 
     conn = sqlite3.connect(db_path)
@@ -544,7 +565,7 @@ def embed_question_bank():
         expanded = expand_question_topic(provider, row['question_text'], row['options']) if provider else None
         texts.append(_embedding_text_for_question(row['question_text'], row['options'], expanded))
 
-    embeddings = model.encode(texts)
+    embeddings = embed_texts(texts, model_name)
 
     if force:
         # Replace existing vectors for these questions.
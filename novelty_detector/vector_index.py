@@ -0,0 +1,138 @@
+"""
+FAISS index selection for novelty scoring.
+
+A single paper is small enough for an exact IndexFlatIP, but scoring against a
+course corpus of hundreds of thousands of chunks is not. create_index() picks
+the index by corpus size:
+
+  flat   exact inner product                          n <= INDEX_FLAT_MAX
+  hnsw   HNSW graph over full vectors                 n <= INDEX_HNSW_MAX
+  ivfpq  inverted lists + product quantisation,       larger corpora
+         re-ranked against 8-bit scalar-quantised vectors
+
+All indexes use inner product over L2-normalised vectors (cosine similarity).
+Parameters can be set through the environment or per call; see
+bench_scoring.py --index-sweep for the recall/latency trade-off of each.
+"""
+
+import os
+import logging
+from typing import Optional
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivfpq")
+
+INDEX_TYPE = os.getenv("NOVELTY_INDEX_TYPE", "auto")
+INDEX_FLAT_MAX = int(os.getenv("NOVELTY_INDEX_FLAT_MAX", 50_000))
+INDEX_HNSW_MAX = int(os.getenv("NOVELTY_INDEX_HNSW_MAX", 2_000_000))
+
+HNSW_M = int(os.getenv("NOVELTY_HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("NOVELTY_HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.getenv("NOVELTY_HNSW_EF_SEARCH", 64))
+
+IVF_NLIST = int(os.getenv("NOVELTY_IVF_NLIST", 0))  # 0 = 4 * sqrt(n)
+IVF_NPROBE = int(os.getenv("NOVELTY_IVF_NPROBE", 16))
+PQ_M = int(os.getenv("NOVELTY_PQ_M", 0))  # 0 = one sub-quantiser per 4 dimensions
+PQ_NBITS = 8
+# PQ candidates re-scored per requested neighbour (0 = no re-ranking). PQ alone
+# loses too much precision to rank near-identical chunks; the SQ8 re-ranking
+# copy costs dim bytes per vector.
+IVF_REFINE_FACTOR = int(os.getenv("NOVELTY_IVF_REFINE_FACTOR", 8))
+# Training points per IVF centroid; faiss warns below 39
+IVF_TRAIN_PER_LIST = 64
+IVF_MIN_TRAIN_PER_LIST = 39
+
+
+def choose_index_type(n: int, index_type: Optional[str] = None) -> str:
+    """Resolve 'auto' (or None) to a concrete index type for n vectors."""
+    index_type = index_type or INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from {INDEX_TYPES}")
+    if index_type != "auto":
+        return index_type
+    if n <= INDEX_FLAT_MAX:
+        return "flat"
+    if n <= INDEX_HNSW_MAX:
+        return "hnsw"
+    return "ivfpq"
+
+
+def _pq_m(dim: int) -> int:
+    """Number of PQ sub-quantisers: must divide dim."""
+    m = PQ_M or max(1, dim // 4)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def create_index(embeddings: np.ndarray, index_type: Optional[str] = None,
+                 nlist: Optional[int] = None, nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None, hnsw_m: Optional[int] = None,
+                 seed: int = 0) -> faiss.Index:
+    """
+    Build (and train, if needed) an inner-product index over normalised embeddings.
+
+    Args:
+        embeddings: (n, dim) float32 L2-normalised vectors
+        index_type: 'auto', 'flat', 'hnsw' or 'ivfpq' (default: NOVELTY_INDEX_TYPE)
+        nlist: IVF lists (default: NOVELTY_IVF_NLIST or 4 * sqrt(n))
+        nprobe: IVF lists visited per query
+        ef_search: HNSW search beam width
+        hnsw_m: HNSW graph degree
+        seed: Seed for the IVF training sample
+
+    Returns:
+        faiss index containing all embeddings, in row order
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    n, dim = embeddings.shape
+    kind = choose_index_type(n, index_type)
+
+    if kind == "ivfpq":
+        nlist = nlist or IVF_NLIST or max(1, int(4 * np.sqrt(n)))
+        min_train = max(nlist, 2 ** PQ_NBITS) * IVF_MIN_TRAIN_PER_LIST
+        if n < min_train:
+            logger.warning(f"{n} vectors is too few to train IVF-PQ "
+                           f"(nlist={nlist}, need ~{min_train}); using a flat index")
+            kind = "flat"
+
+    if kind == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m or HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    else:
+        quantizer = faiss.IndexFlatIP(dim)
+        ivf = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim), PQ_NBITS,
+                               faiss.METRIC_INNER_PRODUCT)
+        ivf.nprobe = nprobe or IVF_NPROBE
+        index = ivf
+        if IVF_REFINE_FACTOR > 0:
+            refine = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit,
+                                                faiss.METRIC_INNER_PRODUCT)
+            index = faiss.IndexRefine(ivf, refine)
+            index.k_factor = IVF_REFINE_FACTOR
+        train_size = min(n, max(nlist, 2 ** PQ_NBITS) * IVF_TRAIN_PER_LIST)
+        sample = np.random.default_rng(seed).choice(n, train_size, replace=False)
+        index.train(embeddings[np.sort(sample)])
+
+    index.add(embeddings)
+    logger.info(f"Built {kind} FAISS index with {index.ntotal} vectors")
+    return index
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None):
+    """Adjust query-time accuracy knobs on an existing index."""
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass  # not an IVF index
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search